@@ -0,0 +1,173 @@
+import logging
+import threading
+import time
+from typing import List, Optional, Sequence
+
+from web3 import Web3
+from web3.exceptions import ProviderConnectionError
+
+logger = logging.getLogger("reefershield")
+
+# Errors that mean "this endpoint is unreachable", as opposed to the node
+# rejecting the request. requests' connection/timeout/HTTP errors are OSErrors.
+RPC_CONNECTION_ERRORS = (OSError, ProviderConnectionError)
+# geth/bor/anvil wording, and eth-tester's for local dev chains
+NONCE_TOO_LOW = ("nonce too low", "invalid transaction nonce")
+
+
+def leaf_hash(cid: str) -> bytes:
+    return bytes(Web3.keccak(text=cid))
+
+
+def _hash_pair(a: bytes, b: bytes) -> bytes:
+    # Sorted pairs, so a proof is just the sibling list (OpenZeppelin MerkleProof layout)
+    return bytes(Web3.keccak(a + b if a <= b else b + a))
+
+
+class MerkleTree:
+    """Keccak Merkle tree over certificate leaves; an odd node is promoted as is."""
+
+    def __init__(self, leaves: Sequence[bytes]):
+        if not leaves:
+            raise ValueError("Merkle tree needs at least one leaf")
+        self.levels: List[List[bytes]] = [list(leaves)]
+        while len(self.levels[-1]) > 1:
+            level = self.levels[-1]
+            nxt = [_hash_pair(level[i], level[i + 1]) for i in range(0, len(level) - 1, 2)]
+            if len(level) % 2:
+                nxt.append(level[-1])
+            self.levels.append(nxt)
+
+    @property
+    def root(self) -> bytes:
+        return self.levels[-1][0]
+
+    def proof(self, index: int) -> List[bytes]:
+        siblings = []
+        for level in self.levels[:-1]:
+            sibling = index ^ 1
+            if sibling < len(level):
+                siblings.append(level[sibling])
+            index //= 2
+        return siblings
+
+
+def verify_proof(leaf: bytes, proof: Sequence[bytes], root: bytes) -> bool:
+    node = leaf
+    for sibling in proof:
+        node = _hash_pair(node, sibling)
+    return node == root
+
+
+class RpcPool:
+    """Ordered Web3 endpoints; calls go to the first healthy one.
+
+    An endpoint that fails with a connection error is skipped for
+    `cooldown_s` before it is tried again, so the primary is retried once it
+    recovers. Errors returned by a reachable node are not failed over.
+    """
+
+    def __init__(self, endpoints: Sequence[Web3], cooldown_s: float = 30.0):
+        if not endpoints:
+            raise ValueError("RpcPool needs at least one endpoint")
+        self.endpoints = list(endpoints)
+        self.cooldown_s = cooldown_s
+        self._down_until = [0.0] * len(self.endpoints)
+        self.failovers = 0
+
+    def call(self, fn):
+        now = time.monotonic()
+        # Healthy endpoints first, in configured order; cooling-down ones as a last resort
+        order = sorted(range(len(self.endpoints)), key=lambda i: (self._down_until[i] > now, i))
+        last_error = None
+        for n, i in enumerate(order):
+            try:
+                result = fn(self.endpoints[i])
+            except RPC_CONNECTION_ERRORS as e:
+                last_error = e
+                self._down_until[i] = time.monotonic() + self.cooldown_s
+                logger.warning("Polygon RPC endpoint %d unreachable: %s", i, e)
+                continue
+            if n:
+                self.failovers += 1
+            return result
+        raise last_error
+
+
+class NonceManager:
+    """Hands out sequential nonces for one account without asking the node each time.
+
+    The counter is seeded from the pending transaction count and re-seeded
+    after `reset()` (a rejected or unsent transaction leaves a gap otherwise).
+    """
+
+    def __init__(self, address: str):
+        self.address = address
+        self._next: Optional[int] = None
+        self._lock = threading.Lock()
+
+    def reserve(self, rpc: RpcPool) -> int:
+        with self._lock:
+            if self._next is None:
+                self._next = rpc.call(lambda w3: w3.eth.get_transaction_count(self.address, "pending"))
+            nonce = self._next
+            self._next += 1
+            return nonce
+
+    def reset(self):
+        with self._lock:
+            self._next = None
+
+
+class PolygonAnchor:
+    """Signs and sends one transaction per Merkle root, carrying the root as calldata."""
+
+    def __init__(self, rpc: RpcPool, private_key: str, chain_id: int, contract_address: str,
+                 gas_limit: int = 200000, gas_price_ttl: float = 30.0):
+        self.rpc = rpc
+        self.account = Web3().eth.account.from_key(private_key)
+        self.chain_id = chain_id
+        self.contract_address = Web3.to_checksum_address(contract_address)
+        self.gas_limit = gas_limit
+        self.gas_price_ttl = gas_price_ttl
+        self.nonces = NonceManager(self.account.address)
+        self._gas_price = (0, 0.0)
+        self.sent = 0
+
+    def gas_price(self) -> int:
+        price, fetched_at = self._gas_price
+        if not price or time.monotonic() - fetched_at >= self.gas_price_ttl:
+            price = self.rpc.call(lambda w3: w3.eth.gas_price)
+            self._gas_price = (price, time.monotonic())
+        return price
+
+    def anchor_root(self, root: bytes) -> str:
+        """Blocking; returns the transaction hash as 0x-hex."""
+        for attempt in range(2):
+            signed = self.account.sign_transaction({
+                "chainId": self.chain_id,
+                "nonce": self.nonces.reserve(self.rpc),
+                "to": self.contract_address,
+                "value": 0,
+                "gas": self.gas_limit,
+                "gasPrice": self.gas_price(),
+                "data": root,
+            })
+            try:
+                self.rpc.call(lambda w3: w3.eth.send_raw_transaction(signed.raw_transaction))
+            except Exception as e:
+                message = str(e).lower()
+                # Primary took it but the response was lost; the fallback already has it
+                if "already known" in message:
+                    break
+                self.nonces.reset()
+                if any(m in message for m in NONCE_TOO_LOW) and not attempt:
+                    logger.warning("Anchor nonce out of sync, resyncing: %s", e)
+                    continue
+                raise
+            break
+        self.sent += 1
+        return Web3.to_hex(signed.hash)
+
+    def stats(self) -> dict:
+        return {"sent": self.sent, "failovers": self.rpc.failovers}
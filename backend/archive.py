@@ -0,0 +1,461 @@
+"""Raw webhook payloads in Parquet/zstd segments, partitioned by user/truck/day.
+
+With RAW_ARCHIVE_URI set, reefer_events keeps a `raw_ref` pointer
+("user_id=U/truck_id=T/day=D/<segment>.parquet#<row>") instead of the
+payload. Segments are immutable and named after the time they were opened,
+so a certificate can commit to "every payload in segments opened before
+the trip closed" and that set never changes afterwards.
+
+Offline check of a certificate against its archive:
+
+    python archive.py verify certificate.pdf --archive /var/lib/reefershield/raw [--cid bafy...]
+"""
+import argparse
+import asyncio
+import base64
+import hashlib
+import heapq
+import json
+import logging
+import os
+import re
+import sys
+import time
+import uuid
+import zlib
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from metrics import EXTERNAL_ERRORS
+
+logger = logging.getLogger("reefershield")
+
+# pyarrow is only needed with RAW_ARCHIVE_URI set and takes a while to import,
+# so it is loaded by the first RawArchive/ArchiveReader (see _load_pyarrow)
+pa = pc = pq = pafs = None
+SEGMENT_SCHEMA = None
+
+Partition = Tuple[str, str, str]  # (user_id, truck_id, day)
+
+
+def canonical_json(payload: dict) -> str:
+    return json.dumps(payload, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+
+
+def parse_time(value: str) -> datetime:
+    return datetime.fromisoformat(value.replace("Z", "+00:00")).astimezone(timezone.utc)
+
+
+def partition_dir(user_id: str, truck_id: str, day: str) -> str:
+    return f"user_id={user_id}/truck_id={truck_id}/day={day}"
+
+
+def segment_opened_at(name: str) -> float:
+    """Unix time a segment was opened, from its "<ms>-<id>.parquet" file name."""
+    return int(name.rsplit("/", 1)[-1].split("-", 1)[0]) / 1000
+
+
+@dataclass
+class _Segment:
+    name: str
+    opened: float
+    times: List[datetime] = field(default_factory=list)
+    providers: List[str] = field(default_factory=list)
+    payloads: List[str] = field(default_factory=list)
+
+
+def _load_pyarrow():
+    global pa, pc, pq, pafs, SEGMENT_SCHEMA
+    if pa is not None:
+        return
+    try:
+        import pyarrow
+        import pyarrow.compute
+        import pyarrow.parquet
+        from pyarrow import fs
+    except ImportError:
+        raise RuntimeError("The raw payload archive needs pyarrow (pip install pyarrow)")
+    pc, pq, pafs = pyarrow.compute, pyarrow.parquet, fs
+    SEGMENT_SCHEMA = pyarrow.schema([
+        ("occurred_at", pyarrow.timestamp("us", tz="UTC")),
+        ("provider", pyarrow.string()),
+        ("payload", pyarrow.string()),  # canonical JSON, the exact bytes the trip digest covers
+    ])
+    pa = pyarrow
+
+
+def _filesystem(uri: str):
+    _load_pyarrow()
+    filesystem, root = pafs.FileSystem.from_uri(uri)
+    return filesystem, root.rstrip("/")
+
+
+class RawArchive:
+    """Buffers raw payloads per partition and writes each as a Parquet segment.
+
+    A segment is written once it holds `segment_rows` payloads or was opened
+    `segment_seconds` ago, so every payload is on storage within that long.
+    `add` returns the pointer straight away; it resolves once the segment is
+    written.
+
+    Rows point at a segment before it is written, so a failed write is never
+    given up: it is retried with backoff (capped at `retry_max_seconds`),
+    and after `spill_after` failures the segment is also saved under
+    `spill_dir`. Spilled segments are uploaded by the next `start()` if the
+    process stops first.
+    """
+
+    def __init__(self, uri: str, segment_rows: int = 10000, segment_seconds: float = 300.0,
+                 compression_level: int = 3, spill_dir: Optional[str] = None, spill_after: int = 3,
+                 retry_max_seconds: float = 60.0):
+        self.fs, self.root = _filesystem(uri)
+        self._local = isinstance(self.fs, pafs.LocalFileSystem)
+        self.segment_rows = segment_rows
+        self.segment_seconds = segment_seconds
+        self.compression_level = compression_level
+        self.spill_dir = spill_dir.rstrip("/") if spill_dir else None
+        self.spill_after = spill_after
+        self.retry_max_seconds = retry_max_seconds
+        self._open: Dict[Partition, _Segment] = {}
+        self._writing: Dict[str, float] = {}  # segment name -> opened
+        self._write_tasks: set = set()
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = asyncio.Event()
+        self.archived = 0
+        self.segments_written = 0
+        self.bytes_written = 0
+        self.write_errors = 0
+        self.segments_spilled = 0
+
+    def add(self, user_id: str, truck_id: str, occurred_at: str, provider: str, payload: dict) -> str:
+        at = parse_time(occurred_at)
+        key = (user_id, truck_id, at.date().isoformat())
+        segment = self._open.get(key)
+        if segment is None:
+            now = time.time()
+            name = f"{partition_dir(*key)}/{int(now * 1000):013d}-{uuid.uuid4().hex[:12]}.parquet"
+            segment = self._open[key] = _Segment(name, now)
+        ref = f"{segment.name}#{len(segment.payloads)}"
+        segment.times.append(at)
+        segment.providers.append(provider)
+        segment.payloads.append(canonical_json(payload))
+        self.archived += 1
+        if len(segment.payloads) >= self.segment_rows:
+            self._seal(key)
+        return ref
+
+    def _seal(self, key: Partition):
+        segment = self._open.pop(key)
+        self._writing[segment.name] = segment.opened
+        table = pa.table([segment.times, segment.providers, segment.payloads], schema=SEGMENT_SCHEMA)
+        self._spawn_write(segment.name, table)
+
+    def _spawn_write(self, name: str, table: "pa.Table", spilled: bool = False):
+        # The loop only keeps weak references to tasks; hold on to it until the write lands
+        task = asyncio.get_running_loop().create_task(self._write(name, table, spilled))
+        self._write_tasks.add(task)
+        task.add_done_callback(self._write_tasks.discard)
+        task.add_done_callback(lambda t: self._writing.pop(name, None))
+
+    async def _write(self, name: str, table: "pa.Table", spilled: bool = False):
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                size = await asyncio.to_thread(self._write_table, name, table)
+                break
+            except Exception as e:
+                self.write_errors += 1
+                EXTERNAL_ERRORS.inc(provider="archive")
+                logger.error("Archive segment %s write failed (attempt %d): %s", name, attempt, e)
+            if self.spill_dir and not spilled and (attempt >= self.spill_after or self._stopping.is_set()):
+                spilled = await asyncio.to_thread(self._spill, name, table)
+            if spilled and self._stopping.is_set():
+                logger.warning("Archive segment %s left in %s for the next start", name, self.spill_dir)
+                return
+            delay = min(self.retry_max_seconds, 2 ** (attempt - 1))
+            if self._stopping.is_set():
+                await asyncio.sleep(delay)  # nowhere to spill: keep trying until it lands
+                continue
+            try:
+                # stop() cuts the wait short so a failing write is spilled straight away
+                await asyncio.wait_for(self._stopping.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+        self.segments_written += 1
+        self.bytes_written += size
+        if spilled:
+            await asyncio.to_thread(self._unspill, name)
+
+    def _spill(self, name: str, table: "pa.Table") -> bool:
+        path = f"{self.spill_dir}/{name}"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            pq.write_table(table, path + ".tmp", compression="zstd", compression_level=self.compression_level)
+            os.replace(path + ".tmp", path)
+        except OSError as e:
+            logger.error("Spilling archive segment %s to %s failed: %s", name, self.spill_dir, e)
+            return False
+        self.segments_spilled += 1
+        return True
+
+    def _unspill(self, name: str):
+        try:
+            os.remove(f"{self.spill_dir}/{name}")
+        except OSError as e:
+            logger.warning("Could not remove spilled archive segment %s: %s", name, e)
+
+    def _spilled(self) -> List[str]:
+        if not self.spill_dir or not os.path.isdir(self.spill_dir):
+            return []
+        return sorted(os.path.relpath(os.path.join(directory, f), self.spill_dir)
+                      for directory, _, files in os.walk(self.spill_dir) for f in files if f.endswith(".parquet"))
+
+    def unwritten(self, truck_id: str, opened_before: float) -> int:
+        """Segments of a truck opened before `opened_before` that are not on storage yet."""
+        return sum(1 for name, opened in self._writing.items()
+                   if opened < opened_before and f"/truck_id={truck_id}/" in f"/{name}")
+
+    def _write_table(self, name: str, table: "pa.Table") -> int:
+        path = f"{self.root}/{name}"
+        self.fs.create_dir(path.rsplit("/", 1)[0], recursive=True)
+        # Object stores publish on close; on local disk write aside and rename
+        target = path + ".tmp" if self._local else path
+        pq.write_table(table, target, filesystem=self.fs, compression="zstd",
+                       compression_level=self.compression_level)
+        if self._local:
+            self.fs.move(target, path)
+        return self.fs.get_file_info(path).size
+
+    async def flush(self, truck_id: Optional[str] = None, max_age: Optional[float] = None):
+        """Seal open segments (of one truck, or older than `max_age`); their writes run in the background."""
+        now = time.time()
+        for key in [key for key, segment in self._open.items()
+                    if (truck_id is None or key[1] == truck_id)
+                    and (max_age is None or now - segment.opened >= max_age)]:
+            self._seal(key)
+
+    def start(self):
+        self._stopping.clear()
+        for name in self._spilled():
+            if name in self._writing:
+                continue
+            logger.info("Uploading spilled archive segment %s", name)
+            self._writing[name] = segment_opened_at(name)
+            self._spawn_write(name, pq.read_table(f"{self.spill_dir}/{name}"), spilled=True)
+        self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
+        # Writes still failing are spilled and picked up again by the next start()
+        self._stopping.set()
+        if self._write_tasks:
+            await asyncio.gather(*self._write_tasks)
+
+    async def _loop(self):
+        interval = min(5.0, self.segment_seconds / 4)
+        while True:
+            await asyncio.sleep(interval)
+            # Seal early enough that the write lands within segment_seconds of opening
+            await self.flush(max_age=self.segment_seconds - 2 * interval)
+
+    def stats(self) -> dict:
+        return {
+            "open_segments": len(self._open),
+            "buffered": sum(len(s.payloads) for s in self._open.values()),
+            "archived": self.archived,
+            "segments_written": self.segments_written,
+            "bytes_written": self.bytes_written,
+            "write_errors": self.write_errors,
+            "writing": len(self._writing),
+            "spilled": self.segments_spilled,
+        }
+
+
+class ArchiveReader:
+    """Reads segments back; local segments are memory-mapped."""
+
+    def __init__(self, uri: str):
+        self.fs, self.root = _filesystem(uri)
+        self._local = isinstance(self.fs, pafs.LocalFileSystem)
+
+    def read_segment(self, name: str, filters=None) -> "pa.Table":
+        path = f"{self.root}/{name}"
+        if self._local:
+            return pq.read_table(path, memory_map=True, filters=filters)
+        return pq.read_table(path, filesystem=self.fs, filters=filters)
+
+    def resolve(self, ref: str) -> dict:
+        """The payload behind a reefer_events.raw_ref pointer."""
+        name, row = ref.rsplit("#", 1)
+        return json.loads(self.read_segment(name).column("payload")[int(row)].as_py())
+
+    def _list(self, path: str, recursive: bool = False):
+        return self.fs.get_file_info(pafs.FileSelector(f"{self.root}/{path}".rstrip("/"),
+                                                       allow_not_found=True, recursive=recursive))
+
+    def segments(self, truck_id: str, start: datetime, end: datetime, user_id: Optional[str] = None,
+                 opened_before: Optional[datetime] = None) -> List[str]:
+        """Segment names for a truck whose day partition overlaps [start, end]."""
+        if user_id:
+            users = [user_id]
+        else:
+            users = [info.base_name.split("=", 1)[1] for info in self._list("")
+                     if info.type == pafs.FileType.Directory and info.base_name.startswith("user_id=")]
+        names = []
+        day = start.date()
+        while day <= end.date():
+            for user in users:
+                for info in self._list(partition_dir(user, truck_id, day.isoformat())):
+                    if info.type != pafs.FileType.File or not info.base_name.endswith(".parquet"):
+                        continue
+                    name = info.path[len(self.root) + 1:]
+                    if opened_before and segment_opened_at(name) > opened_before.timestamp():
+                        continue
+                    names.append(name)
+            day += timedelta(days=1)
+        return sorted(names)
+
+    def _earliest(self, name: str, default: datetime) -> datetime:
+        """Lower bound on a segment's occurred_at, from the Parquet footer statistics."""
+        path = f"{self.root}/{name}"
+        metadata = pq.read_metadata(path) if self._local else pq.read_metadata(path, filesystem=self.fs)
+        earliest = None
+        for i in range(metadata.num_row_groups):
+            stats = metadata.row_group(i).column(0).statistics
+            if stats is None or not stats.has_min_max:
+                return default
+            low = stats.min if stats.min.tzinfo else stats.min.replace(tzinfo=timezone.utc)
+            earliest = low if earliest is None else min(earliest, low)
+        return earliest or default
+
+    def _sorted_rows(self, name: str, filters) -> Iterator[Tuple[datetime, str]]:
+        table = self.read_segment(name, filters).select(["occurred_at", "payload"])
+        table = table.take(pc.sort_indices(table, [("occurred_at", "ascending"), ("payload", "ascending")]))
+        for batch in table.to_batches(max_chunksize=1024):
+            yield from zip(batch.column(0).to_pylist(), batch.column(1).to_pylist())
+
+    def iter_trip(self, truck_id: str, start: datetime, end: datetime, user_id: Optional[str] = None,
+                  opened_before: Optional[datetime] = None) -> Iterator[Tuple[datetime, str]]:
+        """(occurred_at, canonical payload) for the window, in digest order."""
+        filters = [("occurred_at", ">=", pa.scalar(start, SEGMENT_SCHEMA.field("occurred_at").type)),
+                   ("occurred_at", "<=", pa.scalar(end, SEGMENT_SCHEMA.field("occurred_at").type))]
+        # Arrival order differs between processes and retries; the digest doesn't.
+        # Segments only overlap around late payloads, so they are opened in order
+        # of their earliest reading and merged: rows below the next segment's
+        # earliest are final, and only the segments still in play are held.
+        segments = sorted((self._earliest(name, start), name)
+                          for name in self.segments(truck_id, start, end, user_id, opened_before))
+        heap = []  # (occurred_at, payload, segment index, rest of the segment)
+        previous = None
+        for index in range(len(segments) + 1):
+            bound = segments[index][0] if index < len(segments) else None
+            while heap and (bound is None or heap[0][0] < bound):
+                at, payload, k, rows = heap[0]
+                # A redelivered payload archived by another process counts once
+                if (at, payload) != previous:
+                    yield at, payload
+                previous = at, payload
+                following = next(rows, None)
+                if following is None:
+                    heapq.heappop(heap)
+                else:
+                    heapq.heapreplace(heap, (*following, k, rows))
+            if bound is not None:
+                rows = self._sorted_rows(segments[index][1], filters)
+                first = next(rows, None)
+                if first is not None:
+                    heapq.heappush(heap, (*first, index, rows))
+
+    def trip_digest(self, truck_id: str, start: datetime, end: datetime, user_id: Optional[str] = None,
+                    opened_before: Optional[datetime] = None) -> Tuple[str, int]:
+        """SHA-256 over "<occurred_at µs>\\t<payload>\\n" lines, and the payload count."""
+        digest = hashlib.sha256()
+        count = 0
+        for at, payload in self.iter_trip(truck_id, start, end, user_id, opened_before):
+            digest.update(f"{int(at.timestamp() * 1_000_000)}\t{payload}\n".encode())
+            count += 1
+        return digest.hexdigest(), count
+
+
+def archive_lines(sha256: str, count: int, cutoff: datetime) -> List[str]:
+    """Certificate header lines committing to the trip's archived payloads."""
+    return [
+        f"Raw data SHA-256: {sha256}",
+        f"Raw payloads: {count} archived by {cutoff.isoformat()}",
+    ]
+
+
+def _pdf_text(pdf: bytes) -> str:
+    """Content streams of a ReportLab PDF (ASCII85 + Flate, or uncompressed)."""
+    chunks = []
+    for match in re.finditer(rb"<<([^>]*)>>\s*stream\r?\n(.*?)\s*endstream", pdf, re.S):
+        filters, data = match.groups()
+        if b"/ASCII85Decode" in filters:
+            data = base64.a85decode(data.strip(), adobe=data.strip().endswith(b"~>"))
+        if b"/FlateDecode" in filters:
+            data = zlib.decompress(data)
+        chunks.append(data.decode("latin-1"))
+    return "\n".join(chunks)
+
+
+def certificate_claims(pdf: bytes) -> dict:
+    text = _pdf_text(pdf)
+    claims = {}
+    for key, pattern in (("truck_id", r"Truck ID: ([^)]+)\)"), ("started", r"Started: ([^)]+)\)"),
+                         ("completed", r"Completed: ([^)]+)\)"), ("sha256", r"Raw data SHA-256: ([0-9a-f]{64})"),
+                         ("count", r"Raw payloads: (\d+) archived by"), ("cutoff", r"archived by ([^)]+)\)")):
+        match = re.search(pattern, text)
+        if match:
+            claims[key] = match.group(1)
+    return claims
+
+
+def verify_certificate(pdf: bytes, reader: ArchiveReader, cid: Optional[str] = None) -> Tuple[bool, List[str]]:
+    claims = certificate_claims(pdf)
+    missing = [k for k in ("truck_id", "started", "completed", "sha256", "cutoff") if k not in claims]
+    if missing:
+        return False, [f"certificate has no {', '.join(missing)}; was it issued with RAW_ARCHIVE_URI set?"]
+    notes = []
+    ok = True
+    if cid:
+        from ipfs import pack_car
+        local_cid, _ = pack_car(pdf)
+        if local_cid != cid:
+            ok = False
+        notes.append(f"PDF CID {local_cid} {'matches' if local_cid == cid else 'does not match'} {cid}")
+    sha256, count = reader.trip_digest(claims["truck_id"], parse_time(claims["started"]),
+                                       parse_time(claims["completed"]), opened_before=parse_time(claims["cutoff"]))
+    if sha256 != claims["sha256"]:
+        ok = False
+    notes.append(f"archive digest {sha256} over {count} payloads "
+                 f"{'matches' if sha256 == claims['sha256'] else 'does not match'} certificate "
+                 f"({claims['sha256']}, {claims.get('count')} payloads)")
+    return ok, notes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    sub = parser.add_subparsers(dest="command", required=True)
+    verify = sub.add_parser("verify", help="check a certificate PDF against the raw archive")
+    verify.add_argument("pdf")
+    verify.add_argument("--archive", required=True, help="archive URI or local path (RAW_ARCHIVE_URI)")
+    verify.add_argument("--cid", help="IPFS CID the certificate was anchored under")
+    args = parser.parse_args()
+
+    with open(args.pdf, "rb") as f:
+        pdf = f.read()
+    ok, notes = verify_certificate(pdf, ArchiveReader(args.archive), args.cid)
+    for note in notes:
+        print(note)
+    print("OK" if ok else "FAIL")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""Batch anchoring against a local dev chain.
+
+    python benchmarks/anchor_devchain.py                      # in-process eth-tester (pip install "eth-tester[py-evm]")
+    python benchmarks/anchor_devchain.py --rpc http://127.0.0.1:8545 --private-key 0xac09...  # anvil
+
+Sends --batches Merkle-root transactions of --batch-size CIDs each, through
+an RpcPool whose primary endpoint is down so every call exercises failover.
+Checks that nonces are consecutive, every receipt succeeded, each tx carries
+its batch root and every inclusion proof verifies. Exits non-zero on any
+mismatch, then prints gas per certificate against one transaction each.
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from web3 import EthereumTesterProvider, HTTPProvider, Web3
+
+from anchoring import MerkleTree, PolygonAnchor, RpcPool, leaf_hash, verify_proof
+
+DEAD_RPC = "http://127.0.0.1:9"
+CONTRACT = "0x000000000000000000000000000000000000dEaD"
+
+
+def dev_chain(args):
+    if args.rpc:
+        return Web3(HTTPProvider(args.rpc)), args.private_key
+    w3 = Web3(EthereumTesterProvider())
+    # Fund a fresh signing key from eth-tester's unlocked account
+    acct = w3.eth.account.create()
+    tx = w3.eth.send_transaction({"from": w3.eth.accounts[0], "to": acct.address, "value": 10 ** 20})
+    w3.eth.wait_for_transaction_receipt(tx)
+    return w3, acct.key
+
+
+def fail(msg: str):
+    print(f"FAIL: {msg}")
+    sys.exit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rpc", help="dev chain RPC URL (default: in-process eth-tester)")
+    parser.add_argument("--private-key", help="funded key on --rpc")
+    parser.add_argument("--batches", type=int, default=5)
+    parser.add_argument("--batch-size", type=int, default=100)
+    args = parser.parse_args()
+    if args.rpc and not args.private_key:
+        parser.error("--rpc needs --private-key")
+
+    chain, key = dev_chain(args)
+    rpc = RpcPool([Web3(HTTPProvider(DEAD_RPC, request_kwargs={"timeout": 1})), chain], cooldown_s=0)
+    anchor = PolygonAnchor(rpc, key, chain.eth.chain_id, CONTRACT)
+    start_nonce = chain.eth.get_transaction_count(anchor.account.address)
+
+    sent = []
+    t0 = time.perf_counter()
+    for b in range(args.batches):
+        cids = [f"bafy-devchain-{b}-{i}" for i in range(args.batch_size)]
+        tree = MerkleTree([leaf_hash(cid) for cid in cids])
+        sent.append((cids, tree, anchor.anchor_root(tree.root)))
+    elapsed = time.perf_counter() - t0
+
+    gas = 0
+    for n, (cids, tree, tx_hash) in enumerate(sent):
+        receipt = chain.eth.wait_for_transaction_receipt(tx_hash)
+        tx = chain.eth.get_transaction(tx_hash)
+        if receipt.status != 1:
+            fail(f"batch {n} reverted")
+        if tx.nonce != start_nonce + n:
+            fail(f"batch {n} nonce {tx.nonce}, expected {start_nonce + n}")
+        if bytes(tx.input) != tree.root:
+            fail(f"batch {n} calldata is not its Merkle root")
+        for i, cid in enumerate(cids):
+            if not verify_proof(leaf_hash(cid), tree.proof(i), tree.root):
+                fail(f"proof for {cid} does not verify")
+        if verify_proof(leaf_hash("not-in-batch"), tree.proof(0), tree.root):
+            fail("proof verified for a foreign leaf")
+        gas += receipt.gasUsed
+
+    # Nonce resync: another sender spends the next nonce behind the manager's back
+    other = anchor.account.sign_transaction({
+        "chainId": chain.eth.chain_id, "nonce": start_nonce + args.batches, "to": CONTRACT,
+        "value": 0, "gas": 21000, "gasPrice": chain.eth.gas_price,
+    })
+    chain.eth.wait_for_transaction_receipt(chain.eth.send_raw_transaction(other.raw_transaction))
+    tree = MerkleTree([leaf_hash("resync")])
+    chain.eth.wait_for_transaction_receipt(anchor.anchor_root(tree.root))
+
+    certs = args.batches * args.batch_size
+    # A lone anchor tx costs the same as a one-leaf batch
+    single_gas = chain.eth.get_transaction_receipt(sent[0][2]).gasUsed
+    print(f"anchored {certs} certificates in {args.batches} txs ({elapsed:.2f}s, {anchor.stats()})")
+    print(f"gas per certificate: {gas / certs:.0f} batched vs {single_gas} one tx each")
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
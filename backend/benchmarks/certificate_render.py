@@ -0,0 +1,94 @@
+"""Certificate render time and PDF size for long trips.
+
+    python benchmarks/certificate_render.py --points 10000 100000 1000000
+
+For each trip length: template build (parse + M4 decimation), draft render,
+final render with anchors, and output size. --naive also times the old
+one-line-per-event drawing for comparison.
+"""
+import argparse
+import io
+import os
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from certificate_pdf import build_certificate_template, render_certificate_pdf
+
+TRIP = {
+    "id": "00000000-0000-0000-0000-0000000000aa",
+    "truck_id": "00000000-0000-0000-0000-0000000000bb",
+    "cargo_type": "fresh",
+    "origin": "Salinas, CA",
+    "destination": "Denver, CO",
+    "started_at": "2026-01-01T00:00:00+00:00",
+    "ended_at": "2026-01-03T00:00:00+00:00",
+}
+CID = "bafybeigdyrzt5sfp7udm7hu76uh7y26nf3efuylqabf3oclgtqy55fbzdi"
+TX = "0x" + "ab" * 32
+
+
+def synthetic_events(points: int):
+    rng = np.random.default_rng(1)
+    start = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    step = timedelta(seconds=172800 / points)
+    temps = 35 + rng.normal(0, 0.2, points).cumsum() * 0.05 + (rng.random(points) < 0.001) * 6
+    return [
+        {"occurred_at": (start + step * i).isoformat(), "temperature": round(float(t), 2), "setpoint": 35}
+        for i, t in enumerate(temps)
+    ]
+
+
+def naive_render(events) -> bytes:
+    from reportlab.lib.pagesizes import A4
+    from reportlab.pdfgen import canvas
+
+    buff = io.BytesIO()
+    c = canvas.Canvas(buff, pagesize=A4)
+    width, _ = A4
+    temps = [e["temperature"] for e in events]
+    times = [datetime.fromisoformat(e["occurred_at"]) for e in events]
+    min_temp, max_temp, min_t, max_t = min(temps), max(temps), min(times), max(times)
+    span = (max_t - min_t).total_seconds()
+    last = None
+    for t, temp in zip(times, temps):
+        x = 50 + (t - min_t).total_seconds() / span * (width - 100)
+        y = 250 + (temp - min_temp) / (max_temp - min_temp) * 200
+        if last:
+            c.line(last[0], last[1], x, y)
+        last = (x, y)
+    c.showPage()
+    c.save()
+    return buff.getvalue()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--points", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--naive", action="store_true", help="also time the per-event line drawing")
+    args = parser.parse_args()
+
+    print(f"{'points':>9} {'template':>9} {'draft':>8} {'final':>8} {'drawn':>6} {'size':>9}" + ("  naive     size" if args.naive else ""))
+    for points in args.points:
+        events = synthetic_events(points)
+        t0 = time.perf_counter()
+        template = build_certificate_template(TRIP, events)
+        t1 = time.perf_counter()
+        render_certificate_pdf(template, None, None)
+        t2 = time.perf_counter()
+        pdf = render_certificate_pdf(template, CID, TX)
+        t3 = time.perf_counter()
+        line = f"{points:>9} {t1 - t0:>8.2f}s {t2 - t1:>7.3f}s {t3 - t2:>7.3f}s {len(template.graph_x):>6} {len(pdf) / 1024:>7.0f}KB"
+        if args.naive:
+            t4 = time.perf_counter()
+            naive = naive_render(events)
+            line += f"  {time.perf_counter() - t4:>6.2f}s {len(naive) / 1024:>6.0f}KB"
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""Cold start: import time of the backend and what it defers.
+
+    python benchmarks/cold_start.py --runs 5
+
+Runs `python -X importtime -c "import main"` in fresh interpreters and
+reports the median total plus the slowest top-level imports, then the time
+from interpreter start to the first `/health` response. Also lists the heavy
+SDKs that are *not* loaded by then, with what each would cost on import.
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFERRED = ("web3", "supabase", "reportlab.pdfgen.canvas", "qrcode", "PIL.Image", "pyarrow.parquet")
+
+FIRST_HEALTH = """
+import time
+t0 = time.perf_counter()
+import asyncio, sys, httpx, main
+
+async def health():
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        (await client.get("/health")).raise_for_status()
+
+asyncio.run(health())
+loaded = [m for m in %r if m in sys.modules]
+print(time.perf_counter() - t0, ",".join(loaded))
+""" % (DEFERRED,)
+
+
+def env() -> dict:
+    return {
+        **os.environ,
+        "BACKEND_SUPABASE_URL": os.getenv("BACKEND_SUPABASE_URL", "http://supabase.bench.local"),
+        "BACKEND_SUPABASE_SERVICE_ROLE_KEY": os.getenv("BACKEND_SUPABASE_SERVICE_ROLE_KEY", "bench"),
+        "PYTHONPATH": BACKEND,
+    }
+
+
+def importtime(statement: str):
+    """{module: cumulative µs} for the modules the statement imports and their direct imports.
+
+    "<total>" is the whole statement: `import a.b` logs `a` and `a.b` separately.
+    """
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", statement], cwd=BACKEND, env=env(),
+                          capture_output=True, text=True, check=True)
+    top = {"<total>": 0}
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        name = name[1:]
+        # Nesting is two spaces per level; keep the statement's module and its direct imports
+        depth = len(name) - len(name.lstrip())
+        if depth <= 2:
+            top[name.strip()] = int(cumulative)
+        if depth == 0:
+            top["<total>"] += int(cumulative)
+    return top
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args()
+
+    runs = [importtime("import main") for _ in range(args.runs)]
+    totals = [run["main"] / 1000 for run in runs]
+    print(f"import main: median {statistics.median(totals):.0f} ms (min {min(totals):.0f}, max {max(totals):.0f})")
+    modules = {name for run in runs for name in run if name not in ("main", "<total>")}
+    slowest = sorted(modules, key=lambda m: -statistics.median(run.get(m, 0) for run in runs))[:args.top]
+    for name in slowest:
+        print(f"  {name:24} {statistics.median(run.get(name, 0) for run in runs) / 1000:8.1f} ms")
+
+    firsts = []
+    for _ in range(args.runs):
+        out = subprocess.run([sys.executable, "-c", FIRST_HEALTH], cwd=BACKEND, env=env(),
+                             capture_output=True, text=True, check=True).stdout.split()
+        firsts.append(float(out[0]) * 1000)
+        loaded = out[1].split(",") if len(out) > 1 else []
+    print(f"first /health: median {statistics.median(firsts):.0f} ms after interpreter start")
+
+    print("deferred until first use:")
+    for module in DEFERRED:
+        cost = importtime(f"import {module}")
+        state = "LOADED at startup" if module in loaded else "not loaded"
+        print(f"  {module:24} {state:18} {cost['<total>'] / 1000:8.1f} ms to import")
+    sys.exit(1 if loaded else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,356 @@
+"""In-memory stand-in for the async Supabase client, for offline benchmarks.
+
+Covers the PostgREST subset the backend uses: select/insert/upsert/update
+with eq/neq/gt/gte/lt/lte/in_/or_ filters, order, limit, single and
+maybe_single, plus the RPCs the ingest and certificate paths call
+(`claim_certificate_job`, `claim_anchor_batch`, `merge_temperature_rollups`), and
+`auth.get_user` for bearer tokens.
+Every execute() waits `latency_ms` first, like a round trip to the database.
+"""
+import asyncio
+import copy
+import itertools
+import re
+import uuid
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+from typing import Callable, Dict, List, Optional
+
+SERIAL_TABLES = {"reefer_events"}
+# Equality-filtered columns with a hash index, so per-truck reads don't scan every event
+INDEXES = {"reefer_events": "truck_id", "reefer_trips": "truck_id"}
+
+TABLE_DEFAULTS = {
+    "certificate_jobs": lambda now: {
+        "status": "pending", "stage": "upload", "attempts": 0, "next_attempt_at": now,
+        "locked_by": None, "locked_at": None, "last_error": None, "created_at": now, "updated_at": now,
+    },
+    "reefer_certificates": lambda now: {"created_at": now},
+    "reefer_trips": lambda now: {"status": "open"},
+}
+
+_TIMESTAMP = re.compile(r"^\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}")
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def _coerce(row_value, value):
+    """Comparable pair for a stored value and a filter value (often a string)."""
+    if isinstance(row_value, bool) or row_value is None or value is None:
+        return row_value, value
+    if isinstance(row_value, (int, float)):
+        return float(row_value), float(value)
+    if isinstance(row_value, str) and isinstance(value, str) and _TIMESTAMP.match(row_value) and _TIMESTAMP.match(value):
+        return (datetime.fromisoformat(row_value.replace("Z", "+00:00")),
+                datetime.fromisoformat(value.replace("Z", "+00:00")))
+    return str(row_value), str(value)
+
+
+def _compare(op: str, row_value, value) -> bool:
+    if op == "in":
+        return any(_compare("eq", row_value, v) for v in value)
+    if op == "is":
+        return row_value is None if value in (None, "null") else row_value == value
+    if row_value is None:
+        return False
+    a, b = _coerce(row_value, value)
+    if op == "eq":
+        return a == b
+    if op == "neq":
+        return a != b
+    if op == "gt":
+        return a > b
+    if op == "gte":
+        return a >= b
+    if op == "lt":
+        return a < b
+    if op == "lte":
+        return a <= b
+    raise ValueError(f"Unsupported filter operator {op}")
+
+
+def _split_top(expr: str) -> List[str]:
+    parts, depth, quoted, start = [], 0, False, 0
+    for i, ch in enumerate(expr):
+        if ch == '"':
+            quoted = not quoted
+        elif not quoted and ch == "(":
+            depth += 1
+        elif not quoted and ch == ")":
+            depth -= 1
+        elif not quoted and ch == "," and depth == 0:
+            parts.append(expr[start:i])
+            start = i + 1
+    parts.append(expr[start:])
+    return parts
+
+
+def _logic(expr: str, combine=any) -> Callable[[dict], bool]:
+    """Predicate for a PostgREST logic tree such as `a.gt.1,and(a.eq.1,id.gt.5)`."""
+    terms = []
+    for term in _split_top(expr):
+        for name, fn in (("and(", all), ("or(", any)):
+            if term.startswith(name):
+                terms.append(_logic(term[len(name):-1], fn))
+                break
+        else:
+            column, op, value = term.split(".", 2)
+            terms.append(lambda row, c=column, o=op, v=value.strip('"'): _compare(o, row.get(c), v))
+    return lambda row: combine(term(row) for term in terms)
+
+
+class FakeResponse:
+    def __init__(self, data):
+        self.data = data
+        self.count = len(data) if isinstance(data, list) else None
+
+
+class FakeQuery:
+    def __init__(self, db: "FakeSupabase", table: str):
+        self.db = db
+        self.table = table
+        self.action = "select"
+        self.columns = "*"
+        self.payload = None
+        self.on_conflict = None
+        self.ignore_duplicates = False
+        self.filters: List[Callable[[dict], bool]] = []
+        self.equals: Dict[str, object] = {}
+        self.orders: List[tuple] = []
+        self._limit: Optional[int] = None
+        self._single: Optional[str] = None
+
+    def select(self, columns: str = "*", **kwargs):
+        self.columns = columns
+        return self
+
+    def insert(self, rows, **kwargs):
+        self.action, self.payload = "insert", rows
+        return self
+
+    def upsert(self, rows, on_conflict: str = "id", ignore_duplicates: bool = False, **kwargs):
+        self.action, self.payload = "upsert", rows
+        self.on_conflict, self.ignore_duplicates = on_conflict, ignore_duplicates
+        return self
+
+    def update(self, fields: dict, **kwargs):
+        self.action, self.payload = "update", fields
+        return self
+
+    def _filter(self, op: str, column: str, value):
+        self.filters.append(lambda row: _compare(op, row.get(column), value))
+        return self
+
+    def eq(self, column, value):
+        self.equals[column] = value
+        return self._filter("eq", column, value)
+
+    def neq(self, column, value):
+        return self._filter("neq", column, value)
+
+    def gt(self, column, value):
+        return self._filter("gt", column, value)
+
+    def gte(self, column, value):
+        return self._filter("gte", column, value)
+
+    def lt(self, column, value):
+        return self._filter("lt", column, value)
+
+    def lte(self, column, value):
+        return self._filter("lte", column, value)
+
+    def in_(self, column, values):
+        return self._filter("in", column, list(values))
+
+    def is_(self, column, value):
+        return self._filter("is", column, value)
+
+    def or_(self, expr: str):
+        self.filters.append(_logic(expr))
+        return self
+
+    def order(self, column: str, desc: bool = False, **kwargs):
+        self.orders.append((column, desc))
+        return self
+
+    def limit(self, n: int):
+        self._limit = n
+        return self
+
+    def single(self):
+        self._single = "single"
+        return self
+
+    def maybe_single(self):
+        self._single = "maybe"
+        return self
+
+    def _project(self, row: dict) -> dict:
+        if self.columns == "*":
+            return dict(row)
+        return {c: row.get(c) for c in (c.strip() for c in self.columns.split(","))}
+
+    async def execute(self):
+        if self.db.latency:
+            await asyncio.sleep(self.db.latency)
+        self.db.requests += 1
+        rows = self.db._candidates(self.table, self.equals)
+        if self.action == "insert":
+            data = [self.db._insert(self.table, row) for row in _as_list(self.payload)]
+        elif self.action == "upsert":
+            data = [r for r in (self.db._upsert(self.table, row, self.on_conflict, self.ignore_duplicates)
+                                for row in _as_list(self.payload)) if r is not None]
+        elif self.action == "update":
+            data = []
+            for row in rows:
+                if all(f(row) for f in self.filters):
+                    row.update(copy.deepcopy(self.payload))
+                    self.db._notify(self.table, row)
+                    data.append(dict(row))
+        else:
+            data = [row for row in rows if all(f(row) for f in self.filters)]
+            for column, desc in reversed(self.orders):
+                data.sort(key=lambda r: _sort_key(r.get(column)), reverse=desc)
+            if self._limit is not None:
+                data = data[:self._limit]
+            data = [self._project(row) for row in data]
+        if self._single == "maybe":
+            return FakeResponse(data[0]) if data else None
+        if self._single == "single":
+            if len(data) != 1:
+                raise RuntimeError(f"single() on {self.table} matched {len(data)} rows")
+            return FakeResponse(data[0])
+        return FakeResponse(data)
+
+
+def _as_list(payload) -> List[dict]:
+    return payload if isinstance(payload, list) else [payload]
+
+
+def _sort_key(value):
+    if isinstance(value, str) and _TIMESTAMP.match(value):
+        return datetime.fromisoformat(value.replace("Z", "+00:00"))
+    return value
+
+
+class FakeRpc:
+    def __init__(self, db: "FakeSupabase", name: str, params: dict):
+        self.db = db
+        self.name = name
+        self.params = params or {}
+
+    async def execute(self):
+        if self.db.latency:
+            await asyncio.sleep(self.db.latency)
+        self.db.requests += 1
+        handler = getattr(self.db, f"_rpc_{self.name}", None)
+        return FakeResponse(handler(**self.params) if handler else [])
+
+
+class FakeAuth:
+    """`auth.get_user`: the access token "user:<id>" is valid for that user, anything else isn't."""
+
+    async def get_user(self, jwt: str):
+        if not jwt.startswith("user:"):
+            raise ValueError("invalid JWT")
+        return SimpleNamespace(user=SimpleNamespace(id=jwt[len("user:"):]))
+
+
+class FakeSupabase:
+    """Tables are lists of dicts; `drop_columns` keeps bulky columns out of memory."""
+
+    def __init__(self, latency_ms: float = 0.0, drop_columns: Optional[Dict[str, set]] = None):
+        self.latency = latency_ms / 1000
+        self.drop_columns = drop_columns or {}
+        self.tables: Dict[str, List[dict]] = {}
+        self.requests = 0
+        self.rollups_merged = 0
+        self.listeners: List[Callable[[str, dict], None]] = []
+        self._serial = itertools.count(1)
+        self._indexes: Dict[str, Dict[object, List[dict]]] = {}
+        # on_conflict targets, built on first use: (table, columns) -> {values: row}
+        self._unique: Dict[tuple, Dict[tuple, dict]] = {}
+        self.auth = FakeAuth()
+
+    def table(self, name: str) -> FakeQuery:
+        return FakeQuery(self, name)
+
+    def rpc(self, name: str, params: Optional[dict] = None) -> FakeRpc:
+        return FakeRpc(self, name, params)
+
+    def _candidates(self, table: str, equals: Dict[str, object]) -> List[dict]:
+        column = INDEXES.get(table)
+        if column in equals:
+            return self._indexes.get(table, {}).get(equals[column], [])
+        return self.tables.setdefault(table, [])
+
+    def seed(self, table: str, rows: List[dict]):
+        for row in rows:
+            self._insert(table, row)
+
+    def _insert(self, table: str, row: dict) -> dict:
+        now = _now()
+        stored = TABLE_DEFAULTS[table](now) if table in TABLE_DEFAULTS else {}
+        stored["id"] = next(self._serial) if table in SERIAL_TABLES else str(uuid.uuid4())
+        stored.update({k: v for k, v in row.items() if k not in self.drop_columns.get(table, ())})
+        self.tables.setdefault(table, []).append(stored)
+        if table in INDEXES:
+            self._indexes.setdefault(table, {}).setdefault(stored.get(INDEXES[table]), []).append(stored)
+        for (unique_table, keys), rows in self._unique.items():
+            if unique_table == table:
+                rows.setdefault(tuple(stored.get(k) for k in keys), stored)
+        self._notify(table, stored)
+        return dict(stored)
+
+    def _upsert(self, table: str, row: dict, on_conflict: str, ignore_duplicates: bool) -> Optional[dict]:
+        keys = tuple(k.strip() for k in (on_conflict or "id").split(","))
+        unique = self._unique.get((table, keys))
+        if unique is None:
+            unique = self._unique[(table, keys)] = {}
+            for existing in self.tables.get(table, []):
+                unique.setdefault(tuple(existing.get(k) for k in keys), existing)
+        existing = unique.get(tuple(row.get(k) for k in keys))
+        if existing is not None:
+            if ignore_duplicates:
+                return None
+            existing.update(row)
+            self._notify(table, existing)
+            return dict(existing)
+        return self._insert(table, row)
+
+    def _notify(self, table: str, row: dict):
+        for listener in self.listeners:
+            listener(table, row)
+
+    def _claim(self, worker: str, due, limit: int, status: Optional[str] = None) -> List[dict]:
+        jobs = sorted((j for j in self.tables.get("certificate_jobs", []) if due(j)),
+                      key=lambda j: _sort_key(j["next_attempt_at"]))[:limit]
+        now = _now()
+        for job in jobs:
+            job.update({"locked_by": worker, "locked_at": now, "updated_at": now})
+            if status:
+                job["status"] = status
+        return [dict(job) for job in jobs]
+
+    def _rpc_claim_certificate_job(self, worker: str, lease_seconds: int = 600):
+        now = datetime.now(timezone.utc)
+        expired = now - timedelta(seconds=lease_seconds)
+        return self._claim(worker, lambda j: (
+            (j["status"] == "pending" and _sort_key(j["next_attempt_at"]) <= now)
+            or (j["status"] == "running" and j["locked_at"] and _sort_key(j["locked_at"]) < expired)
+        ), 1, "running")
+
+    def _rpc_claim_anchor_batch(self, worker: str, max_jobs: int = 256, lease_seconds: int = 600):
+        now = datetime.now(timezone.utc)
+        expired = now - timedelta(seconds=lease_seconds)
+        return self._claim(worker, lambda j: (
+            j["status"] == "anchoring" and _sort_key(j["next_attempt_at"]) <= now
+            and (j["locked_by"] is None or _sort_key(j["locked_at"]) < expired)
+        ), max_jobs)
+
+    def _rpc_merge_temperature_rollups(self, rollups: List[dict]):
+        self.rollups_merged += len(rollups)
+        return None
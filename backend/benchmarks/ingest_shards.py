@@ -0,0 +1,81 @@
+"""Ingest throughput and per-truck ordering across shard counts.
+
+    python benchmarks/ingest_shards.py --events 200000 --trucks 2000 --latency-ms 20
+
+Pushes readings through ingest.ShardedIngestQueue with a flush that sleeps
+--latency-ms per batch (the reefer_events insert) plus the measured CPU of
+building rows, for each shard count in --shards. Checks that every truck's
+readings reach the flush in the order they were put.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ingest import IngestQueueFull, ShardedIngestQueue
+from normalizers import ReeferEvent
+
+
+async def run(shards: int, args) -> dict:
+    last_seq = {}
+    out_of_order = 0
+
+    async def flush(events):
+        nonlocal out_of_order
+        for event in events:
+            if event.raw_payload["seq"] < last_seq.get(event.truck_id, -1):
+                out_of_order += 1
+            last_seq[event.truck_id] = event.raw_payload["seq"]
+        rows = [event.to_row() for event in events]
+        await asyncio.sleep(args.latency_ms / 1000)
+        return rows
+
+    queue = ShardedIngestQueue(flush, lambda e: e.truck_id, shards=shards, max_batch=args.batch,
+                               max_size=args.max_queue)
+    await queue.start()
+    started = time.perf_counter()
+    rejected = 0
+    for seq in range(args.events):
+        event = ReeferEvent(provider="samsara", event_type="temperature", temperature=38.0,
+                            occurred_at="2026-03-02T14:05:11+00:00", raw_payload={"seq": seq},
+                            user_id="user-1", truck_id=f"truck-{seq % args.trucks}")
+        while True:
+            try:
+                queue.put(event)
+                break
+            except IngestQueueFull:
+                rejected += 1
+                await asyncio.sleep(0.001)
+        if seq % 1000 == 0:
+            await asyncio.sleep(0)
+    await queue.stop()
+    elapsed = time.perf_counter() - started
+    stats = queue.stats()
+    return {"elapsed": elapsed, "flushes": stats["flush_count"], "rejected": rejected, "out_of_order": out_of_order}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--events", type=int, default=200000)
+    parser.add_argument("--trucks", type=int, default=2000)
+    parser.add_argument("--latency-ms", type=float, default=20.0, help="simulated insert round trip")
+    parser.add_argument("--batch", type=int, default=500)
+    parser.add_argument("--max-queue", type=int, default=20000)
+    parser.add_argument("--shards", default="1,2,4,8")
+    args = parser.parse_args()
+
+    ok = True
+    for shards in (int(n) for n in args.shards.split(",")):
+        result = asyncio.run(run(shards, args))
+        ok = ok and result["out_of_order"] == 0
+        print(f"shards={shards}: {args.events / result['elapsed']:,.0f} events/s, {result['flushes']} flushes, "
+              f"{result['rejected']} rejected puts, {result['out_of_order']} out of order")
+    print("OK" if ok else "FAIL")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""IPFS CAR upload throughput, retries and dedup against a local stub.
+
+    python benchmarks/ipfs_upload.py --pdfs 200 --duplicates 50 --fail-every 7 --latency-ms 50
+
+Uploads --pdfs distinct payloads of --size-kb (plus --large multi-chunk
+ones) and --duplicates repeats through IpfsUploader. Every CAR the stub
+receives is parsed back: each block must hash to its CID and each root must
+match the locally computed CID, and no CID may be stored twice.
+"""
+import argparse
+import asyncio
+import hashlib
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from stub_server import start_stub_server
+
+from clients import close_http_clients
+from ipfs import IpfsUploader, cid_str
+
+
+def read_varint(buf: bytes, pos: int):
+    n = shift = 0
+    while True:
+        byte = buf[pos]
+        pos += 1
+        n |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return n, pos
+        shift += 7
+
+
+def read_car(car: bytes):
+    """Returns (root CID string, block count); raises if any block doesn't match its CID."""
+    size, pos = read_varint(car, 0)
+    header = car[pos:pos + size]
+    # Header is {"roots": [tag42(0x00 + cid)], "version": 1}; the CID runs up to "version"
+    root = header[header.index(b"\xd8\x2a") + 5:header.index(b"\x67version")]
+    pos += size
+    blocks = 0
+    while pos < len(car):
+        size, pos = read_varint(car, pos)
+        end = pos + size
+        # CIDv1 + codec varints, then a 34-byte sha2-256 multihash
+        _, p = read_varint(car, pos)
+        _, p = read_varint(car, p)
+        cid_end = p + 34
+        if car[p + 2:cid_end] != hashlib.sha256(car[cid_end:end]).digest():
+            raise ValueError("block does not match its CID")
+        pos = end
+        blocks += 1
+    return cid_str(root), blocks
+
+
+async def run(args, base_url, stub):
+    uploader = IpfsUploader(f"{base_url}/upload", "stub-token", concurrency=args.concurrency,
+                            retries=args.retries, backoff_s=0.01)
+    payloads = [os.urandom(args.size_kb * 1024) for _ in range(args.pdfs)]
+    payloads += [os.urandom(3 * 1024 * 1024 + 123) for _ in range(args.large)]
+    payloads += payloads[:args.duplicates]
+
+    t0 = time.perf_counter()
+    cids = await asyncio.gather(*(uploader.upload(p) for p in payloads))
+    elapsed = time.perf_counter() - t0
+    await close_http_clients()
+    return uploader, cids, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pdfs", type=int, default=200)
+    parser.add_argument("--size-kb", type=int, default=60)
+    parser.add_argument("--large", type=int, default=2, help="extra 3 MiB payloads (multi-block DAGs)")
+    parser.add_argument("--duplicates", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--retries", type=int, default=4)
+    parser.add_argument("--fail-every", type=int, default=7, help="stub answers every Nth upload with 503")
+    parser.add_argument("--latency-ms", type=float, default=50)
+    args = parser.parse_args()
+
+    base_url, stub = start_stub_server(args.latency_ms, args.fail_every)
+    uploader, cids, elapsed = asyncio.run(run(args, base_url, stub))
+
+    stored = [read_car(body) for body in stub.bodies]
+    roots = [root for root, _ in stored]
+    unique = set(cids)
+    ok = sorted(roots) == sorted(unique)
+    print(f"{len(cids)} uploads requested, {len(unique)} unique CIDs, {len(roots)} CARs stored "
+          f"({sum(b for _, b in stored)} blocks) in {elapsed:.2f}s")
+    print(f"uploader: {uploader.stats()}, stub requests: {stub.other_requests}")
+    print("OK" if ok else "FAIL: stored CARs don't match the computed CIDs one-to-one")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
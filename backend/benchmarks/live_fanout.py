@@ -0,0 +1,306 @@
+"""Fan-out of the /live stream to thousands of concurrent subscribers.
+
+    python benchmarks/live_fanout.py --users 50 --subscribers 2000 --trucks 10 --seconds 15 --rate 5
+
+Runs the API under uvicorn in a subprocess (Supabase is benchmarks/fake_supabase.py,
+the OEM recovery call is a no-op) and opens --subscribers SSE connections
+spread over --users. Every user's trucks post --rate readings per second
+through the webhook; one truck per user goes out of range for the middle third
+of the run. --stalled-fraction of the connections never read after the
+headers, with a tiny receive buffer, to show they don't hold up the others.
+
+Reports delivery latency (reading time -> received, including the coalescing
+hold), readings delivered per truck per second on each connection, CPU of the
+server and of this load generator, server RSS per subscriber and the hub's
+coalesced/dropped counts. Fails unless every reading connection ends on each
+truck's last reading, gets both excursion alerts, and gets no more readings
+per truck than one per LIVE_COALESCE_SECONDS. The load generator runs on the
+same machine; if "published" takes much longer than --seconds, it (or the
+server) is out of CPU and the latency figures include that backlog.
+"""
+import argparse
+import asyncio
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND)
+
+SERVER_ENV = {
+    "BACKEND_SUPABASE_URL": "http://supabase.bench.local",
+    "BACKEND_SUPABASE_SERVICE_ROLE_KEY": "bench",
+    "INGEST_FLUSH_INTERVAL_MS": "50",
+    "EXCURSION_MIN_DURATION_SECONDS": "0",
+    "LIVE_HEARTBEAT_SECONDS": "5",
+}
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))
+    return values[index]
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def rss_mb(pid: int) -> float:
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def cpu_seconds(pid: int) -> float:
+    # utime + stime from /proc/<pid>/stat, in clock ticks
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+def serve(port: int):
+    import logging
+    import uvicorn
+    import main
+    from fake_supabase import FakeSupabase
+
+    async def no_recovery(provider, user_id, truck_id, setpoint):
+        return None
+
+    logging.getLogger("reefershield").setLevel(logging.ERROR)
+    main.supabase = FakeSupabase(drop_columns={"reefer_events": {"raw_payload"}})
+    main.execute_recovery_command = no_recovery
+    uvicorn.run(main.app, host="127.0.0.1", port=port, log_level="warning", backlog=8192,
+                timeout_graceful_shutdown=2)
+
+
+class Subscriber:
+    def __init__(self, user: int):
+        self.user = user
+        self.last = {}
+        self.seen = {}
+        self.latencies = []
+        self.min_gap = float("inf")
+        self.alerts = set()
+        self.overflows = 0
+        self.connected = asyncio.Event()
+
+    def on_event(self, kind: str, data: dict):
+        now = time.time()
+        if kind == "reading":
+            truck = data["truck_id"]
+            previous = self.seen.get(truck)
+            if previous is not None:
+                self.min_gap = min(self.min_gap, now - previous[-1])
+            self.seen.setdefault(truck, []).append(now)
+            self.last[truck] = data["temperature"]
+            occurred = datetime.fromisoformat(data["occurred_at"].replace("Z", "+00:00")).timestamp()
+            self.latencies.append(now - occurred)
+        elif kind == "overflow":
+            self.overflows += data["dropped"]
+        else:
+            self.alerts.add((kind, data.get("truck_id")))
+
+    async def run(self, port: int):
+        # Plain asyncio streams: an httpx client per connection costs more CPU than the server does
+        reader, writer = await open_live(port, self.user)
+        self.connected.set()
+        buffer = b""
+        try:
+            while True:
+                size = int(await reader.readuntil(b"\r\n"), 16)
+                if not size:
+                    return
+                *messages, buffer = (buffer + (await reader.readexactly(size + 2))[:-2]).split(b"\n\n")
+                for message in messages:
+                    if message.startswith(b"event: "):
+                        event, data = message.split(b"\n", 1)
+                        self.on_event(event[7:].decode(), json.loads(data[6:]))
+        finally:
+            writer.close()
+
+
+async def open_live(port: int, user: int, rcvbuf: int = 0):
+    sock = socket.socket()
+    if rcvbuf:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, rcvbuf)
+    sock.setblocking(False)
+    await asyncio.get_running_loop().sock_connect(sock, ("127.0.0.1", port))
+    reader, writer = await asyncio.open_connection(sock=sock)
+    writer.write(f"GET /live HTTP/1.1\r\nHost: bench\r\nAuthorization: Bearer user:{user_id(user)}\r\n\r\n".encode())
+    headers = await reader.readuntil(b"\r\n\r\n")
+    if not headers.startswith(b"HTTP/1.1 200"):
+        raise RuntimeError(headers.split(b"\r\n", 1)[0].decode())
+    return reader, writer
+
+
+async def stalled(port: int, user: int, opened: list):
+    # Never reads past the response headers
+    _, writer = await open_live(port, user, rcvbuf=1024)
+    opened.append(writer)
+
+
+def user_id(user: int) -> str:
+    return f"00000000-0000-0000-0000-{user:012d}"
+
+
+def truck_id(user: int, truck: int) -> str:
+    return f"00000000-0000-0000-{user:04d}-{truck:012d}"
+
+
+async def publish(client, base: str, args, last: dict):
+    ticks = int(args.seconds * args.rate)
+    excursion = range(ticks // 3, 2 * ticks // 3)
+    posted = 0
+    start = time.monotonic()
+    for tick in range(ticks):
+        now = datetime.now(timezone.utc).isoformat()
+        # The whole fleet's tick in one batch, like a provider's bulk delivery
+        body = []
+        for user in range(args.users):
+            for truck in range(args.trucks):
+                temperature = round(35 + ((tick * 7 + truck) % 10) / 10, 1)
+                if truck == 0 and tick in excursion:
+                    temperature = 50.0
+                body.append({"user_id": user_id(user), "truck_id": truck_id(user, truck), "cargo_type": "fresh",
+                             "event_type": "temperature", "temperature": temperature, "occurred_at": now})
+                last[truck_id(user, truck)] = temperature
+        (await client.post(f"{base}/webhooks/bench", json=body)).raise_for_status()
+        posted += len(body)
+        await asyncio.sleep(max(0.0, start + (tick + 1) / args.rate - time.monotonic()))
+    return posted
+
+
+async def run(args, port: int, server: subprocess.Popen):
+    import httpx
+
+    base = f"http://127.0.0.1:{port}"
+    async with httpx.AsyncClient(timeout=30) as client:
+        for _ in range(100):
+            try:
+                (await client.get(f"{base}/health")).raise_for_status()
+                break
+            except httpx.TransportError:
+                await asyncio.sleep(0.1)
+        rss_idle = rss_mb(server.pid)
+
+        checks = {}
+        resp = await client.get(f"{base}/live", headers={"Authorization": "Bearer not-a-token"})
+        checks["bad_token_rejected"] = resp.status_code == 401
+
+        stalled_count = int(args.subscribers * args.stalled_fraction)
+        subscribers = [Subscriber(i % args.users) for i in range(args.subscribers - stalled_count)]
+        t0 = time.perf_counter()
+        tasks = [asyncio.create_task(s.run(port)) for s in subscribers]
+        opened = []
+        await asyncio.gather(*(stalled(port, i % args.users, opened) for i in range(stalled_count)))
+        await asyncio.wait_for(asyncio.gather(*(s.connected.wait() for s in subscribers)), 120)
+        connect_s = time.perf_counter() - t0
+        rss_connected = rss_mb(server.pid)
+
+        # User 0 is at LIVE_MAX_CONNECTIONS_PER_USER (see main()), so one more is turned away
+        resp = await client.get(f"{base}/live", headers={"Authorization": f"Bearer user:{user_id(0)}"})
+        checks["per_user_limit_enforced"] = resp.status_code == 429
+
+        last = {}
+        t0 = time.perf_counter()
+        cpu = (cpu_seconds(server.pid), time.process_time())
+        posted = await publish(client, base, args, last)
+        publish_s = time.perf_counter() - t0
+        server_cpu, client_cpu = cpu_seconds(server.pid) - cpu[0], time.process_time() - cpu[1]
+        await asyncio.sleep(args.settle)
+        stats = (await client.get(f"{base}/ingest/stats")).json()["live"]
+        rss_peak = rss_mb(server.pid)
+
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for writer in opened:
+            writer.close()
+
+    t0 = time.perf_counter()
+    server.send_signal(signal.SIGTERM)
+    server.wait(timeout=30)
+    shutdown_s = time.perf_counter() - t0
+
+    latencies = [l for s in subscribers for l in s.latencies]
+    per_truck_rate = [len(times) / args.seconds for s in subscribers for times in s.seen.values()]
+    stale = sum(1 for s in subscribers for truck in range(args.trucks)
+                if s.last.get(truck_id(s.user, truck)) != last[truck_id(s.user, truck)])
+    missing_alerts = sum(1 for s in subscribers for kind in ("excursion_started", "excursion_ended")
+                         if (kind, truck_id(s.user, 0)) not in s.alerts)
+    min_gap = min(s.min_gap for s in subscribers)
+    # Counted rather than timed: gaps seen by a lagging load generator say little about the server
+    most = max(len(times) for s in subscribers for times in s.seen.values())
+    checks.update({
+        "all_connections_converged": stale == 0,
+        "excursion_alerts_delivered": missing_alerts == 0,
+        "coalescing_respected": most <= (publish_s + args.settle) / args.coalesce + 1,
+    })
+
+    print(f"subscribers: {len(subscribers)} reading + {stalled_count} stalled over {args.users} users, "
+          f"connected in {connect_s:.2f}s")
+    print(f"published: {posted} readings in {publish_s:.1f}s ({posted / publish_s:.0f}/s) "
+          f"for {args.users * args.trucks} trucks")
+    print(f"delivered: {len(latencies)} readings, per truck per connection "
+          f"{percentile(per_truck_rate, 50):.2f}/s median, {max(per_truck_rate):.2f}/s max "
+          f"(sent at {args.rate}/s), closest pair {min_gap:.2f}s apart")
+    print(f"latency: p50 {percentile(latencies, 50) * 1000:.0f} ms, p99 {percentile(latencies, 99) * 1000:.0f} ms, "
+          f"max {max(latencies) * 1000:.0f} ms (reading time -> received)")
+    print(f"cpu while publishing: server {server_cpu:.1f}s, load generator {client_cpu:.1f}s")
+    print(f"hub: coalesced {stats['coalesced']}, dropped {stats['dropped']}, pending {stats['pending']}, "
+          f"sent {stats['sent']}")
+    print(f"server RSS: {rss_idle:.0f} MB idle, {rss_connected:.0f} MB connected "
+          f"({(rss_connected - rss_idle) * 1024 / args.subscribers:.0f} KB per subscriber), {rss_peak:.0f} MB at end")
+    print(f"server shutdown with streams open: {shutdown_s:.2f}s")
+    print(f"stale trucks: {stale}, missing excursion alerts: {missing_alerts}")
+    for name, ok in checks.items():
+        print(f"  {'ok  ' if ok else 'FAIL'} {name}")
+    return all(checks.values())
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--subscribers", type=int, default=2000)
+    parser.add_argument("--trucks", type=int, default=10, help="trucks per user")
+    parser.add_argument("--seconds", type=float, default=15)
+    parser.add_argument("--rate", type=float, default=5, help="readings per truck per second")
+    parser.add_argument("--stalled-fraction", type=float, default=0.05)
+    parser.add_argument("--coalesce", type=float, default=1.0)
+    parser.add_argument("--settle", type=float, default=3.0, help="seconds to wait for the last readings")
+    parser.add_argument("--serve", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.serve)
+        return
+
+    port = free_port()
+    stalled_count = int(args.subscribers * args.stalled_fraction)
+    per_user = -(-(args.subscribers - stalled_count) // args.users) + -(-stalled_count // args.users)
+    env = {**os.environ, **SERVER_ENV, "LIVE_COALESCE_SECONDS": str(args.coalesce),
+           "LIVE_MAX_CONNECTIONS_PER_USER": str(per_user), "PYTHONPATH": BACKEND}
+    server = subprocess.Popen([sys.executable, os.path.abspath(__file__), "--serve", str(port)], cwd=BACKEND, env=env)
+    try:
+        ok = asyncio.run(run(args, port, server))
+    finally:
+        if server.poll() is None:
+            server.kill()
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
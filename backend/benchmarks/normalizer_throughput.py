@@ -0,0 +1,106 @@
+"""Normalizer throughput over recorded provider payloads.
+
+    python benchmarks/normalizer_throughput.py --payloads 200000
+
+Replays benchmarks/samples/<provider>.ndjson through the registered
+normalizer until --payloads readings have been produced per provider, then
+resolves the vehicle ids through a VehicleIndex backed by an in-memory load.
+Also compares the memory held by queued ReeferEvents with the equivalent
+row dicts.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from normalizers import NORMALIZERS, VehicleIndex, normalize
+
+SAMPLES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "samples")
+
+
+def load_samples(provider: str):
+    with open(os.path.join(SAMPLES, f"{provider}.ndjson")) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def flat_samples():
+    return [{
+        "user_id": "00000000-0000-0000-0000-000000000001",
+        "truck_id": "00000000-0000-0000-0000-000000000007",
+        "event_type": "temperature",
+        "cargo_type": "frozen",
+        "temperature": -0.4,
+        "occurred_at": "2026-03-02T14:05:11+00:00",
+    }]
+
+
+def bench(provider: str, samples, count: int) -> float:
+    reps = count // len(samples) + 1
+    payloads = (samples * reps)[:count]
+    started = time.perf_counter()
+    for payload in payloads:
+        normalize(provider, payload)
+    return time.perf_counter() - started
+
+
+def held_bytes(build) -> int:
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    items = build()
+    size = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del items
+    return size
+
+
+async def resolve(events):
+    async def load(provider, ids):
+        return {i: (f"truck-{provider}-{i}", "user-1") for i in ids}
+
+    index = VehicleIndex(load)
+    started = time.perf_counter()
+    for i in range(0, len(events), 500):
+        batch = events[i:i + 500]
+        await index.resolve(batch[0].provider, (e.external_vehicle_id for e in batch))
+    return time.perf_counter() - started, index.stats()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--payloads", type=int, default=200000, help="readings per provider")
+    parser.add_argument("--fleet", type=int, default=2000, help="distinct vehicle ids when resolving")
+    args = parser.parse_args()
+
+    for provider in NORMALIZERS:
+        samples = load_samples(provider)
+        for payload in samples:
+            event = normalize(provider, payload)
+            print(f"  {provider:8} {event.event_type:13} vehicle={event.external_vehicle_id:16} "
+                  f"temp={event.temperature} setpoint={event.setpoint}")
+        elapsed = bench(provider, samples, args.payloads)
+        print(f"{provider}: {args.payloads} payloads in {elapsed:.3f}s "
+              f"({args.payloads / elapsed:,.0f}/s, {elapsed / args.payloads * 1e6:.2f} µs each)")
+    elapsed = bench("samsara", flat_samples(), args.payloads)
+    print(f"flat: {args.payloads} payloads in {elapsed:.3f}s ({args.payloads / elapsed:,.0f}/s)")
+
+    samples = load_samples("samsara")
+    payloads = [json.loads(json.dumps(samples[i % 2])) for i in range(args.payloads)]
+    for i, payload in enumerate(payloads):
+        payload["data"]["vehicle"]["id"] = str(i % args.fleet)
+    events = [normalize("samsara", p) for p in payloads]
+    elapsed, stats = asyncio.run(resolve(events))
+    print(f"vehicle resolution: {len(events)} events in {elapsed:.3f}s, {stats}")
+
+    slots = held_bytes(lambda: [normalize("samsara", p) for p in payloads])
+    rows = held_bytes(lambda: [normalize("samsara", p).to_row() for p in payloads])
+    print(f"queued memory: ReeferEvent {slots / len(payloads):.0f} B/reading, "
+          f"row dict {rows / len(payloads):.0f} B/reading")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,386 @@
+"""Offline replay of a synthetic fleet through webhook -> trip close -> certificate.
+
+    python benchmarks/pipeline_replay.py --trucks 50 --hours 6 --interval 30
+    python benchmarks/pipeline_replay.py --out after.json --compare before.json
+
+Nothing leaves the process: Supabase is benchmarks/fake_supabase.py, the
+Polygon anchor is a fake that sleeps --chain-latency-ms per batch, and the
+pooled httpx clients for web3.storage, Resend and the telematics APIs are
+replaced by a transport that sleeps --http-latency-ms and answers 200.
+
+Each truck gets an open trip and sends native Samsara readings every
+--interval seconds for --hours, ending with EngineOff at its receiver
+(--late-fraction of the readings are delivered after that, and
+--duplicate-fraction are delivered twice), so
+every trip closes and goes through upload, anchor, pin, store and email on
+the in-process certificate workers. Reports webhook throughput and latency,
+ingest drain time, certificate latency (final reading -> job done) and peak
+RSS, plus how many readings were still unstored when each trip closed, and
+writes them as JSON so two runs can be compared.
+"""
+import argparse
+import asyncio
+import copy
+import json
+import os
+import random
+import resource
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_supabase import FakeSupabase
+from ingest import RecentKeys
+
+SAMPLES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "samples")
+USER_ID = "00000000-0000-0000-0000-000000000001"
+RECEIVER = (41.8781, -87.6298)
+STUB_HOSTS = ("api.resend.com", "ipfs.bench.local", "api.samsara.com", "api.gomotive.com")
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))
+    return values[index]
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+class FakeAnchor:
+    """Stands in for anchoring.PolygonAnchor; called from a worker thread."""
+
+    def __init__(self, latency_ms: float):
+        self.latency = latency_ms / 1000
+        self.batches = 0
+
+    def anchor_root(self, root: bytes) -> str:
+        time.sleep(self.latency)
+        self.batches += 1
+        return "0x" + root.hex()
+
+    def stats(self) -> dict:
+        return {"batches": self.batches}
+
+
+def stub_transport(latency_ms: float):
+    import httpx
+
+    class StubTransport(httpx.AsyncBaseTransport):
+        def __init__(self):
+            self.requests = 0
+
+        async def handle_async_request(self, request):
+            await request.aread()
+            if latency_ms:
+                await asyncio.sleep(latency_ms / 1000)
+            self.requests += 1
+            return httpx.Response(200, json={"id": f"stub-{self.requests}"}, request=request)
+
+    return StubTransport()
+
+
+def configure_env(args):
+    # Read by main at import time
+    os.environ.update({
+        "BACKEND_SUPABASE_URL": "http://supabase.bench.local",
+        "BACKEND_SUPABASE_SERVICE_ROLE_KEY": "bench",
+        "WEB3_STORAGE_TOKEN": "bench",
+        "WEB3_STORAGE_UPLOAD_URL": "https://ipfs.bench.local/upload",
+        "RESEND_API_KEY": "bench",
+        "CERT_INPROCESS_WORKERS": str(args.cert_workers),
+        "ANCHOR_BATCH_WINDOW_SECONDS": str(args.anchor_window),
+        "CERT_JOB_POLL_SECONDS": "0.2",
+        "INGEST_SHARDS": str(args.shards),
+        "TRIP_CLOSE_WATERMARK_SECONDS": str(args.watermark),
+        "PAYLOAD_LOG_SAMPLE_RATE": "0",
+    })
+
+
+def seed(db: FakeSupabase, trucks: int, started_at: datetime):
+    db.seed("trucks", [{
+        "id": truck_id(i), "user_id": USER_ID, "telematics_provider": "samsara", "external_vehicle_id": str(i),
+    } for i in range(trucks)])
+    db.seed("reefer_trips", [{
+        "user_id": USER_ID, "truck_id": truck_id(i), "cargo_type": "fresh", "status": "open",
+        "started_at": started_at.isoformat(), "receiver_lat": RECEIVER[0], "receiver_lng": RECEIVER[1],
+    } for i in range(trucks)])
+    db.seed("recipient_emails", [{
+        "user_id": USER_ID, "truck_id": truck_id(i), "shipper_email": f"shipper-{i}@example.com",
+    } for i in range(trucks)])
+
+
+def truck_id(i: int) -> str:
+    return f"00000000-0000-0000-0000-{i:012d}"
+
+
+def fleet_payloads(args, started_at: datetime):
+    """(truck index, payload, last) in timestamp order, interleaved across trucks."""
+    with open(os.path.join(SAMPLES, "samsara.ndjson")) as f:
+        samples = [json.loads(line) for line in f if line.strip()]
+    reading = samples[0]
+    engine_off = next(s for s in samples if s["eventType"] == "EngineOff")
+    steps = int(args.hours * 3600 / args.interval)
+    for step in range(steps + 1):
+        at = (started_at + timedelta(seconds=step * args.interval)).isoformat().replace("+00:00", "Z")
+        last = step == steps
+        for truck in range(args.trucks):
+            payload = copy.deepcopy(engine_off if last else reading)
+            payload["eventId"] = f"{truck}-{step}"
+            payload["eventTime"] = at
+            payload["data"]["vehicle"]["id"] = str(truck)
+            if last:
+                payload["data"]["location"] = {"latitude": RECEIVER[0], "longitude": RECEIVER[1]}
+            else:
+                payload["data"]["reeferStats"]["returnAirTemperatureMilliC"] = 3000 + (step * 7 + truck) % 1500
+                payload["data"]["reeferStats"]["setPointMilliC"] = 3000
+            yield truck, payload, last
+
+
+def drained(stats: dict) -> bool:
+    return stats["flushed_total"] + stats["dropped_total"] >= stats["enqueued_total"]
+
+
+async def run(args) -> dict:
+    import httpx
+    import clients
+    import main
+
+    db = FakeSupabase(args.db_latency_ms, drop_columns={"reefer_events": {"raw_payload"}})
+    main.supabase = db
+    main.polygon_anchor = FakeAnchor(args.chain_latency_ms)
+    transports = {}
+    for host in STUB_HOSTS:
+        transports[host] = stub_transport(args.http_latency_ms)
+        clients._clients[host] = httpx.AsyncClient(transport=transports[host])
+
+    started_at = datetime.now(timezone.utc) - timedelta(hours=args.hours)
+    seed(db, args.trucks, started_at)
+
+    closed_at = {}
+    issued_at = {}
+    missing_at_close = {}
+    readings_per_trip = int(args.hours * 3600 / args.interval) + 1
+    trip_trucks = {t["id"]: t["truck_id"] for t in db.tables["reefer_trips"]}
+
+    def on_write(table, row):
+        if table != "certificate_jobs":
+            return
+        truck = trip_trucks[row["trip_id"]]
+        if truck not in missing_at_close:
+            # Readings the certificate would miss if it were built right now
+            stored = len(db._candidates("reefer_events", {"truck_id": truck}))
+            missing_at_close[truck] = readings_per_trip - stored
+        if row.get("status") == "done":
+            issued_at.setdefault(truck, time.perf_counter())
+
+    db.listeners.append(on_write)
+
+    # Stages run per job; anchoring is counted by the fake chain instead
+    stage_runs = {name: 0 for name in main.CERTIFICATE_STAGES if name != "anchor"}
+    run_stage = main.run_certificate_stage
+
+    async def counted_stage(name, job):
+        result = await run_stage(name, job)
+        stage_runs[name] += 1
+        return result
+
+    main.run_certificate_stage = counted_stage
+
+    latencies = []
+    sent = rejected = accepted = duplicates = 0
+    queue = asyncio.Queue(maxsize=args.concurrency * 4)
+
+    async def sender(client):
+        nonlocal sent, rejected, accepted, duplicates
+        while True:
+            item = await queue.get()
+            if item is None:
+                queue.task_done()
+                return
+            truck, payload, last = item
+            while True:
+                t0 = time.perf_counter()
+                resp = await client.post("/webhooks/samsara", json=payload)
+                latencies.append(time.perf_counter() - t0)
+                if resp.status_code != 429:
+                    break
+                rejected += 1
+                await asyncio.sleep(0.05)
+            resp.raise_for_status()
+            sent += 1
+            accepted += resp.json()["accepted"]
+            duplicates += resp.json()["duplicates"]
+            if last:
+                closed_at.setdefault(truck_id(truck), time.perf_counter())
+            queue.task_done()
+
+    async with main.app.router.lifespan_context(main.app):
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            t_start = time.perf_counter()
+            senders = [asyncio.create_task(sender(client)) for _ in range(args.concurrency)]
+            # A fraction of readings is held back and delivered after every trip's EngineOff
+            # and a fraction is delivered twice, like a provider retrying after a timeout
+            rng = random.Random(7)
+            late = []
+            retried = []
+            for item in fleet_payloads(args, started_at):
+                if not item[2] and rng.random() < args.late_fraction:
+                    late.append(item)
+                else:
+                    await queue.put(item)
+                if rng.random() < args.duplicate_fraction:
+                    retried.append(item)
+            for item in late:
+                await queue.put(item)
+            half = len(retried) // 2
+            for item in retried[:half]:
+                await queue.put(item)
+            # The rest reach a "process" that never saw the originals: only the unique index stops them
+            await queue.join()
+            main.recent_keys = RecentKeys(main.INGEST_DEDUP_CACHE_SIZE)
+            for item in retried[half:]:
+                await queue.put(item)
+            for _ in senders:
+                await queue.put(None)
+            await asyncio.gather(*senders)
+            send_elapsed = time.perf_counter() - t_start
+
+            deadline = time.perf_counter() + args.timeout
+            while not drained(main.ingest_queue.stats()) and time.perf_counter() < deadline:
+                await asyncio.sleep(0.05)
+            drain_elapsed = time.perf_counter() - t_start
+            while len(issued_at) < args.trucks and time.perf_counter() < deadline:
+                await asyncio.sleep(0.1)
+            total_elapsed = time.perf_counter() - t_start
+            ingest = main.ingest_queue.stats()
+
+    cert_ms = [(issued_at[t] - closed_at[t]) * 1000 for t in issued_at if t in closed_at]
+    webhook_ms = [v * 1000 for v in latencies]
+    jobs = db.tables.get("certificate_jobs", [])
+    return {
+        "config": vars(args),
+        "events_sent": sent,
+        "events_per_s": sent / send_elapsed,
+        "rejected_429": rejected,
+        "webhook_ms": {
+            "p50": percentile(webhook_ms, 50),
+            "p95": percentile(webhook_ms, 95),
+            "p99": percentile(webhook_ms, 99),
+            "max": max(webhook_ms),
+        },
+        "events_stored": len(db.tables.get("reefer_events", [])),
+        "readings": readings_per_trip * args.trucks,
+        "duplicates": {"sent": len(retried), "memory": duplicates,
+                       "database": accepted - len(db.tables.get("reefer_events", []))},
+        "readings_missing_at_close": sum(missing_at_close.values()),
+        "ingest_drain_s": drain_elapsed,
+        "certificates": {
+            "expected": args.trucks,
+            "issued": len(issued_at),
+            "stored": len(db.tables.get("reefer_certificates", [])),
+            "failed": sum(1 for j in jobs if j["status"] == "failed"),
+            "stage_runs": stage_runs,
+            "p50_ms": percentile(cert_ms, 50),
+            "p99_ms": percentile(cert_ms, 99),
+            "max_ms": max(cert_ms) if cert_ms else None,
+        },
+        "anchor_batches": main.polygon_anchor.batches,
+        "stub_http_requests": {host: t.requests for host, t in transports.items()},
+        "db_requests": db.requests,
+        "total_s": total_elapsed,
+        "peak_rss_mb": peak_rss_mb(),
+        "ingest": {k: ingest[k] for k in ("flush_count", "flush_errors", "flush_seconds_avg", "dropped_total")},
+    }
+
+
+METRICS = (
+    ("events_per_s", "events/s", True),
+    ("webhook_ms.p50", "webhook p50 ms", False),
+    ("webhook_ms.p99", "webhook p99 ms", False),
+    ("ingest_drain_s", "ingest drain s", False),
+    ("certificates.p50_ms", "certificate p50 ms", False),
+    ("certificates.p99_ms", "certificate p99 ms", False),
+    ("peak_rss_mb", "peak RSS MB", False),
+    ("db_requests", "db requests", False),
+)
+
+
+def lookup(result: dict, path: str):
+    for key in path.split("."):
+        result = result.get(key) if isinstance(result, dict) else None
+    return result
+
+
+def report(result: dict, baseline=None):
+    certs = result["certificates"]
+    print(f"sent {result['events_sent']} events ({result['events_stored']} stored, "
+          f"{result['rejected_429']} 429s) at {result['events_per_s']:,.0f}/s; "
+          f"{result['readings_missing_at_close']} readings not yet stored when their trip closed")
+    dupes = result["duplicates"]
+    print(f"{dupes['sent']} redeliveries: {dupes['memory']} dropped in memory, {dupes['database']} by the unique index")
+    print(f"certificates {certs['issued']}/{certs['expected']} issued, {certs['failed']} failed, "
+          f"{result['anchor_batches']} anchor batches, total {result['total_s']:.1f}s")
+    print("stage runs: " + ", ".join(f"{name} {count}" for name, count in certs["stage_runs"].items()))
+    for path, label, higher_is_better in METRICS:
+        value = lookup(result, path)
+        line = f"  {label:20} {value:12,.2f}" if value is not None else f"  {label:20} {'-':>12}"
+        old = lookup(baseline, path) if baseline else None
+        if value is not None and old:
+            change = (value - old) / old * 100
+            better = change > 0 if higher_is_better else change < 0
+            line += f"   {old:12,.2f} -> {change:+.1f}%{' (better)' if better and abs(change) >= 1 else ''}"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--trucks", type=int, default=50)
+    parser.add_argument("--hours", type=float, default=6)
+    parser.add_argument("--interval", type=float, default=30, help="seconds between readings per truck")
+    parser.add_argument("--concurrency", type=int, default=100, help="concurrent webhook senders")
+    parser.add_argument("--db-latency-ms", type=float, default=5.0)
+    parser.add_argument("--http-latency-ms", type=float, default=50.0)
+    parser.add_argument("--chain-latency-ms", type=float, default=500.0)
+    parser.add_argument("--cert-workers", type=int, default=4)
+    parser.add_argument("--shards", type=int, default=4, help="INGEST_SHARDS")
+    parser.add_argument("--watermark", type=float, default=2.0, help="TRIP_CLOSE_WATERMARK_SECONDS")
+    parser.add_argument("--late-fraction", type=float, default=0.01, help="readings sent after the trip's EngineOff")
+    parser.add_argument("--duplicate-fraction", type=float, default=0.02, help="readings delivered twice")
+    parser.add_argument("--anchor-window", type=float, default=1.0, help="ANCHOR_BATCH_WINDOW_SECONDS")
+    parser.add_argument("--timeout", type=float, default=300, help="seconds to wait for certificates")
+    parser.add_argument("--out", default="pipeline_replay.json")
+    parser.add_argument("--compare", help="earlier --out file to diff against")
+    args = parser.parse_args()
+
+    configure_env(args)
+    import logging
+    logging.getLogger("reefershield").setLevel(logging.WARNING)
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    result = asyncio.run(run(args))
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    report(result, baseline)
+    with open(args.out, "w") as f:
+        json.dump(result, f, indent=2)
+    print(f"wrote {args.out}")
+    certs = result["certificates"]
+    ok = (certs["issued"] == certs["stored"] == args.trucks and result["events_stored"] == result["readings"]
+          and result["readings_missing_at_close"] == 0
+          and result["anchor_batches"] > 0 and min(certs["stage_runs"].values()) >= args.trucks)
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
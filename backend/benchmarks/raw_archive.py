@@ -0,0 +1,124 @@
+"""Raw payload archive: write throughput, size and offline certificate checks.
+
+    python benchmarks/raw_archive.py --trucks 50 --days 2 --interval 30
+
+Archives a synthetic fleet's native Samsara payloads (from
+benchmarks/samples/) into a temporary directory, compares the hot-row size
+with and without raw_payload, replays one trip through the memory-mapped
+reader, and checks a rendered certificate with `archive.verify_certificate`
+before and after tampering with one archived payload.
+"""
+import argparse
+import asyncio
+import copy
+import json
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from archive import ArchiveReader, RawArchive, archive_lines, verify_certificate
+from certificate_pdf import CertificateTemplate, render_certificate_pdf
+from ipfs import pack_car
+from normalizers import normalize
+
+SAMPLES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "samples")
+USER_ID = "00000000-0000-0000-0000-000000000001"
+
+
+def fleet_payloads(trucks: int, days: float, interval: float):
+    with open(os.path.join(SAMPLES, "samsara.ndjson")) as f:
+        template = json.loads(f.readline())
+    start = datetime(2026, 3, 2, tzinfo=timezone.utc)
+    steps = int(days * 86400 / interval)
+    for step in range(steps):
+        at = (start + timedelta(seconds=step * interval)).isoformat().replace("+00:00", "Z")
+        for truck in range(trucks):
+            payload = copy.deepcopy(template)
+            payload["eventId"] = f"{truck}-{step}"
+            payload["eventTime"] = at
+            payload["data"]["vehicle"]["id"] = str(truck)
+            payload["data"]["reeferStats"]["returnAirTemperatureMilliC"] = -17800 + (step * 7 + truck) % 400
+            yield f"00000000-0000-0000-0000-{truck:012d}", payload
+
+
+async def archive_fleet(root: str, args):
+    archive = RawArchive(root, segment_rows=args.segment_rows, segment_seconds=3600)
+    rows = []
+    started = time.perf_counter()
+    for truck_id, payload in fleet_payloads(args.trucks, args.days, args.interval):
+        event = normalize("samsara", payload)
+        event.user_id, event.truck_id = USER_ID, truck_id
+        full_row = json.dumps(event.to_row())
+        event.raw_ref = archive.add(USER_ID, truck_id, event.occurred_at, "samsara", payload)
+        rows.append((len(full_row), len(json.dumps(event.to_row()))))
+    await archive.stop()
+    return archive, rows, time.perf_counter() - started
+
+
+def tamper(root: str, reader: ArchiveReader, truck_id: str, start, end):
+    name = reader.segments(truck_id, start, end, USER_ID)[0]
+    path = os.path.join(root, name)
+    table = pq.read_table(path)
+    payloads = table.column("payload").to_pylist()
+    times = table.column("occurred_at").to_pylist()
+    i = next(i for i, at in enumerate(times) if start <= at <= end)
+    payloads[i] = payloads[i].replace("-17", "-16", 1)
+    table = table.set_column(2, table.schema.field("payload"), pa.array(payloads))
+    pq.write_table(table, path, compression="zstd")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--trucks", type=int, default=50)
+    parser.add_argument("--days", type=float, default=2)
+    parser.add_argument("--interval", type=float, default=30, help="seconds between readings")
+    parser.add_argument("--segment-rows", type=int, default=10000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as root:
+        archive, rows, elapsed = asyncio.run(archive_fleet(root, args))
+        stats = archive.stats()
+        json_bytes = sum(full for full, _ in rows)
+        print(f"archived {stats['archived']} payloads in {elapsed:.2f}s ({stats['archived'] / elapsed:,.0f}/s), "
+              f"{stats['segments_written']} segments, {stats['bytes_written'] / 1e6:.1f} MB on disk")
+        print(f"hot row JSON: {json_bytes / len(rows):.0f} B with raw_payload, "
+              f"{sum(r for _, r in rows) / len(rows):.0f} B with raw_ref; "
+              f"archive {stats['bytes_written'] / len(rows):.0f} B/payload")
+
+        reader = ArchiveReader(root)
+        truck_id = "00000000-0000-0000-0000-000000000003"
+        start = datetime(2026, 3, 2, 6, tzinfo=timezone.utc)
+        end = start + timedelta(hours=min(36, args.days * 24 - 6))
+        t0 = time.perf_counter()
+        sha256, count = reader.trip_digest(truck_id, start, end, USER_ID)
+        print(f"trip replay: {count} payloads digested in {(time.perf_counter() - t0) * 1000:.1f} ms")
+
+        cutoff = datetime.now(timezone.utc)
+        template = CertificateTemplate([
+            f"Truck ID: {truck_id}",
+            f"Started: {start.isoformat()}",
+            f"Completed: {end.isoformat()}",
+            *archive_lines(sha256, count, cutoff),
+        ])
+        pdf = render_certificate_pdf(template, None, None)
+        cid, _ = pack_car(pdf)
+        ok, notes = verify_certificate(pdf, reader, cid)
+        print("\n".join(notes))
+        tamper(root, reader, truck_id, start, end)
+        tampered_ok, notes = verify_certificate(pdf, reader, cid)
+        print("after tampering:", notes[-1])
+
+    good = ok and not tampered_ok
+    print("OK" if good else "FAIL")
+    sys.exit(0 if good else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""Local stand-in for Supabase/PostgREST and third-party HTTP APIs.
+
+Every request is answered after an optional artificial delay: PostgREST
+writes echo the posted rows back, reads return an empty list and anything
+else gets `{}` (or a 503 for every `fail_every`-th such request, to exercise
+retries). Used by the benchmarks so they never leave the machine.
+"""
+import asyncio
+import json
+import socket
+import threading
+import time
+
+import uvicorn
+
+
+class StubApp:
+    def __init__(self, latency_ms: float = 0.0, fail_every: int = 0):
+        self.latency = latency_ms / 1000
+        self.fail_every = fail_every
+        self.requests = 0
+        self.other_requests = 0
+        self.bodies = []
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            while True:
+                message = await receive()
+                if message["type"] == "lifespan.startup":
+                    await send({"type": "lifespan.startup.complete"})
+                elif message["type"] == "lifespan.shutdown":
+                    await send({"type": "lifespan.shutdown.complete"})
+                    return
+        body = b""
+        while True:
+            message = await receive()
+            body += message.get("body", b"")
+            if not message.get("more_body"):
+                break
+        self.requests += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        method = scope["method"]
+        if scope["path"].startswith("/rest/v1/"):
+            if method in ("POST", "PATCH"):
+                status, payload = 201, body or b"[]"
+                if not payload.lstrip().startswith(b"["):
+                    payload = b"[" + payload + b"]"
+            else:
+                status, payload = 200, b"[]"
+        else:
+            self.other_requests += 1
+            if self.fail_every and self.other_requests % self.fail_every == 0:
+                status, payload = 503, json.dumps({"message": "stub failure"}).encode()
+            else:
+                self.bodies.append(body)
+                status, payload = 200, json.dumps({}).encode()
+        await send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": [(b"content-type", b"application/json")],
+        })
+        await send({"type": "http.response.body", "body": payload})
+
+
+def start_stub_server(latency_ms: float = 0.0, fail_every: int = 0):
+    """Start the stub on a free local port in a daemon thread; returns (base_url, app)."""
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+
+    app = StubApp(latency_ms, fail_every)
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.01)
+    return f"http://127.0.0.1:{port}", app
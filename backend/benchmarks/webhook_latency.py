@@ -0,0 +1,86 @@
+"""Webhook latency under concurrent load against a local stub server.
+
+    python benchmarks/webhook_latency.py --requests 5000 --concurrency 200 --latency-ms 20
+
+Supabase is pointed at benchmarks/stub_server.py, which adds --latency-ms to
+every PostgREST call to mimic a remote database.
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from stub_server import start_stub_server
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))
+    return values[index]
+
+
+async def run(args):
+    import httpx
+    import main
+
+    latencies = []
+    queue = asyncio.Queue()
+    for i in range(args.requests):
+        queue.put_nowait(i)
+
+    async def worker(client):
+        while True:
+            try:
+                i = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            payload = {
+                "user_id": "00000000-0000-0000-0000-000000000001",
+                "truck_id": f"00000000-0000-0000-0000-{i % args.trucks:012d}",
+                "event_type": "temperature",
+                "cargo_type": "frozen",
+                "temperature": 0,
+            }
+            started = time.perf_counter()
+            resp = await client.post("/webhooks/samsara", json=payload)
+            latencies.append(time.perf_counter() - started)
+            resp.raise_for_status()
+
+    async with main.app.router.lifespan_context(main.app):
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            started = time.perf_counter()
+            await asyncio.gather(*(worker(client) for _ in range(args.concurrency)))
+            elapsed = time.perf_counter() - started
+    stats = main.ingest_queue.stats()
+
+    ms = [v * 1000 for v in latencies]
+    print(f"requests={args.requests} concurrency={args.concurrency} stub_latency_ms={args.latency_ms}")
+    print(f"throughput={args.requests / elapsed:.0f} req/s")
+    print(f"p50={percentile(ms, 50):.2f}ms p95={percentile(ms, 95):.2f}ms p99={percentile(ms, 99):.2f}ms "
+          f"mean={statistics.mean(ms):.2f}ms max={max(ms):.2f}ms")
+    print(f"flushes={stats['flush_count']} avg_flush_ms={stats['flush_seconds_avg'] * 1000:.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--trucks", type=int, default=300)
+    parser.add_argument("--latency-ms", type=float, default=20.0)
+    args = parser.parse_args()
+
+    base_url, _ = start_stub_server(args.latency_ms)
+    os.environ["BACKEND_SUPABASE_URL"] = base_url
+    os.environ["BACKEND_SUPABASE_SERVICE_ROLE_KEY"] = "stub-service-role-key"
+    import logging
+    logging.disable(logging.INFO)
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,283 @@
+"""Certificate issuance workers for the durable `certificate_jobs` queue.
+
+    python cert_worker.py                      # CERT_WORKER_PROCESSES x CERT_WORKER_CONCURRENCY
+    python cert_worker.py --processes 4 --concurrency 2
+
+Jobs are claimed through the `claim_certificate_job` RPC (FOR UPDATE SKIP
+LOCKED with a lease), so any number of processes can share the table. A
+failed stage is retried with exponential backoff; completed stages are never
+re-run.
+
+With Polygon configured, the anchor stage parks the job as `anchoring`. One
+AnchorBatcher (in the first worker process) collects those jobs every
+ANCHOR_BATCH_WINDOW_SECONDS, sends a single transaction for their Merkle root
+and hands each job back with its inclusion proof.
+"""
+import argparse
+import asyncio
+import importlib
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional
+
+import main
+from metrics import EXTERNAL_ERRORS, start_metrics_server, stage
+from clients import close_http_clients
+
+logger = logging.getLogger("reefershield")
+
+CERT_WORKER_PROCESSES = int(os.getenv("CERT_WORKER_PROCESSES", "2"))
+CERT_WORKER_CONCURRENCY = int(os.getenv("CERT_WORKER_CONCURRENCY", "2"))
+CERT_JOB_MAX_ATTEMPTS = int(os.getenv("CERT_JOB_MAX_ATTEMPTS", "6"))
+CERT_JOB_BACKOFF_SECONDS = float(os.getenv("CERT_JOB_BACKOFF_SECONDS", "30"))
+CERT_JOB_BACKOFF_MAX_SECONDS = float(os.getenv("CERT_JOB_BACKOFF_MAX_SECONDS", "3600"))
+CERT_JOB_POLL_SECONDS = float(os.getenv("CERT_JOB_POLL_SECONDS", "2"))
+# A running job whose worker died is handed out again after this long
+CERT_JOB_LEASE_SECONDS = int(os.getenv("CERT_JOB_LEASE_SECONDS", "600"))
+# Worker i serves Prometheus metrics on CERT_WORKER_METRICS_PORT + i (unset = off)
+CERT_WORKER_METRICS_PORT = int(os.getenv("CERT_WORKER_METRICS_PORT", "0"))
+
+
+def backoff_seconds(attempts: int) -> float:
+    return min(CERT_JOB_BACKOFF_MAX_SECONDS, CERT_JOB_BACKOFF_SECONDS * 2 ** (attempts - 1))
+
+
+async def claim_job(worker_id: str) -> Optional[dict]:
+    resp = await main.supabase.rpc("claim_certificate_job", {
+        "worker": worker_id,
+        "lease_seconds": CERT_JOB_LEASE_SECONDS,
+    }).execute()
+    return resp.data[0] if resp.data else None
+
+
+async def update_job(job_id: str, fields: dict):
+    fields["updated_at"] = datetime.now(timezone.utc).isoformat()
+    await main.supabase.table("certificate_jobs").update(fields).eq("id", job_id).execute()
+
+
+async def process_job(job: dict):
+    stage = job["stage"]
+    while stage != "done":
+        if stage == "anchor" and main.polygon_anchor:
+            await update_job(job["id"], {"status": "anchoring", "locked_by": None, "locked_at": None})
+            return
+        try:
+            updates = await main.run_certificate_stage(stage, job)
+        except Exception as e:
+            attempts = job["attempts"] + 1
+            failed = attempts >= CERT_JOB_MAX_ATTEMPTS
+            delay = backoff_seconds(attempts)
+            logger.error("Certificate job %s stage %s failed (attempt %d/%d): %s",
+                         job["trip_id"], stage, attempts, CERT_JOB_MAX_ATTEMPTS, e)
+            await update_job(job["id"], {
+                "status": "failed" if failed else "pending",
+                "attempts": attempts,
+                "last_error": f"{stage}: {e}"[:1000],
+                "next_attempt_at": (datetime.now(timezone.utc) + timedelta(seconds=delay)).isoformat(),
+                "locked_by": None,
+                "locked_at": None,
+            })
+            return
+
+        index = main.CERTIFICATE_STAGES.index(stage)
+        stage = main.CERTIFICATE_STAGES[index + 1] if index + 1 < len(main.CERTIFICATE_STAGES) else "done"
+        job.update(updates)
+        job["stage"] = stage
+        job["attempts"] = 0
+        fields = {**updates, "stage": stage, "attempts": 0, "last_error": None}
+        if stage == "done":
+            fields.update({"status": "done", "locked_by": None, "locked_at": None})
+        await update_job(job["id"], fields)
+    logger.info("Certificate issued for trip %s", job["trip_id"])
+
+
+class CertificateWorkerPool:
+    """`concurrency` polling loops in the current event loop."""
+
+    def __init__(self, worker_id: str, concurrency: int):
+        self.worker_id = worker_id
+        self.concurrency = concurrency
+        self._stopping = asyncio.Event()
+        self._tasks: List[asyncio.Task] = []
+
+    def start(self):
+        self._tasks = [asyncio.create_task(self._loop(f"{self.worker_id}:{i}")) for i in range(self.concurrency)]
+
+    async def stop(self):
+        # Lets in-flight jobs finish their current stage chain
+        self._stopping.set()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _loop(self, worker_id: str):
+        while not self._stopping.is_set():
+            try:
+                job = await claim_job(worker_id)
+            except Exception as e:
+                logger.error("Claiming certificate job failed: %s", e)
+                job = None
+            if job is None:
+                try:
+                    await asyncio.wait_for(self._stopping.wait(), timeout=CERT_JOB_POLL_SECONDS)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            try:
+                await process_job(job)
+            except Exception as e:
+                # Job stays leased and is picked up again once the lease expires
+                logger.error("Certificate job %s crashed: %s", job.get("trip_id"), e)
+
+
+async def claim_anchor_batch(worker_id: str) -> List[dict]:
+    resp = await main.supabase.rpc("claim_anchor_batch", {
+        "worker": worker_id,
+        "max_jobs": main.ANCHOR_BATCH_MAX,
+        "lease_seconds": CERT_JOB_LEASE_SECONDS,
+    }).execute()
+    return resp.data or []
+
+
+async def anchor_batch(jobs: List[dict]):
+    # web3 is only loaded by the process that anchors
+    from web3 import Web3
+    from anchoring import MerkleTree, leaf_hash
+
+    # Same leaf as the old per-certificate transaction: keccak of the CID
+    tree = MerkleTree([leaf_hash(job.get("ipfs_cid") or job["trip_id"]) for job in jobs])
+    root = Web3.to_hex(tree.root)
+    try:
+        with stage("polygon_send"):
+            # The first call builds the anchor client, off the event loop
+            tx_hash = await asyncio.to_thread(lambda: main.polygon_anchor.anchor_root(tree.root))
+    except Exception as e:
+        EXTERNAL_ERRORS.inc(provider="polygon")
+        logger.error("Anchoring batch of %d certificates failed: %s", len(jobs), e)
+        now = datetime.now(timezone.utc)
+        await asyncio.gather(*(update_job(job["id"], {
+            "status": "failed" if job["attempts"] + 1 >= CERT_JOB_MAX_ATTEMPTS else "anchoring",
+            "attempts": job["attempts"] + 1,
+            "last_error": f"anchor: {e}"[:1000],
+            "next_attempt_at": (now + timedelta(seconds=backoff_seconds(job["attempts"] + 1))).isoformat(),
+            "locked_by": None,
+            "locked_at": None,
+        }) for job in jobs))
+        return
+    logger.info("Anchored %d certificates in %s (root %s)", len(jobs), tx_hash, root)
+    now = datetime.now(timezone.utc).isoformat()
+    next_stage = main.CERTIFICATE_STAGES[main.CERTIFICATE_STAGES.index("anchor") + 1]
+    await asyncio.gather(*(update_job(job["id"], {
+        "polygon_tx_hash": tx_hash,
+        "merkle_root": root,
+        "merkle_proof": [Web3.to_hex(p) for p in tree.proof(i)],
+        "stage": next_stage,
+        "status": "pending",
+        "attempts": 0,
+        "last_error": None,
+        "next_attempt_at": now,
+        "locked_by": None,
+        "locked_at": None,
+    }) for i, job in enumerate(jobs)))
+
+
+class AnchorBatcher:
+    """Anchors every job parked in `anchoring` once per batch window.
+
+    Run one per deployment: batches are claimed with SKIP LOCKED, but all
+    batchers share the same wallet and its nonce sequence.
+    """
+
+    def __init__(self, worker_id: str):
+        self.worker_id = f"{worker_id}:anchor"
+        self._stopping = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        self._stopping.set()
+        if self._task:
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _loop(self):
+        # Load web3 in a thread so the first batch doesn't stall the event loop
+        await asyncio.to_thread(importlib.import_module, "anchoring")
+        while not self._stopping.is_set():
+            try:
+                await asyncio.wait_for(self._stopping.wait(), timeout=main.ANCHOR_BATCH_WINDOW_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            try:
+                # Drain everything due, one transaction per ANCHOR_BATCH_MAX jobs
+                while True:
+                    jobs = await claim_anchor_batch(self.worker_id)
+                    if jobs:
+                        await anchor_batch(jobs)
+                    if len(jobs) < main.ANCHOR_BATCH_MAX:
+                        break
+            except Exception as e:
+                logger.error("Anchor batch loop failed: %s", e)
+
+
+def run_worker_process(concurrency: int, anchor: bool = False, metrics_port: int = 0):
+    if metrics_port:
+        start_metrics_server(metrics_port)
+
+    async def _run():
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(sig, stop.set)
+        worker_id = f"{socket.gethostname()}-{os.getpid()}"
+        pool = CertificateWorkerPool(worker_id, concurrency)
+        pool.start()
+        batcher = AnchorBatcher(worker_id) if anchor and main.polygon_anchor else None
+        if batcher:
+            batcher.start()
+        await stop.wait()
+        await pool.stop()
+        if batcher:
+            await batcher.stop()
+        await close_http_clients()
+
+    asyncio.run(_run())
+
+
+def run():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--processes", type=int, default=CERT_WORKER_PROCESSES)
+    parser.add_argument("--concurrency", type=int, default=CERT_WORKER_CONCURRENCY)
+    parser.add_argument("--no-anchor", action="store_true", help="don't run the batch anchor loop here")
+    args = parser.parse_args()
+
+    procs = [
+        multiprocessing.Process(
+            target=run_worker_process,
+            args=(args.concurrency, i == 0 and not args.no_anchor, CERT_WORKER_METRICS_PORT + i if CERT_WORKER_METRICS_PORT else 0),
+            name=f"cert-worker-{i}",
+        )
+        for i in range(args.processes)
+    ]
+    for proc in procs:
+        proc.start()
+    logger.info("Started %d certificate worker processes x %d", args.processes, args.concurrency)
+
+    def _forward(signum, frame):
+        for proc in procs:
+            if proc.is_alive():
+                os.kill(proc.pid, signal.SIGTERM)
+
+    signal.signal(signal.SIGTERM, _forward)
+    signal.signal(signal.SIGINT, _forward)
+    for proc in procs:
+        proc.join()
+
+
+if __name__ == "__main__":
+    run()
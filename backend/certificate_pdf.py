@@ -0,0 +1,257 @@
+import io
+from dataclasses import dataclass
+from datetime import datetime
+from typing import List, Optional
+
+import numpy as np
+
+# reportlab.lib.pagesizes.A4 in points. reportlab, qrcode and PIL are imported
+# by render_certificate_pdf, so webhook-only processes never load them.
+A4 = (595.2755905511812, 841.8897637795277)
+
+GRAPH_LEFT = 50
+GRAPH_BOTTOM = 250
+GRAPH_HEIGHT = 200
+# Samples per point of plot width; reportlab's user space is 72 dpi, so 4
+# keeps the line exact at print resolution.
+GRAPH_SAMPLES_PER_PT = 4
+
+
+def parse_ts(value: str) -> float:
+    return datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+
+
+class GraphReducer:
+    """Streaming M4 decimation over a fixed time window.
+
+    The window is split into `bins` columns and each keeps only its first,
+    last, min and max point, so memory is constant however many readings
+    are fed in. The drawn line is identical to plotting every point as long
+    as `bins` is at least the plot's pixel width.
+    """
+
+    def __init__(self, t_start: float, t_end: float, bins: int):
+        self.t_start = t_start
+        self.span = max(t_end - t_start, 0.0)
+        self.bins = bins
+        self.first_t = np.full(bins, np.inf)
+        self.first_y = np.zeros(bins)
+        self.last_t = np.full(bins, -np.inf)
+        self.last_y = np.zeros(bins)
+        self.min_t = np.zeros(bins)
+        self.min_y = np.full(bins, np.inf)
+        self.max_t = np.zeros(bins)
+        self.max_y = np.full(bins, -np.inf)
+        self.count = 0
+
+    def add(self, times: np.ndarray, temps: np.ndarray):
+        n = len(times)
+        if not n:
+            return
+        if self.span:
+            b = ((times - self.t_start) * (self.bins / self.span)).astype(np.int64)
+            np.clip(b, 0, self.bins - 1, out=b)
+        else:
+            b = np.zeros(n, dtype=np.int64)
+        order = np.lexsort((times, b))
+        times, temps, b = times[order], temps[order], b[order]
+        starts = np.flatnonzero(np.r_[True, b[1:] != b[:-1]])
+        ends = np.r_[starts[1:], n] - 1
+        ub = b[starts]
+        # Sorting by (bin, temp) keeps each bin in the same slots, so its
+        # first and last entries are the bin's min and max.
+        by_temp = np.lexsort((temps, b))
+        mins, maxs = by_temp[starts], by_temp[ends]
+
+        sel = times[starts] < self.first_t[ub]
+        self.first_t[ub[sel]], self.first_y[ub[sel]] = times[starts[sel]], temps[starts[sel]]
+        sel = times[ends] >= self.last_t[ub]
+        self.last_t[ub[sel]], self.last_y[ub[sel]] = times[ends[sel]], temps[ends[sel]]
+        sel = temps[mins] < self.min_y[ub]
+        self.min_t[ub[sel]], self.min_y[ub[sel]] = times[mins[sel]], temps[mins[sel]]
+        sel = temps[maxs] > self.max_y[ub]
+        self.max_t[ub[sel]], self.max_y[ub[sel]] = times[maxs[sel]], temps[maxs[sel]]
+        self.count += n
+
+    def points(self):
+        used = np.isfinite(self.first_t)
+        t = np.concatenate((self.first_t[used], self.min_t[used], self.max_t[used], self.last_t[used]))
+        y = np.concatenate((self.first_y[used], self.min_y[used], self.max_y[used], self.last_y[used]))
+        order = np.lexsort((y, t))
+        t, y = t[order], y[order]
+        keep = np.r_[True, (t[1:] != t[:-1]) | (y[1:] != y[:-1])]
+        return t[keep], y[keep]
+
+
+@dataclass
+class CertificateTemplate:
+    """Everything on the certificate except the anchors, computed once per trip."""
+    header_lines: List[str]
+    graph_x: Optional[np.ndarray] = None
+    graph_y: Optional[np.ndarray] = None
+    min_temp: Optional[float] = None
+    max_temp: Optional[float] = None
+    points: int = 0
+    raw_sha256: Optional[str] = None  # digest of the trip's archived raw payloads
+
+
+class CertificateTemplateBuilder:
+    """Builds a CertificateTemplate from event pages fed in time order."""
+
+    def __init__(self, trip, t_start: float, t_end: float):
+        self.trip = trip
+        width, _ = A4
+        self.graph_width = width - 100
+        self.reducer = GraphReducer(t_start, t_end, int(self.graph_width * GRAPH_SAMPLES_PER_PT))
+
+    @classmethod
+    def for_trip(cls, trip):
+        return cls(trip, parse_ts(trip["started_at"]), parse_ts(trip["ended_at"]))
+
+    def add_events(self, events):
+        times, temps = event_arrays(events)
+        self.reducer.add(times, temps)
+
+    def build(self) -> CertificateTemplate:
+        trip = self.trip
+        template = CertificateTemplate([
+            f"Trip ID: {trip['id']}",
+            f"Truck ID: {trip['truck_id']}",
+            f"Cargo Type: {trip.get('cargo_type') or 'N/A'}",
+            f"Origin: {trip.get('origin') or 'N/A'}",
+            f"Destination: {trip.get('destination') or 'N/A'}",
+            f"Started: {trip.get('started_at')}",
+            f"Completed: {trip.get('ended_at')}",
+        ])
+        if not self.reducer.count:
+            return template
+
+        times, temps = self.reducer.points()
+        min_t, max_t = times[0], times[-1]
+        min_temp, max_temp = float(temps.min()), float(temps.max())
+        if max_t == min_t:
+            xs = np.full(len(times), float(GRAPH_LEFT))
+        else:
+            xs = GRAPH_LEFT + (times - min_t) / (max_t - min_t) * self.graph_width
+        if max_temp == min_temp:
+            ys = np.full(len(temps), float(GRAPH_BOTTOM))
+        else:
+            ys = GRAPH_BOTTOM + (temps - min_temp) / (max_temp - min_temp) * GRAPH_HEIGHT
+
+        template.graph_x, template.graph_y = xs, ys
+        template.min_temp, template.max_temp = min_temp, max_temp
+        template.points = self.reducer.count
+        return template
+
+
+def event_arrays(events):
+    readings = [(parse_ts(e["occurred_at"]), float(e["temperature"]))
+                for e in events if e.get("temperature") is not None]
+    arr = np.array(readings, dtype=np.float64).reshape(-1, 2)
+    return arr[:, 0], arr[:, 1]
+
+
+def build_certificate_template(trip, events) -> CertificateTemplate:
+    times, temps = event_arrays(events)
+    builder = CertificateTemplateBuilder(trip, times.min(initial=np.inf), times.max(initial=-np.inf))
+    builder.reducer.add(times, temps)
+    return builder.build()
+
+
+def _fmt_temp(value: float):
+    return int(value) if value == int(value) else value
+
+
+def render_certificate_pdf(template: CertificateTemplate, ipfs_cid: Optional[str], polygon_tx: Optional[str],
+                           merkle_root: Optional[str] = None) -> bytes:
+    from reportlab.pdfgen import canvas
+
+    buff = io.BytesIO()
+    # Invariant output (no timestamp / random document ID): the same template
+    # always renders the same bytes, so the IPFS CID can be recomputed later
+    c = canvas.Canvas(buff, pagesize=A4, invariant=1)
+    width, height = A4
+
+    c.setFillColorRGB(0, 0.5, 1)
+    c.setFont("Helvetica-Bold", 20)
+    c.drawString(50, height - 50, "ReeferShield Certificate of Temperature Integrity")
+
+    c.setFillColorRGB(1, 1, 1)
+    c.setFont("Helvetica", 10)
+    y = height - 90
+    for line in template.header_lines:
+        c.drawString(50, y, line)
+        y -= 14
+
+    # Temperature graph as a single path from the precomputed, decimated points
+    if template.graph_x is not None:
+        c.setStrokeColorRGB(0.3, 0.3, 0.3)
+        c.rect(GRAPH_LEFT, GRAPH_BOTTOM, width - 100, GRAPH_HEIGHT)
+
+        c.setStrokeColorRGB(0, 0.7, 1)
+        c.setLineWidth(1.5)
+        path = c.beginPath()
+        xs, ys = template.graph_x.tolist(), template.graph_y.tolist()
+        path.moveTo(xs[0], ys[0])
+        for x, y in zip(xs[1:], ys[1:]):
+            path.lineTo(x, y)
+        c.drawPath(path, stroke=1, fill=0)
+
+        c.setFont("Helvetica", 8)
+        c.drawString(GRAPH_LEFT, GRAPH_BOTTOM - 12,
+                     f"Min temp: {_fmt_temp(template.min_temp)}  Max temp: {_fmt_temp(template.max_temp)}")
+
+    # IPFS / Polygon details
+    y = 200
+    c.setFont("Helvetica-Bold", 10)
+    c.drawString(50, y, "Tamper‑proof anchors")
+    c.setFont("Helvetica", 9)
+    y -= 14
+    if ipfs_cid:
+        c.drawString(50, y, f"IPFS CID: {ipfs_cid}")
+        y -= 12
+        c.drawString(50, y, f"IPFS Gateway: https://{ipfs_cid}.ipfs.w3s.link")
+        y -= 14
+    if polygon_tx:
+        c.drawString(50, y, f"Polygon Tx: {polygon_tx}")
+        y -= 12
+        c.drawString(50, y, f"Polygonscan: https://polygonscan.com/tx/{polygon_tx}")
+        y -= 14
+    if merkle_root:
+        # The tx anchors a batch; the inclusion proof is stored with the certificate
+        c.drawString(50, y, f"Merkle root: {merkle_root}")
+        y -= 14
+
+    # QR code linking to Polygonscan if present, otherwise IPFS
+    qr_target = None
+    if polygon_tx:
+        qr_target = f"https://polygonscan.com/tx/{polygon_tx}"
+    elif ipfs_cid:
+        qr_target = f"https://{ipfs_cid}.ipfs.w3s.link"
+
+    if qr_target:
+        import qrcode
+        from PIL import Image
+
+        qr = qrcode.QRCode(box_size=2, border=2)
+        qr.add_data(qr_target)
+        qr.make(fit=True)
+        img = qr.make_image(fill_color="black", back_color="white")
+        img_buff = io.BytesIO()
+        img.save(img_buff, format="PNG")
+        img_buff.seek(0)
+        qr_x = width - 150
+        qr_y = 50
+        c.drawInlineImage(Image.open(img_buff), qr_x, qr_y, width=100, height=100)
+        c.setFont("Helvetica", 7)
+        c.drawString(qr_x, qr_y + 105, "Scan to verify immutability")
+
+    c.showPage()
+    c.save()
+    pdf_bytes = buff.getvalue()
+    buff.close()
+    return pdf_bytes
+
+
+def generate_certificate_pdf(trip, events, ipfs_cid: Optional[str], polygon_tx: Optional[str]) -> bytes:
+    return render_certificate_pdf(build_certificate_template(trip, events), ipfs_cid, polygon_tx)
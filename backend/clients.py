@@ -0,0 +1,60 @@
+import os
+from typing import Callable, Dict, Optional
+
+import httpx
+
+HTTP_MAX_CONNECTIONS_PER_HOST = int(os.getenv("HTTP_MAX_CONNECTIONS_PER_HOST", "20"))
+HTTP_MAX_KEEPALIVE_PER_HOST = int(os.getenv("HTTP_MAX_KEEPALIVE_PER_HOST", "10"))
+HTTP_TIMEOUT_SECONDS = float(os.getenv("HTTP_TIMEOUT_SECONDS", "15"))
+HTTP_CONNECT_TIMEOUT_SECONDS = float(os.getenv("HTTP_CONNECT_TIMEOUT_SECONDS", "5"))
+
+# One pooled keep-alive client per upstream host, so a slow provider can only
+# tie up its own connections.
+_clients: Dict[str, httpx.AsyncClient] = {}
+
+
+def http_client(url: str) -> httpx.AsyncClient:
+    host = httpx.URL(url).host
+    client = _clients.get(host)
+    if client is None or client.is_closed:
+        client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=HTTP_MAX_CONNECTIONS_PER_HOST,
+                max_keepalive_connections=HTTP_MAX_KEEPALIVE_PER_HOST,
+            ),
+            timeout=httpx.Timeout(HTTP_TIMEOUT_SECONDS, connect=HTTP_CONNECT_TIMEOUT_SECONDS),
+        )
+        _clients[host] = client
+    return client
+
+
+async def close_http_clients():
+    clients = list(_clients.values())
+    _clients.clear()
+    for client in clients:
+        await client.aclose()
+
+
+class LazyClient:
+    """Builds a client on first attribute access and proxies to it from then on.
+
+    Keeps SDK imports and connection setup off the import path. The client is
+    rebuilt when `healthy(client)` is False, e.g. once its pooled connections
+    were closed by a shutdown.
+    """
+
+    def __init__(self, build: Callable[[], object], healthy: Optional[Callable[[object], bool]] = None):
+        self._build = build
+        self._healthy = healthy
+        self._client = None
+        self.builds = 0
+
+    def get(self):
+        client = self._client
+        if client is None or (self._healthy and not self._healthy(client)):
+            client = self._client = self._build()
+            self.builds += 1
+        return client
+
+    def __getattr__(self, name):
+        return getattr(self.get(), name)
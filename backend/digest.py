@@ -0,0 +1,60 @@
+from dataclasses import asdict, dataclass
+from html import escape
+from typing import Iterable, Iterator, List
+
+# Resend's /emails/batch accepts at most 100 messages per call
+DIGEST_BATCH_SIZE = 100
+DIGEST_SUBJECT = "ReeferShield daily digest"
+
+DIGEST_TEMPLATE = "<h2>Your ReeferShield daily digest</h2><ul>{items}</ul>{more}"
+DIGEST_ITEM = "<li>Truck {truck_id} – Trip {trip_id} – Created {created_at}</li>"
+DIGEST_MORE = "<p>…and {count} more in your ReeferShield dashboard.</p>"
+
+
+@dataclass
+class DigestMetrics:
+    users: int = 0
+    emails: int = 0
+    batches: int = 0
+    failed_batches: int = 0
+    failed_emails: int = 0
+    pages: int = 0
+    query_s: float = 0.0
+    render_s: float = 0.0
+    send_s: float = 0.0
+    total_s: float = 0.0
+
+    def to_dict(self) -> dict:
+        return {k: round(v, 3) if isinstance(v, float) else v for k, v in asdict(self).items()}
+
+
+def render_digest_html(certificates: List[dict], total: int) -> str:
+    items = "".join(
+        DIGEST_ITEM.format(
+            truck_id=escape(str(c.get("truck_id"))),
+            trip_id=escape(str(c.get("trip_id"))),
+            created_at=escape(str(c.get("created_at"))),
+        )
+        for c in certificates
+    )
+    more = DIGEST_MORE.format(count=total - len(certificates)) if total > len(certificates) else ""
+    return DIGEST_TEMPLATE.format(items=items, more=more)
+
+
+def digest_messages(rows: Iterable[dict], from_email: str) -> List[dict]:
+    """One Resend message per `daily_digest_page` row."""
+    return [
+        {
+            "from": from_email,
+            "to": [row["email"]],
+            "subject": DIGEST_SUBJECT,
+            "html": render_digest_html(row["certificates"], row["total"]),
+        }
+        for row in rows
+        if row.get("email")
+    ]
+
+
+def batches(items: List[dict], size: int = DIGEST_BATCH_SIZE) -> Iterator[List[dict]]:
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
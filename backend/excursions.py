@@ -0,0 +1,309 @@
+from collections import deque
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+
+@dataclass(frozen=True)
+class CargoThresholds:
+    low: float
+    high: float
+    # An excursion only ends once the temperature is back inside
+    # [low + hysteresis, high - hysteresis], so readings hovering on the
+    # boundary don't flap in and out.
+    hysteresis: float = 1.0
+    # Out-of-range runs shorter than this are treated as noise
+    min_duration_s: float = 300.0
+
+
+DEFAULT_CARGO_RANGES = {
+    "frozen": (-20, 10),
+    "fresh": (30, 40),
+    "produce": (34, 42),
+}
+
+
+def build_thresholds(overrides: Optional[dict] = None, hysteresis: float = 1.0,
+                     min_duration_s: float = 300.0) -> Dict[str, CargoThresholds]:
+    thresholds = {
+        cargo: CargoThresholds(low, high, hysteresis, min_duration_s)
+        for cargo, (low, high) in DEFAULT_CARGO_RANGES.items()
+    }
+    for cargo, cfg in (overrides or {}).items():
+        thresholds[cargo.lower()] = CargoThresholds(
+            float(cfg["low"]),
+            float(cfg["high"]),
+            float(cfg.get("hysteresis", hysteresis)),
+            float(cfg.get("min_duration_s", min_duration_s)),
+        )
+    return thresholds
+
+
+@dataclass
+class Excursion:
+    truck_id: str
+    cargo_type: str
+    started_at: float
+    ended_at: Optional[float]
+    peak_temperature: float
+    readings: int
+
+    @property
+    def duration_s(self) -> Optional[float]:
+        if self.ended_at is None:
+            return None
+        return self.ended_at - self.started_at
+
+    def to_dict(self) -> dict:
+        return {
+            "truck_id": self.truck_id,
+            "cargo_type": self.cargo_type,
+            "started_at": _iso(self.started_at),
+            "ended_at": _iso(self.ended_at) if self.ended_at is not None else None,
+            "duration_s": self.duration_s,
+            "peak_temperature": self.peak_temperature,
+            "readings": self.readings,
+        }
+
+
+@dataclass
+class TruckState:
+    cargo_type: Optional[str] = None
+    latched: bool = False
+    run_start: float = 0.0
+    run_min: float = np.inf
+    run_max: float = -np.inf
+    run_readings: int = 0
+    confirmed: bool = False
+    last_time: float = -np.inf
+    last_recovery: Optional[float] = None
+    history: deque = field(default_factory=lambda: deque(maxlen=500))
+
+
+@dataclass
+class Transition:
+    kind: str  # "started", "ended" or "recover"
+    truck_id: str
+    excursion: Excursion
+    setpoint: Optional[float] = None
+
+
+def parse_ts(value: str) -> float:
+    return datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+
+
+def _iso(ts: float) -> str:
+    return datetime.fromtimestamp(ts, tz=timezone.utc).isoformat()
+
+
+def _peak(run_min: float, run_max: float, th: CargoThresholds) -> float:
+    return run_max if run_max - th.high >= th.low - run_min else run_min
+
+
+def scan(times: np.ndarray, temps: np.ndarray, th: CargoThresholds, state: TruckState,
+         truck_id: str = "") -> Tuple[List[Excursion], Optional[Excursion]]:
+    """Run the hysteresis latch over one truck's time-sorted readings.
+
+    Returns the excursions that closed in this chunk (already filtered by
+    minimum duration) and the still-open run, if any. `state` is updated in
+    place so the next chunk continues where this one stopped.
+    """
+    n = len(temps)
+    if n == 0:
+        return [], None
+
+    out = (temps < th.low) | (temps > th.high)
+    back = (temps >= th.low + th.hysteresis) & (temps <= th.high - th.hysteresis)
+    # Latch: set on an out-of-range reading, reset on a reading back inside the
+    # hysteresis band, otherwise hold. Carry the last set/reset forward.
+    code = np.where(out, 1, np.where(back, 0, -1)).astype(np.int8)
+    marks = np.where(code >= 0, np.arange(n), -1)
+    last = np.maximum.accumulate(marks)
+    latched = np.where(last >= 0, code[np.maximum(last, 0)] == 1, state.latched)
+
+    edges = np.diff(np.concatenate(([state.latched], latched)).astype(np.int8))
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+
+    # Per-segment min/max between every run boundary in one pass
+    bounds = np.unique(np.concatenate(([0], starts, ends)))
+    seg_min = np.minimum.reduceat(temps, bounds)
+    seg_max = np.maximum.reduceat(temps, bounds)
+    seg_len = np.diff(np.append(bounds, n))
+    seg_at = {int(b): i for i, b in enumerate(bounds)}
+
+    closed: List[Excursion] = []
+    run_starts = list(starts)
+    if state.latched:
+        run_starts.insert(0, -1)  # run carried over from the previous chunk
+    end_iter = iter(ends)
+    for s in run_starts:
+        e = next(end_iter, None)
+        seg = seg_at[max(int(s), 0)]
+        if s < 0:
+            run_start = state.run_start
+            run_min = min(state.run_min, seg_min[seg])
+            run_max = max(state.run_max, seg_max[seg])
+            readings = state.run_readings + int(seg_len[seg])
+        else:
+            run_start = float(times[s])
+            run_min, run_max = float(seg_min[seg]), float(seg_max[seg])
+            readings = int(seg_len[seg])
+        exc = Excursion(truck_id, state.cargo_type or "", run_start, None,
+                        float(_peak(run_min, run_max, th)), readings)
+        if e is None:
+            state.latched = True
+            state.run_start = run_start
+            state.run_min, state.run_max = float(run_min), float(run_max)
+            state.run_readings = readings
+            state.last_time = float(times[-1])
+            return closed, exc
+        exc.ended_at = float(times[e])
+        if exc.duration_s >= th.min_duration_s:
+            closed.append(exc)
+
+    state.latched = False
+    state.confirmed = False
+    state.run_min, state.run_max, state.run_readings = np.inf, -np.inf, 0
+    state.last_time = float(times[-1])
+    return closed, None
+
+
+class TripExcursionReducer:
+    """Summarizes a trip's excursions from time-ordered chunks in constant memory."""
+
+    def __init__(self, th: CargoThresholds, truck_id: str = "", cargo_type: str = ""):
+        self.th = th
+        self.truck_id = truck_id
+        self.state = TruckState(cargo_type=cargo_type)
+        self.excursions: List[Excursion] = []
+        self.open_run: Optional[Excursion] = None
+
+    def add(self, times: np.ndarray, temps: np.ndarray):
+        mask = ~np.isnan(temps)
+        if not mask.any():
+            return
+        closed, self.open_run = scan(times[mask], temps[mask], self.th, self.state, self.truck_id)
+        self.excursions.extend(closed)
+
+    def result(self) -> List[Excursion]:
+        run = self.open_run
+        if run and self.state.last_time - run.started_at >= self.th.min_duration_s:
+            return self.excursions + [run]
+        return list(self.excursions)
+
+
+def summarize_excursions(times: np.ndarray, temps: np.ndarray, th: CargoThresholds,
+                         truck_id: str = "", cargo_type: str = "") -> List[Excursion]:
+    reducer = TripExcursionReducer(th, truck_id, cargo_type)
+    reducer.add(times, temps)
+    return reducer.result()
+
+
+class ExcursionDetector:
+    """Per-truck streaming excursion state fed with batches of readings.
+
+    `process` groups a batch by truck, sorts each group by time and runs the
+    vectorized latch, returning start/end transitions plus recovery requests
+    (at most one per truck per `recovery_cooldown_s` of reading time).
+    """
+
+    def __init__(self, thresholds: Dict[str, CargoThresholds], recovery_cooldown_s: float = 900.0):
+        self.thresholds = thresholds
+        self.recovery_cooldown_s = recovery_cooldown_s
+        self.trucks: Dict[str, TruckState] = {}
+
+    def process_rows(self, rows: Iterable[dict]) -> List[Transition]:
+        truck_ids, times, temps, cargos = [], [], [], []
+        for row in rows:
+            if row.get("temperature") is None or not row.get("cargo_type"):
+                continue
+            truck_ids.append(row["truck_id"])
+            times.append(parse_ts(row["occurred_at"]))
+            temps.append(float(row["temperature"]))
+            cargos.append(row["cargo_type"].lower())
+        if not truck_ids:
+            return []
+        return self.process(np.asarray(truck_ids), np.asarray(times, dtype=np.float64),
+                            np.asarray(temps, dtype=np.float64), np.asarray(cargos))
+
+    def process(self, truck_ids: np.ndarray, times: np.ndarray, temps: np.ndarray,
+                cargos: np.ndarray) -> List[Transition]:
+        order = np.lexsort((times, truck_ids))
+        truck_ids, times, temps, cargos = truck_ids[order], times[order], temps[order], cargos[order]
+        uniq, first = np.unique(truck_ids, return_index=True)
+        bounds = np.append(first, len(truck_ids))
+
+        # Fleet-wide range check first: trucks with no out-of-range reading and
+        # no open excursion only need their cursor advanced, not a full scan.
+        cargo_names, cargo_idx = np.unique(cargos, return_inverse=True)
+        lows = np.array([self.thresholds[c].low if c in self.thresholds else np.nan for c in cargo_names])
+        highs = np.array([self.thresholds[c].high if c in self.thresholds else np.nan for c in cargo_names])
+        out = (temps < lows[cargo_idx]) | (temps > highs[cargo_idx])
+        any_out = np.logical_or.reduceat(out, first)
+
+        transitions: List[Transition] = []
+        for i, truck_id in enumerate(uniq):
+            lo, hi = bounds[i], bounds[i + 1]
+            truck_id = str(truck_id)
+            cargo = str(cargos[hi - 1])
+            state = self.trucks.get(truck_id)
+            if not any_out[i] and state is not None and not state.latched and state.cargo_type == cargo:
+                state.last_time = max(state.last_time, float(times[hi - 1]))
+                continue
+            transitions.extend(self._process_truck(truck_id, times[lo:hi], temps[lo:hi], cargo))
+        return transitions
+
+    def _process_truck(self, truck_id: str, times: np.ndarray, temps: np.ndarray, cargo: str) -> List[Transition]:
+        th = self.thresholds.get(cargo)
+        if th is None:
+            return []
+        state = self.trucks.get(truck_id)
+        if state is None:
+            state = self.trucks[truck_id] = TruckState()
+        if state.cargo_type != cargo:
+            # New cargo means a new load; don't carry the old latch across
+            state.cargo_type = cargo
+            state.latched = False
+            state.confirmed = False
+            state.run_min, state.run_max, state.run_readings = np.inf, -np.inf, 0
+
+        # Late readings can't be replayed into the latch; they are still stored
+        fresh = times >= state.last_time
+        times, temps = times[fresh], temps[fresh]
+        if not len(times):
+            return []
+
+        # `confirmed` means "started" was already emitted for the run carried into this chunk
+        was_confirmed = state.confirmed
+        closed, open_run = scan(times, temps, th, state, truck_id)
+
+        transitions = []
+        for i, exc in enumerate(closed):
+            state.history.append(exc)
+            if not (i == 0 and was_confirmed):
+                transitions.append(Transition("started", truck_id, exc))
+            transitions.append(Transition("ended", truck_id, exc))
+        if closed:
+            state.confirmed = False
+        if open_run is None:
+            return transitions
+
+        if times[-1] - open_run.started_at < th.min_duration_s:
+            return transitions
+        if not state.confirmed:
+            transitions.append(Transition("started", truck_id, open_run))
+            state.confirmed = True
+        now = float(times[-1])
+        if state.last_recovery is None or now - state.last_recovery >= self.recovery_cooldown_s:
+            state.last_recovery = now
+            transitions.append(Transition("recover", truck_id, open_run, setpoint=(th.low + th.high) / 2))
+        return transitions
+
+    def history(self, truck_id: str, start: float = -np.inf, end: float = np.inf) -> List[Excursion]:
+        state = self.trucks.get(truck_id)
+        if not state:
+            return []
+        return [e for e in state.history if start <= e.started_at <= end]
@@ -0,0 +1,300 @@
+import asyncio
+import json
+import logging
+import time
+import zlib
+from collections import OrderedDict, deque
+from typing import AsyncIterator, Awaitable, Callable, Iterable, List, Optional
+
+logger = logging.getLogger("reefershield")
+
+
+class IngestQueueFull(Exception):
+    pass
+
+
+class BatchRejected(Exception):
+    """Raised by a flush when the database refused the rows themselves.
+
+    Retrying the same batch cannot succeed, so the queue splits it instead and
+    drops only the rows that are refused on their own.
+    """
+
+
+class IngestQueue:
+    """Buffers normalized events and flushes them as multi-row inserts.
+
+    A flush happens once `max_batch` events are waiting or the oldest buffered
+    event is `max_delay` seconds old, whichever comes first. `max_size` bounds
+    buffered plus in-flight events; `put` raises IngestQueueFull beyond that.
+    Other flush errors are retried `retries` times; a BatchRejected batch is
+    bisected until the bad rows are isolated.
+    """
+
+    def __init__(
+        self,
+        flush: Callable[[List], Awaitable[None]],
+        max_batch: int = 500,
+        max_delay: float = 0.25,
+        max_size: int = 20000,
+        retries: int = 3,
+    ):
+        self._flush = flush
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.max_size = max_size
+        self.retries = retries
+
+        self._buffer: deque = deque()
+        self._oldest: Optional[float] = None
+        self._in_flight = 0
+        self._wake: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._closing = False
+
+        self.enqueued_total = 0
+        self.rejected_total = 0
+        self.flushed_total = 0
+        self.dropped_total = 0
+        self.refused_total = 0
+        self.flush_count = 0
+        self.flush_errors = 0
+        self.flush_seconds_total = 0.0
+        self.flush_seconds_last = 0.0
+        self.flush_seconds_max = 0.0
+
+    @property
+    def depth(self) -> int:
+        return len(self._buffer) + self._in_flight
+
+    def put(self, row):
+        if self._closing or self.depth >= self.max_size:
+            self.rejected_total += 1
+            raise IngestQueueFull()
+        if not self._buffer:
+            self._oldest = time.monotonic()
+        self._buffer.append(row)
+        self.enqueued_total += 1
+        if self._wake and (len(self._buffer) == 1 or len(self._buffer) >= self.max_batch):
+            self._wake.set()
+
+    async def start(self):
+        if self._task:
+            return
+        self._closing = False
+        self._wake = asyncio.Event()
+        if self._buffer:
+            self._wake.set()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        # Refuse new rows, then let the flusher drain whatever is buffered.
+        self._closing = True
+        if not self._task:
+            return
+        self._wake.set()
+        await self._task
+        self._task = None
+
+    async def _run(self):
+        while True:
+            if not self._buffer:
+                if self._closing:
+                    return
+                self._wake.clear()
+                await self._wake.wait()
+                continue
+
+            if len(self._buffer) < self.max_batch and not self._closing:
+                remaining = self._oldest + self.max_delay - time.monotonic()
+                if remaining > 0:
+                    self._wake.clear()
+                    try:
+                        await asyncio.wait_for(self._wake.wait(), timeout=remaining)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+
+            batch = [self._buffer.popleft() for _ in range(min(self.max_batch, len(self._buffer)))]
+            self._oldest = time.monotonic() if self._buffer else None
+            self._in_flight = len(batch)
+            try:
+                await self._flush_batch(batch)
+            finally:
+                self._in_flight = 0
+
+    async def _flush_batch(self, batch: List):
+        started = time.perf_counter()
+        for attempt in range(1, self.retries + 1):
+            try:
+                await self._flush(batch)
+                break
+            except BatchRejected as e:
+                self.flush_errors += 1
+                if len(batch) == 1:
+                    logger.error("Ingest row refused, dropping it: %s", e)
+                    self.refused_total += 1
+                    self.dropped_total += 1
+                    return
+                # Halves keep arrival order, so per-truck rules still see readings in sequence
+                middle = len(batch) // 2
+                await self._flush_batch(batch[:middle])
+                await self._flush_batch(batch[middle:])
+                return
+            except Exception as e:
+                self.flush_errors += 1
+                logger.error("Ingest flush of %d rows failed (attempt %d/%d): %s", len(batch), attempt, self.retries, e)
+                if attempt == self.retries:
+                    self.dropped_total += len(batch)
+                    return
+                await asyncio.sleep(0.1 * 2 ** (attempt - 1))
+        elapsed = time.perf_counter() - started
+        self.flush_count += 1
+        self.flushed_total += len(batch)
+        self.flush_seconds_total += elapsed
+        self.flush_seconds_last = elapsed
+        self.flush_seconds_max = max(self.flush_seconds_max, elapsed)
+
+    def stats(self) -> dict:
+        return {
+            "depth": self.depth,
+            "max_size": self.max_size,
+            "enqueued_total": self.enqueued_total,
+            "rejected_total": self.rejected_total,
+            "flushed_total": self.flushed_total,
+            "dropped_total": self.dropped_total,
+            "refused_total": self.refused_total,
+            "flush_count": self.flush_count,
+            "flush_errors": self.flush_errors,
+            "flush_seconds_last": self.flush_seconds_last,
+            "flush_seconds_max": self.flush_seconds_max,
+            "flush_seconds_avg": self.flush_seconds_total / self.flush_count if self.flush_count else 0.0,
+        }
+
+
+class RecentKeys:
+    """LRU of the dedup keys this process accepted most recently.
+
+    Catches provider retries before they reach the queue. It is exact, so
+    unlike a Bloom filter it never drops a new reading. Redeliveries it
+    misses (evicted, or accepted by another process) stop at the unique index
+    on reefer_events.
+    """
+
+    def __init__(self, max_size: int = 100000):
+        self.max_size = max_size
+        self._keys: "OrderedDict[str, None]" = OrderedDict()
+        self.hits = 0
+
+    def seen(self, key: str) -> bool:
+        if key in self._keys:
+            self._keys.move_to_end(key)
+            self.hits += 1
+            return True
+        return False
+
+    def add(self, key: str):
+        self._keys[key] = None
+        if len(self._keys) > self.max_size:
+            self._keys.popitem(last=False)
+
+    def forget(self, keys: Iterable[str]):
+        for key in keys:
+            self._keys.pop(key, None)
+
+    def stats(self) -> dict:
+        return {"keys": len(self._keys), "max_size": self.max_size, "hits": self.hits}
+
+
+class ShardedIngestQueue:
+    """Routes each event to one of `shards` IngestQueues by a stable hash of `key(event)`.
+
+    Every shard flushes on its own task, so a truck's readings are inserted and
+    run through the trip rules in arrival order while other trucks' batches
+    proceed concurrently. `max_size` is split evenly across the shards.
+    """
+
+    def __init__(
+        self,
+        flush: Callable[[List], Awaitable[None]],
+        key: Callable[[object], str],
+        shards: int = 4,
+        max_batch: int = 500,
+        max_delay: float = 0.25,
+        max_size: int = 20000,
+        retries: int = 3,
+    ):
+        self.key = key
+        per_shard = -(-max_size // shards)
+        self.shards = [IngestQueue(flush, max_batch=max_batch, max_delay=max_delay,
+                                   max_size=per_shard, retries=retries) for _ in range(shards)]
+
+    def shard_for(self, key: str) -> IngestQueue:
+        return self.shards[zlib.crc32(key.encode()) % len(self.shards)]
+
+    @property
+    def depth(self) -> int:
+        return sum(shard.depth for shard in self.shards)
+
+    def put(self, event):
+        self.shard_for(self.key(event)).put(event)
+
+    async def start(self):
+        for shard in self.shards:
+            await shard.start()
+
+    async def stop(self):
+        await asyncio.gather(*(shard.stop() for shard in self.shards))
+
+    def stats(self) -> dict:
+        shards = [shard.stats() for shard in self.shards]
+        stats = {name: sum(s[name] for s in shards) for name in (
+            "depth", "max_size", "enqueued_total", "rejected_total", "flushed_total",
+            "dropped_total", "refused_total", "flush_count", "flush_errors")}
+        stats["flush_seconds_last"] = max(s["flush_seconds_last"] for s in shards)
+        stats["flush_seconds_max"] = max(s["flush_seconds_max"] for s in shards)
+        total = sum(shard.flush_seconds_total for shard in self.shards)
+        stats["flush_seconds_avg"] = total / stats["flush_count"] if stats["flush_count"] else 0.0
+        stats["shard_depths"] = [s["depth"] for s in shards]
+        return stats
+
+
+async def iter_ndjson(chunks: AsyncIterator[bytes], max_line_bytes: int = 1 << 20) -> AsyncIterator[dict]:
+    """Yield one JSON object per line of a streamed NDJSON body.
+
+    Only the current partial line is held in memory. Blank lines are skipped;
+    lines that fail to parse or are not objects are logged and skipped. A line
+    longer than `max_line_bytes`, complete or not, raises ValueError.
+    """
+    pending = b""
+    async for chunk in chunks:
+        pending += chunk
+        lines = pending.split(b"\n")
+        pending = lines.pop()
+        if len(pending) > max_line_bytes:
+            raise ValueError("NDJSON line exceeds %d bytes" % max_line_bytes)
+        for line in lines:
+            # A whole oversized line can arrive inside one chunk
+            if len(line) > max_line_bytes:
+                raise ValueError("NDJSON line exceeds %d bytes" % max_line_bytes)
+            record = _parse_ndjson_line(line)
+            if record is not None:
+                yield record
+    record = _parse_ndjson_line(pending)
+    if record is not None:
+        yield record
+
+
+def _parse_ndjson_line(line: bytes) -> Optional[dict]:
+    line = line.strip()
+    if not line:
+        return None
+    try:
+        record = json.loads(line)
+    except ValueError as e:
+        logger.warning("Skipping malformed NDJSON line: %s", e)
+        return None
+    if not isinstance(record, dict):
+        logger.warning("Skipping non-object NDJSON line")
+        return None
+    return record
@@ -0,0 +1,211 @@
+import asyncio
+import base64
+import hashlib
+import logging
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+
+from clients import http_client
+from metrics import EXTERNAL_ERRORS, stage
+
+logger = logging.getLogger("reefershield")
+
+# Multicodec / multihash codes
+RAW = 0x55
+DAG_PB = 0x70
+SHA2_256 = 0x12
+
+# Same defaults as the web3.storage / Storacha client: 1 MiB raw leaves,
+# balanced DAG with up to 1024 links per node, CIDv1.
+IPFS_CHUNK_SIZE = 1024 * 1024
+IPFS_MAX_LINKS = 1024
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+def _varint(n: int) -> bytes:
+    out = bytearray()
+    while True:
+        byte = n & 0x7F
+        n >>= 7
+        if n:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def _pb_bytes(field: int, value: bytes) -> bytes:
+    return _varint(field << 3 | 2) + _varint(len(value)) + value
+
+
+def _pb_uint(field: int, value: int) -> bytes:
+    return _varint(field << 3) + _varint(value)
+
+
+def cid_bytes(codec: int, block: bytes) -> bytes:
+    return _varint(1) + _varint(codec) + bytes((SHA2_256, 32)) + hashlib.sha256(block).digest()
+
+
+def cid_str(cid: bytes) -> str:
+    # Multibase base32 (lowercase, unpadded): the familiar "bafy..." / "bafk..." form
+    return "b" + base64.b32encode(cid).decode().lower().rstrip("=")
+
+
+def _file_node(links: List[Tuple[bytes, int, int]]) -> bytes:
+    """dag-pb node for a UnixFS file over (cid, content size, encoded DAG size) links."""
+    unixfs = _pb_uint(1, 2) + _pb_uint(3, sum(size for _, size, _ in links))
+    for _, size, _ in links:
+        unixfs += _pb_uint(4, size)
+    # dag-pb canonical order: Links (field 2) before Data (field 1)
+    node = b"".join(_pb_bytes(2, _pb_bytes(1, cid) + _pb_bytes(2, b"") + _pb_uint(3, tsize))
+                    for cid, _, tsize in links)
+    return node + _pb_bytes(1, unixfs)
+
+
+def unixfs_blocks(data: bytes, chunk_size: int = IPFS_CHUNK_SIZE,
+                  max_links: int = IPFS_MAX_LINKS) -> Tuple[bytes, List[Tuple[bytes, bytes]]]:
+    """Chunk `data` into a UnixFS file DAG; returns (root CID, [(cid, block), ...])."""
+    blocks = []
+    # (cid, content size, encoded DAG size) per node of the current layer
+    layer = []
+    for i in range(0, max(len(data), 1), chunk_size):
+        chunk = data[i:i + chunk_size]
+        cid = cid_bytes(RAW, chunk)
+        blocks.append((cid, chunk))
+        layer.append((cid, len(chunk), len(chunk)))
+    while len(layer) > 1:
+        parents = []
+        for i in range(0, len(layer), max_links):
+            links = layer[i:i + max_links]
+            node = _file_node(links)
+            cid = cid_bytes(DAG_PB, node)
+            blocks.append((cid, node))
+            parents.append((cid, sum(size for _, size, _ in links), len(node) + sum(t for _, _, t in links)))
+        layer = parents
+    return layer[0][0], blocks
+
+
+def pack_car(data: bytes, chunk_size: int = IPFS_CHUNK_SIZE, max_links: int = IPFS_MAX_LINKS) -> Tuple[str, bytes]:
+    """CARv1 archive of `data` as a UnixFS file; returns (root CID string, CAR bytes)."""
+    root, blocks = unixfs_blocks(data, chunk_size, max_links)
+    # dag-cbor {"roots": [root], "version": 1}; the CID is tag 42 over 0x00 + CID bytes
+    cid_field = b"\x00" + root
+    header = (b"\xa2\x65roots\x81\xd8\x2a\x58" + bytes((len(cid_field),)) + cid_field
+              + b"\x67version\x01")
+    parts = [_varint(len(header)), header]
+    for cid, block in blocks:
+        parts.append(_varint(len(cid) + len(block)))
+        parts.append(cid)
+        parts.append(block)
+    return cid_str(root), b"".join(parts)
+
+
+class IpfsUploader:
+    """Bounded-concurrency CAR uploads keyed by their locally computed CID.
+
+    The CID is known before anything is sent, so callers can stamp it right
+    away and `wait` for the upload later. CIDs already uploaded by this
+    process, or currently uploading, are not sent again.
+    """
+
+    def __init__(self, url: str, token: str, concurrency: int = 4, retries: int = 4,
+                 backoff_s: float = 1.0, cache_size: int = 1024):
+        self.url = url
+        self.token = token
+        self.retries = retries
+        self.backoff_s = backoff_s
+        self.cache_size = cache_size
+        self._slots = asyncio.Semaphore(concurrency)
+        self._uploaded: "OrderedDict[str, None]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self.uploads = 0
+        self.dedup_hits = 0
+        self.retried = 0
+
+    def start(self, cid: str, car: bytes) -> Optional[asyncio.Task]:
+        """Schedule the upload; returns None when `cid` is already stored."""
+        if cid in self._uploaded:
+            self._uploaded.move_to_end(cid)
+            self.dedup_hits += 1
+            return None
+        task = self._inflight.get(cid)
+        if task is not None:
+            self.dedup_hits += 1
+            return task
+        task = self._inflight[cid] = asyncio.create_task(self._upload(cid, car))
+        task.add_done_callback(lambda t: self._done(cid, t))
+        return task
+
+    async def upload(self, data: bytes) -> str:
+        cid, car = await asyncio.to_thread(pack_car, data)
+        task = self.start(cid, car)
+        if task is not None:
+            await task
+        return cid
+
+    async def wait(self, cid: str) -> bool:
+        """True once `cid` is uploaded; False if this process never started it."""
+        if cid in self._uploaded:
+            return True
+        task = self._inflight.get(cid)
+        if task is None:
+            return False
+        await task
+        return True
+
+    def _done(self, cid: str, task: asyncio.Task):
+        self._inflight.pop(cid, None)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error("IPFS upload of %s failed: %s", cid, task.exception())
+
+    async def _upload(self, cid: str, car: bytes):
+        headers = {"Authorization": f"Bearer {self.token}", "Content-Type": "application/vnd.ipld.car"}
+        for attempt in range(1, self.retries + 1):
+            async with self._slots:
+                try:
+                    with stage("ipfs_upload"):
+                        resp = await http_client(self.url).post(self.url, headers=headers, content=car)
+                except httpx.TransportError as e:
+                    EXTERNAL_ERRORS.inc(provider="web3storage")
+                    error = e
+                else:
+                    if resp.status_code in (200, 201, 202):
+                        self._check_cid(cid, resp)
+                        self._remember(cid)
+                        self.uploads += 1
+                        return
+                    EXTERNAL_ERRORS.inc(provider="web3storage")
+                    logger.error("web3.storage upload error: %s %s", resp.status_code, resp.text[:200])
+                    error = RuntimeError(f"web3.storage upload failed with {resp.status_code}")
+                    if resp.status_code not in RETRY_STATUSES:
+                        raise error
+            if attempt < self.retries:
+                self.retried += 1
+                await asyncio.sleep(self.backoff_s * 2 ** (attempt - 1))
+        raise error
+
+    @staticmethod
+    def _check_cid(cid: str, resp: httpx.Response):
+        try:
+            data = resp.json()
+        except ValueError:
+            return
+        remote = data.get("cid") or data.get("value", {}).get("cid") if isinstance(data, dict) else None
+        if remote and remote != cid:
+            raise RuntimeError(f"web3.storage returned CID {remote}, expected {cid}")
+
+    def _remember(self, cid: str):
+        self._uploaded[cid] = None
+        if len(self._uploaded) > self.cache_size:
+            self._uploaded.popitem(last=False)
+
+    def stats(self) -> dict:
+        return {
+            "uploads": self.uploads,
+            "inflight": len(self._inflight),
+            "dedup_hits": self.dedup_hits,
+            "retries": self.retried,
+        }
@@ -0,0 +1,218 @@
+import asyncio
+import json
+import time
+from collections import deque
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+# Reading columns pushed to the dashboard; the rest of the row stays server-side
+READING_FIELDS = ("truck_id", "event_type", "temperature", "setpoint", "latitude", "longitude", "occurred_at")
+
+
+class LiveSubscriberLimit(Exception):
+    pass
+
+
+def sse_message(kind: str, data: dict) -> str:
+    return f"event: {kind}\ndata: {json.dumps(data, separators=(',', ':'), default=str)}\n\n"
+
+
+class LiveChannel:
+    """A user's latest reading per truck, shared by all of that user's connections.
+
+    Each update gets a new version; a connection remembers the last version it
+    sent and picks up whatever changed since, so a reading is encoded and
+    stored once however many tabs are open.
+    """
+
+    def __init__(self):
+        self.subscribers: Set["LiveSubscriber"] = set()
+        self.latest: Dict[str, Tuple[str, int, str]] = {}
+        self.version = 0
+        self.updates = 0
+
+    def put(self, truck_id: str, occurred_at: str, message: str):
+        current = self.latest.get(truck_id)
+        if current is not None and current[0] > occurred_at:
+            return  # a late reading never replaces a newer one
+        self.version += 1
+        self.latest[truck_id] = (occurred_at, self.version, message)
+
+
+class LiveSubscriber:
+    """One streaming connection's pending updates, as encoded SSE messages.
+
+    Readings are coalesced: all trucks that changed since the last write go
+    out together, at most once per `coalesce` seconds, each with its newest
+    reading. Alerts (excursions, certificates) are never coalesced. They sit in
+    a queue of at most `max_pending`, and the oldest are dropped beyond that.
+    The connection is then told how many it lost, so it can reload from
+    Supabase. A slow reader costs its user's channel plus that queue, however
+    far behind it is.
+    """
+
+    def __init__(self, user_id: str, channel: LiveChannel, coalesce: float = 1.0, max_pending: int = 256):
+        self.user_id = user_id
+        self.channel = channel
+        self.coalesce = coalesce
+        self.max_pending = max_pending
+        self.closed = False
+        self._cursor = channel.version
+        self._updates_seen = channel.updates
+        self._next_at = 0.0
+        self._sleep_until = 0.0
+        self._alerts: deque = deque()
+        self._lost = 0
+        self._wake = asyncio.Event()
+        self.sent = 0
+        self.coalesced = 0
+        self.dropped = 0
+
+    def notify(self):
+        # New readings only need a wake-up if the connection would otherwise sleep past its next write
+        if self._sleep_until > self._next_at:
+            self._wake.set()
+
+    def offer_alert(self, message: str):
+        if len(self._alerts) >= self.max_pending:
+            self._alerts.popleft()
+            self._lost += 1
+            self.dropped += 1
+        self._alerts.append(message)
+        self._wake.set()
+
+    def close(self):
+        self.closed = True
+        self._wake.set()
+
+    @property
+    def pending(self) -> int:
+        return len(self._alerts) + (self.channel.version > self._cursor)
+
+    def take(self, now: float) -> List[str]:
+        """Everything that may be sent at `now`: the alerts, then the due readings."""
+        batch = []
+        if self._lost:
+            batch.append(sse_message("overflow", {"dropped": self._lost}))
+            self._lost = 0
+        while self._alerts:
+            batch.append(self._alerts.popleft())
+        channel = self.channel
+        if channel.version > self._cursor and self._next_at <= now:
+            readings = [message for _, version, message in channel.latest.values() if version > self._cursor]
+            batch.extend(readings)
+            self.coalesced += channel.updates - self._updates_seen - len(readings)
+            self._cursor, self._updates_seen = channel.version, channel.updates
+            self._next_at = now + self.coalesce
+        self.sent += len(batch)
+        return batch
+
+    async def next_batch(self, timeout: float) -> Optional[List[str]]:
+        """Wait for updates; [] after `timeout` seconds without any, None once closed."""
+        loop = asyncio.get_running_loop()
+        deadline = time.monotonic() + timeout
+        while not self.closed:
+            self._wake.clear()
+            now = time.monotonic()
+            batch = self.take(now)
+            if batch or now >= deadline:
+                return batch
+            self._sleep_until = min(deadline, self._next_at) if self.channel.version > self._cursor else deadline
+            # A timer handle rather than wait_for(): this runs per connection several times a second
+            timer = loop.call_later(self._sleep_until - now, self._wake.set)
+            try:
+                await self._wake.wait()
+            finally:
+                timer.cancel()
+                self._sleep_until = 0.0
+        return None
+
+
+class LiveHub:
+    """Fans readings, excursion alerts and certificate notices out to each user's live connections.
+
+    Publishing never blocks the ingest path: it updates the user's channel and
+    wakes the connections, and each connection drains at the pace its client
+    reads. Only updates produced in this process are seen, so every API
+    process runs its own hub.
+    """
+
+    def __init__(self, coalesce: float = 1.0, max_pending: int = 256, max_per_user: int = 50):
+        self.coalesce = coalesce
+        self.max_pending = max_pending
+        self.max_per_user = max_per_user
+        self._channels: Dict[str, LiveChannel] = {}
+        self.published = 0
+        self.connected = 0
+        self.rejected = 0
+        self._closed_sent = self._closed_coalesced = self._closed_dropped = 0
+
+    def subscribe(self, user_id: str) -> LiveSubscriber:
+        channel = self._channels.get(user_id)
+        if channel is None:
+            channel = self._channels[user_id] = LiveChannel()
+        if len(channel.subscribers) >= self.max_per_user:
+            self.rejected += 1
+            raise LiveSubscriberLimit(f"{len(channel.subscribers)} live connections already open for this user")
+        subscriber = LiveSubscriber(user_id, channel, coalesce=self.coalesce, max_pending=self.max_pending)
+        channel.subscribers.add(subscriber)
+        self.connected += 1
+        return subscriber
+
+    def unsubscribe(self, subscriber: LiveSubscriber):
+        channel = self._channels.get(subscriber.user_id)
+        if channel is None or subscriber not in channel.subscribers:
+            return
+        channel.subscribers.discard(subscriber)
+        if not channel.subscribers:
+            del self._channels[subscriber.user_id]
+        self._closed_sent += subscriber.sent
+        self._closed_coalesced += subscriber.coalesced
+        self._closed_dropped += subscriber.dropped
+
+    def publish_readings(self, rows: Iterable[dict]):
+        # Only the newest row per truck in the batch is encoded
+        newest: Dict[Tuple[LiveChannel, str], dict] = {}
+        for row in rows:
+            channel = self._channels.get(row.get("user_id"))
+            if channel is None:
+                continue
+            channel.updates += 1
+            self.published += 1
+            key = (channel, row["truck_id"])
+            current = newest.get(key)
+            if current is None or current["occurred_at"] <= row["occurred_at"]:
+                newest[key] = row
+        for (channel, truck_id), row in newest.items():
+            channel.put(truck_id, row["occurred_at"],
+                        sse_message("reading", {name: row.get(name) for name in READING_FIELDS}))
+        for channel in {channel for channel, _ in newest}:
+            for subscriber in channel.subscribers:
+                subscriber.notify()
+
+    def publish(self, user_id: str, kind: str, data: dict):
+        channel = self._channels.get(user_id)
+        if channel is None:
+            return
+        message = sse_message(kind, data)
+        for subscriber in channel.subscribers:
+            subscriber.offer_alert(message)
+        self.published += 1
+
+    def close(self):
+        for channel in self._channels.values():
+            for subscriber in channel.subscribers:
+                subscriber.close()
+
+    def stats(self) -> dict:
+        subscribers = [s for channel in self._channels.values() for s in channel.subscribers]
+        return {
+            "subscribers": len(subscribers),
+            "users": len(self._channels),
+            "connected": self.connected,
+            "rejected": self.rejected,
+            "published": self.published,
+            "sent": self._closed_sent + sum(s.sent for s in subscribers),
+            "coalesced": self._closed_coalesced + sum(s.coalesced for s in subscribers),
+            "dropped": self._closed_dropped + sum(s.dropped for s in subscribers),
+            "pending": sum(s.pending for s in subscribers),
+        }
@@ -1,21 +1,36 @@
 import os
-import io
+import asyncio
+import hashlib
+import hmac
+import itertools
 import json
 import logging
+import random
+import time
+from contextlib import asynccontextmanager
 from datetime import datetime, timedelta, timezone
+from collections import OrderedDict
 from typing import Optional, List
 
-from fastapi import FastAPI, Request, Depends, HTTPException, BackgroundTasks
-from fastapi.responses import RedirectResponse, JSONResponse
+from fastapi import FastAPI, Request, Depends, Header, HTTPException
+from fastapi.responses import PlainTextResponse, RedirectResponse, JSONResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from dotenv import load_dotenv
-import requests
-from supabase import create_client, Client
-from web3 import Web3, HTTPProvider
-from reportlab.lib.pagesizes import A4
-from reportlab.pdfgen import canvas
-import qrcode
-from PIL import Image
+
+from archive import ArchiveReader, RawArchive, archive_lines, parse_time
+from certificate_pdf import CertificateTemplate, CertificateTemplateBuilder, event_arrays, render_certificate_pdf
+from clients import HTTP_TIMEOUT_SECONDS, LazyClient, http_client, close_http_clients
+from digest import DigestMetrics, batches, digest_messages
+from excursions import ExcursionDetector, TripExcursionReducer, build_thresholds
+from ingest import BatchRejected, IngestQueueFull, RecentKeys, ShardedIngestQueue, iter_ndjson
+from ipfs import IpfsUploader, pack_car
+from live import LiveHub, LiveSubscriberLimit
+from metrics import (CONTENT_TYPE, EXTERNAL_ERRORS, INGEST_DUPLICATES, INGEST_INVALID, INGEST_EVENTS, INGEST_REJECTED,
+                     REGISTRY, stage)
+from normalizers import InvalidEvent, ReeferEvent, VehicleIndex, normalize
+from rollups import ROLLUP_RESOLUTIONS, RollupAggregator, RollupMerger, pick_resolution
+from tokens import OAuthToken, TokenCache
+from trips import OpenTripIndex, TripCloser, within_geofence
 
 load_dotenv()
 
@@ -28,17 +43,43 @@ SUPABASE_SERVICE_ROLE_KEY = os.getenv("BACKEND_SUPABASE_SERVICE_ROLE_KEY") or os
 if not SUPABASE_URL or not SUPABASE_SERVICE_ROLE_KEY:
     raise RuntimeError("Supabase env vars missing for backend")
 
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_SERVICE_ROLE_KEY)
+# Async PostgREST client sharing the pooled keep-alive connections for the Supabase host.
+# Built on first use; rebuilt if those connections were closed (e.g. by a lifespan shutdown).
+def connect_supabase():
+    from supabase import AsyncClient, AsyncClientOptions
+
+    return AsyncClient(
+        SUPABASE_URL,
+        SUPABASE_SERVICE_ROLE_KEY,
+        AsyncClientOptions(httpx_client=http_client(SUPABASE_URL)),
+    )
+
+supabase = LazyClient(connect_supabase, healthy=lambda client: not client.options.httpx_client.is_closed)
 
 WEB3_STORAGE_TOKEN = os.getenv("WEB3_STORAGE_TOKEN")
+WEB3_STORAGE_UPLOAD_URL = os.getenv("WEB3_STORAGE_UPLOAD_URL", "https://api.web3.storage/upload")
+IPFS_UPLOAD_CONCURRENCY = int(os.getenv("IPFS_UPLOAD_CONCURRENCY", "4"))
+IPFS_UPLOAD_RETRIES = int(os.getenv("IPFS_UPLOAD_RETRIES", "4"))
+IPFS_UPLOAD_BACKOFF_SECONDS = float(os.getenv("IPFS_UPLOAD_BACKOFF_SECONDS", "1"))
+IPFS_DEDUP_CACHE_SIZE = int(os.getenv("IPFS_DEDUP_CACHE_SIZE", "1024"))
 POLYGON_RPC_URL_PRIMARY = os.getenv("POLYGON_RPC_URL_PRIMARY")
 POLYGON_RPC_URL_FALLBACK = os.getenv("POLYGON_RPC_URL_FALLBACK")
 POLYGON_PRIVATE_KEY = os.getenv("POLYGON_PRIVATE_KEY")
 POLYGON_CHAIN_ID = int(os.getenv("POLYGON_CHAIN_ID", "137"))
 POLYGON_CERT_CONTRACT_ADDRESS = os.getenv("POLYGON_CERT_CONTRACT_ADDRESS")
+# Certificates ready for anchoring are collected for this long, then anchored as one Merkle root
+ANCHOR_BATCH_WINDOW_SECONDS = float(os.getenv("ANCHOR_BATCH_WINDOW_SECONDS", "60"))
+ANCHOR_BATCH_MAX = int(os.getenv("ANCHOR_BATCH_MAX", "256"))
+ANCHOR_GAS_PRICE_TTL_SECONDS = float(os.getenv("ANCHOR_GAS_PRICE_TTL_SECONDS", "30"))
+ANCHOR_RPC_COOLDOWN_SECONDS = float(os.getenv("ANCHOR_RPC_COOLDOWN_SECONDS", "30"))
 
 RESEND_API_KEY = os.getenv("RESEND_API_KEY")
 FROM_EMAIL = os.getenv("FROM_EMAIL", "noreply@reefershield.app")
+# Digest users per checkpointed page; keep at or below PostgREST max-rows
+DIGEST_PAGE_USERS = int(os.getenv("DIGEST_PAGE_USERS", "1000"))
+DIGEST_MAX_ITEMS = int(os.getenv("DIGEST_MAX_ITEMS", "200"))
+DIGEST_SEND_CONCURRENCY = int(os.getenv("DIGEST_SEND_CONCURRENCY", "2"))
+DIGEST_SEND_RETRIES = int(os.getenv("DIGEST_SEND_RETRIES", "3"))
 
 SAMSARA_CLIENT_ID = os.getenv("SAMSARA_CLIENT_ID")
 SAMSARA_CLIENT_SECRET = os.getenv("SAMSARA_CLIENT_SECRET")
@@ -54,16 +95,119 @@ GEOTAB_OAUTH_REDIRECT_URI = os.getenv("GEOTAB_OAUTH_REDIRECT_URI")
 
 BACKEND_BASE_URL = os.getenv("BACKEND_BASE_URL", "http://localhost:8000")
 
-# Polygon web3 setup
-def get_web3() -> Optional[Web3]:
-    rpc = POLYGON_RPC_URL_PRIMARY or POLYGON_RPC_URL_FALLBACK
-    if not rpc:
-        return None
-    return Web3(HTTPProvider(rpc))
+# Telematics OAuth tokens are cached per (user_id, provider) and renewed this long before expiry
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "1024"))
+TOKEN_REFRESH_MARGIN_SECONDS = float(os.getenv("TOKEN_REFRESH_MARGIN_SECONDS", "300"))
+TOKEN_REFRESH_INTERVAL_SECONDS = float(os.getenv("TOKEN_REFRESH_INTERVAL_SECONDS", "60"))
+
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "500"))
+INGEST_FLUSH_INTERVAL_MS = int(os.getenv("INGEST_FLUSH_INTERVAL_MS", "250"))
+INGEST_MAX_QUEUE = int(os.getenv("INGEST_MAX_QUEUE", "20000"))
+# Flusher tasks; a truck's readings always go to the same one, in arrival order
+INGEST_SHARDS = int(os.getenv("INGEST_SHARDS", "4"))
+# Recently accepted reading keys remembered per process to drop provider retries early
+INGEST_DEDUP_CACHE_SIZE = int(os.getenv("INGEST_DEDUP_CACHE_SIZE", "100000"))
+# Fraction of webhook payloads logged in full (0 disables, 1 logs every payload)
+PAYLOAD_LOG_SAMPLE_RATE = float(os.getenv("PAYLOAD_LOG_SAMPLE_RATE", "0.001"))
+
+# Dashboard live stream: readings go out at most once per truck per LIVE_COALESCE_SECONDS;
+# a connection keeps up to LIVE_MAX_PENDING undelivered alerts before dropping the oldest
+LIVE_COALESCE_SECONDS = float(os.getenv("LIVE_COALESCE_SECONDS", "1"))
+LIVE_MAX_PENDING = int(os.getenv("LIVE_MAX_PENDING", "256"))
+LIVE_MAX_CONNECTIONS_PER_USER = int(os.getenv("LIVE_MAX_CONNECTIONS_PER_USER", "50"))
+LIVE_HEARTBEAT_SECONDS = float(os.getenv("LIVE_HEARTBEAT_SECONDS", "15"))
+# Streams end after this long so the client reconnects with a fresh access token
+LIVE_STREAM_MAX_SECONDS = float(os.getenv("LIVE_STREAM_MAX_SECONDS", "900"))
+
+# Provider vehicle ids -> trucks rows; unknown ids are retried after the miss TTL
+VEHICLE_INDEX_TTL_SECONDS = float(os.getenv("VEHICLE_INDEX_TTL_SECONDS", "600"))
+VEHICLE_INDEX_MISS_TTL_SECONDS = float(os.getenv("VEHICLE_INDEX_MISS_TTL_SECONDS", "60"))
+
+TRIP_GEOFENCE_RADIUS_M = float(os.getenv("TRIP_GEOFENCE_RADIUS_M", "1000"))
+TRIP_INDEX_TTL_SECONDS = float(os.getenv("TRIP_INDEX_TTL_SECONDS", "300"))
+# Required by /hooks/reefer-trips; the hook is refused while it is unset
+TRIP_HOOK_SECRET = os.getenv("TRIP_HOOK_SECRET")
+# Seconds a trip stays open after its closing ignition_off, for late readings (0 = close at once)
+TRIP_CLOSE_WATERMARK_SECONDS = float(os.getenv("TRIP_CLOSE_WATERMARK_SECONDS", "120"))
+
+# Optional JSON, e.g. {"pharma": {"low": 36, "high": 46, "hysteresis": 0.5, "min_duration_s": 120}}
+CARGO_THRESHOLDS_JSON = os.getenv("CARGO_THRESHOLDS_JSON")
+EXCURSION_HYSTERESIS = float(os.getenv("EXCURSION_HYSTERESIS", "1.0"))
+EXCURSION_MIN_DURATION_SECONDS = float(os.getenv("EXCURSION_MIN_DURATION_SECONDS", "300"))
+RECOVERY_COOLDOWN_SECONDS = float(os.getenv("RECOVERY_COOLDOWN_SECONDS", "900"))
+
+# Raw payload archive (local path or object-store URI, e.g. s3://bucket/raw); unset keeps raw_payload in reefer_events
+RAW_ARCHIVE_URI = os.getenv("RAW_ARCHIVE_URI")
+RAW_ARCHIVE_SEGMENT_ROWS = int(os.getenv("RAW_ARCHIVE_SEGMENT_ROWS", "10000"))
+RAW_ARCHIVE_SEGMENT_SECONDS = float(os.getenv("RAW_ARCHIVE_SEGMENT_SECONDS", "300"))
+# Local directory for segments whose write keeps failing; uploaded again on the next start
+RAW_ARCHIVE_SPILL_DIR = os.getenv("RAW_ARCHIVE_SPILL_DIR", "/var/tmp/reefershield-archive-spill")
+
+# Certificate job workers running inside the API process (0 = rely on cert_worker.py)
+CERT_INPROCESS_WORKERS = int(os.getenv("CERT_INPROCESS_WORKERS", "0"))
+CERT_TEMPLATE_CACHE_SIZE = int(os.getenv("CERT_TEMPLATE_CACHE_SIZE", "16"))
+# Rows per keyset page when streaming a trip's events; keep at or below PostgREST max-rows
+EVENT_PAGE_SIZE = int(os.getenv("EVENT_PAGE_SIZE", "1000"))
+
+POLYGON_RPC_URLS = [url for url in (POLYGON_RPC_URL_PRIMARY, POLYGON_RPC_URL_FALLBACK) if url]
+
+# Polygon anchoring: primary RPC with failover to the fallback.
+# web3 is only imported when the anchor is first used, i.e. by the anchor batcher.
+def connect_polygon_anchor():
+    from web3 import Web3, HTTPProvider
+    from anchoring import PolygonAnchor, RpcPool
+
+    endpoints = [Web3(HTTPProvider(url, request_kwargs={"timeout": HTTP_TIMEOUT_SECONDS})) for url in POLYGON_RPC_URLS]
+    return PolygonAnchor(
+        RpcPool(endpoints, cooldown_s=ANCHOR_RPC_COOLDOWN_SECONDS),
+        POLYGON_PRIVATE_KEY,
+        POLYGON_CHAIN_ID,
+        POLYGON_CERT_CONTRACT_ADDRESS,
+        gas_price_ttl=ANCHOR_GAS_PRICE_TTL_SECONDS,
+    )
+
+polygon_anchor = (LazyClient(connect_polygon_anchor)
+                  if POLYGON_RPC_URLS and POLYGON_PRIVATE_KEY and POLYGON_CERT_CONTRACT_ADDRESS else None)
+
+# Raw payload archive: Parquet/zstd segments per user/truck/day (needs pyarrow)
+def get_raw_archive():
+    if not RAW_ARCHIVE_URI:
+        return None, None
+    archive = RawArchive(RAW_ARCHIVE_URI, segment_rows=RAW_ARCHIVE_SEGMENT_ROWS,
+                         segment_seconds=RAW_ARCHIVE_SEGMENT_SECONDS, spill_dir=RAW_ARCHIVE_SPILL_DIR or None)
+    return archive, ArchiveReader(RAW_ARCHIVE_URI)
+
+raw_archive, raw_archive_reader = get_raw_archive()
 
-w3 = get_web3()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await ingest_queue.start()
+    trip_closer.start()
+    if raw_archive:
+        raw_archive.start()
+    token_cache.start()
+    cert_workers = anchor_batcher = None
+    if CERT_INPROCESS_WORKERS:
+        import cert_worker
+        cert_workers = cert_worker.CertificateWorkerPool(f"api-{os.getpid()}", CERT_INPROCESS_WORKERS)
+        cert_workers.start()
+        if polygon_anchor:
+            anchor_batcher = cert_worker.AnchorBatcher(f"api-{os.getpid()}")
+            anchor_batcher.start()
+    yield
+    live_hub.close()
+    await ingest_queue.stop()
+    await trip_closer.stop()
+    if raw_archive:
+        await raw_archive.stop()
+    if cert_workers:
+        await cert_workers.stop()
+    if anchor_batcher:
+        await anchor_batcher.stop()
+    await token_cache.stop()
+    await close_http_clients()
 
-app = FastAPI(title="ReeferShield Backend")
+app = FastAPI(title="ReeferShield Backend", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -75,45 +219,17 @@ app.add_middleware(
 
 # ---------- Utility ----------
 
-def upload_pdf_to_web3_storage(pdf_bytes: bytes) -> Optional[str]:
-    if not WEB3_STORAGE_TOKEN:
-        logger.warning("WEB3_STORAGE_TOKEN not set; skipping IPFS upload")
-        return None
-    headers = {
-        "Authorization": f"Bearer {WEB3_STORAGE_TOKEN}",
-        "Content-Type": "application/pdf",
-    }
-    resp = requests.post("https://api.web3.storage/upload", headers=headers, data=pdf_bytes)
-    if resp.status_code not in (200, 202):
-        logger.error("web3.storage upload error: %s %s", resp.status_code, resp.text)
-        return None
-    data = resp.json()
-    cid = data.get("cid") or data.get("value", {}).get("cid")
-    return cid
-
-def record_on_polygon(cid: str, timestamp: int) -> Optional[str]:
-    if not (w3 and POLYGON_PRIVATE_KEY and POLYGON_CERT_CONTRACT_ADDRESS):
-        logger.warning("Polygon not fully configured; skipping on-chain record")
-        return None
-
-    acct = w3.eth.account.from_key(POLYGON_PRIVATE_KEY)
-    cid_hash = w3.keccak(text=cid)
-    nonce = w3.eth.get_transaction_count(acct.address)
-
-    tx = {
-        "chainId": POLYGON_CHAIN_ID,
-        "nonce": nonce,
-        "to": Web3.to_checksum_address(POLYGON_CERT_CONTRACT_ADDRESS),
-        "value": 0,
-        "gas": 200000,
-        "gasPrice": w3.eth.gas_price,
-        "data": cid_hash,  # simple marker; ABI-encoded call can be wired later
-    }
-    signed = w3.eth.account.sign_transaction(tx, private_key=POLYGON_PRIVATE_KEY)
-    tx_hash = w3.eth.send_raw_transaction(signed.rawTransaction)
-    return w3.to_hex(tx_hash)
+# IPFS: CIDs are computed locally from a CAR of the PDF; uploads run in a bounded background pool
+ipfs_uploader = IpfsUploader(
+    WEB3_STORAGE_UPLOAD_URL,
+    WEB3_STORAGE_TOKEN,
+    concurrency=IPFS_UPLOAD_CONCURRENCY,
+    retries=IPFS_UPLOAD_RETRIES,
+    backoff_s=IPFS_UPLOAD_BACKOFF_SECONDS,
+    cache_size=IPFS_DEDUP_CACHE_SIZE,
+) if WEB3_STORAGE_TOKEN else None
 
-def send_certificate_email(to_emails: List[str], subject: str, html: str, pdf_bytes: bytes):
+async def send_certificate_email(to_emails: List[str], subject: str, html: str, pdf_bytes: bytes):
     if not RESEND_API_KEY:
         logger.warning("RESEND_API_KEY missing; skipping email send")
         return
@@ -130,180 +246,192 @@ def send_certificate_email(to_emails: List[str], subject: str, html: str, pdf_by
         "html": html,
     }
     # Resend attachments require multipart; here we keep it simple and just send link-less email
-    resp = requests.post(
-        "https://api.resend.com/emails",
-        headers={"Authorization": f"Bearer {RESEND_API_KEY}", "Content-Type": "application/json"},
-        data=json.dumps(payload),
-    )
+    url = "https://api.resend.com/emails"
+    with stage("email"):
+        resp = await http_client(url).post(
+            url,
+            headers={"Authorization": f"Bearer {RESEND_API_KEY}", "Content-Type": "application/json"},
+            content=json.dumps(payload),
+        )
     if resp.status_code >= 400:
+        EXTERNAL_ERRORS.inc(provider="resend")
         logger.error("Error sending email via Resend: %s %s", resp.status_code, resp.text)
+        raise RuntimeError(f"Resend email failed with {resp.status_code}")
 
-def generate_certificate_pdf(trip, events, ipfs_cid: Optional[str], polygon_tx: Optional[str]) -> bytes:
-    buff = io.BytesIO()
-    c = canvas.Canvas(buff, pagesize=A4)
-    width, height = A4
-
-    c.setFillColorRGB(0, 0.5, 1)
-    c.setFont("Helvetica-Bold", 20)
-    c.drawString(50, height - 50, "ReeferShield Certificate of Temperature Integrity")
-
-    c.setFillColorRGB(1, 1, 1)
-    c.setFont("Helvetica", 10)
-    y = height - 90
-    lines = [
-        f"Trip ID: {trip['id']}",
-        f"Truck ID: {trip['truck_id']}",
-        f"Cargo Type: {trip.get('cargo_type') or 'N/A'}",
-        f"Origin: {trip.get('origin') or 'N/A'}",
-        f"Destination: {trip.get('destination') or 'N/A'}",
-        f"Started: {trip.get('started_at')}",
-        f"Completed: {trip.get('ended_at')}",
-    ]
-    for line in lines:
-        c.drawString(50, y, line)
-        y -= 14
-
-    # Draw a simple temperature graph
-    temps = [e.get("temperature") for e in events if e.get("temperature") is not None]
-    times = [datetime.fromisoformat(e["occurred_at"].replace("Z", "+00:00")) for e in events]
-    if temps and times:
-        min_temp = min(temps)
-        max_temp = max(temps)
-        min_t = min(times)
-        max_t = max(times)
-        graph_left = 50
-        graph_bottom = 250
-        graph_width = width - 100
-        graph_height = 200
-
-        c.setStrokeColorRGB(0.3, 0.3, 0.3)
-        c.rect(graph_left, graph_bottom, graph_width, graph_height)
-
-        def norm_x(t):
-            if max_t == min_t:
-                return graph_left
-            return graph_left + ( (t - min_t).total_seconds() / (max_t - min_t).total_seconds() ) * graph_width
-
-        def norm_y(temp):
-            if max_temp == min_temp:
-                return graph_bottom
-            return graph_bottom + ((temp - min_temp) / (max_temp - min_temp)) * graph_height
-
-        c.setStrokeColorRGB(0, 0.7, 1)
-        c.setLineWidth(1.5)
-        last_x, last_y = None, None
-        for t, temp in zip(times, temps):
-            x = norm_x(t)
-            y = norm_y(temp)
-            if last_x is not None:
-                c.line(last_x, last_y, x, y)
-            last_x, last_y = x, y
-
-        c.setFont("Helvetica", 8)
-        c.drawString(graph_left, graph_bottom - 12, f"Min temp: {min_temp}  Max temp: {max_temp}")
-
-    # IPFS / Polygon details
-    y = 200
-    c.setFont("Helvetica-Bold", 10)
-    c.drawString(50, y, "Tamper‑proof anchors")
-    c.setFont("Helvetica", 9)
-    y -= 14
-    if ipfs_cid:
-        c.drawString(50, y, f"IPFS CID: {ipfs_cid}")
-        y -= 12
-        c.drawString(50, y, f"IPFS Gateway: https://{ipfs_cid}.ipfs.w3s.link")
-        y -= 14
-    if polygon_tx:
-        c.drawString(50, y, f"Polygon Tx: {polygon_tx}")
-        y -= 12
-        c.drawString(50, y, f"Polygonscan: https://polygonscan.com/tx/{polygon_tx}")
-        y -= 14
-
-    # QR code linking to Polygonscan if present, otherwise IPFS
-    qr_target = None
-    if polygon_tx:
-        qr_target = f"https://polygonscan.com/tx/{polygon_tx}"
-    elif ipfs_cid:
-        qr_target = f"https://{ipfs_cid}.ipfs.w3s.link"
-
-    if qr_target:
-        qr = qrcode.QRCode(box_size=2, border=2)
-        qr.add_data(qr_target)
-        qr.make(fit=True)
-        img = qr.make_image(fill_color="black", back_color="white")
-        img_buff = io.BytesIO()
-        img.save(img_buff, format="PNG")
-        img_buff.seek(0)
-        qr_x = width - 150
-        qr_y = 50
-        c.drawInlineImage(Image.open(img_buff), qr_x, qr_y, width=100, height=100)
-        c.setFont("Helvetica", 7)
-        c.drawString(qr_x, qr_y + 105, "Scan to verify immutability")
-
-    c.showPage()
-    c.save()
-    pdf_bytes = buff.getvalue()
-    buff.close()
-    return pdf_bytes
-
-def complete_trip_and_issue_certificate(trip_id: str):
-    # Load trip
-    trip = supabase.table("reefer_trips").select("*").eq("id", trip_id).single().execute().data
-    if not trip:
-        logger.error("Trip not found for certificate generation")
-        return
-    user_id = trip["user_id"]
-    truck_id = trip["truck_id"]
+async def send_email_batch(messages: List[dict], idempotency_key: str):
+    # Up to 100 messages per call; the idempotency key makes a resumed run's resend a no-op
+    url = "https://api.resend.com/emails/batch"
+    headers = {
+        "Authorization": f"Bearer {RESEND_API_KEY}",
+        "Content-Type": "application/json",
+        "Idempotency-Key": idempotency_key,
+    }
+    for attempt in range(1, DIGEST_SEND_RETRIES + 1):
+        with stage("email"):
+            resp = await http_client(url).post(url, headers=headers, content=json.dumps(messages))
+        if resp.status_code < 400:
+            return
+        EXTERNAL_ERRORS.inc(provider="resend")
+        logger.error("Resend batch error: %s %s", resp.status_code, resp.text[:200])
+        if resp.status_code != 429 and resp.status_code < 500:
+            break
+        if attempt < DIGEST_SEND_RETRIES:
+            await asyncio.sleep(float(resp.headers.get("retry-after") or attempt))
+    raise RuntimeError(f"Resend batch failed with {resp.status_code}")
 
-    # Fetch events for this trip
-    events_resp = supabase.table("reefer_events").select("*").eq("user_id", user_id).eq("truck_id", truck_id)        .gte("occurred_at", trip["started_at"]).lte("occurred_at", trip["ended_at"]).order("occurred_at").execute()
-    events = events_resp.data or []
+# Certificate issuance runs as a durable job in certificate_jobs (see cert_worker.py).
+# Each stage persists its result on the job row, so a retry resumes where it failed.
+CERTIFICATE_STAGES = ("upload", "anchor", "pin", "store", "email")
 
-    ipfs_cid = None
-    polygon_tx = None
+async def enqueue_certificate_job(trip: dict):
+    # Idempotent per trip: a second enqueue for the same trip_id is a no-op
+    job = {"trip_id": trip["id"], "user_id": trip["user_id"]}
+    if raw_archive:
+        # Every API process writes payloads received before the close within one segment age
+        job["next_attempt_at"] = (datetime.now(timezone.utc) + timedelta(seconds=RAW_ARCHIVE_SEGMENT_SECONDS)).isoformat()
+    await supabase.table("certificate_jobs").upsert(job, on_conflict="trip_id", ignore_duplicates=True).execute()
 
-    pdf_bytes = generate_certificate_pdf(trip, events, ipfs_cid=None, polygon_tx=None)
+async def iter_trip_events(trip: dict, columns: str = "id,occurred_at,temperature,setpoint"):
+    # Keyset pagination on (occurred_at, id): each page is one indexed range
+    # scan and stays under PostgREST's max-rows cap however long the trip is.
+    cursor = None
+    while True:
+        query = (supabase.table("reefer_events").select(columns)
+                 .eq("user_id", trip["user_id"]).eq("truck_id", trip["truck_id"])
+                 .gte("occurred_at", trip["started_at"]))
+        if trip.get("ended_at"):
+            query = query.lte("occurred_at", trip["ended_at"])
+        if cursor:
+            at, last_id = cursor
+            query = query.or_(f'occurred_at.gt."{at}",and(occurred_at.eq."{at}",id.gt.{last_id})')
+        page = (await query.order("occurred_at").order("id").limit(EVENT_PAGE_SIZE).execute()).data or []
+        if page:
+            yield page
+        if len(page) < EVENT_PAGE_SIZE:
+            return
+        cursor = (page[-1]["occurred_at"], page[-1]["id"])
 
-    # Upload to IPFS
-    cid = upload_pdf_to_web3_storage(pdf_bytes)
-    if cid:
-        ipfs_cid = cid
+# Upload and email render the same trip; the worker usually runs both stages back to back
+_certificate_templates: "OrderedDict[str, CertificateTemplate]" = OrderedDict()
 
-    # Record on Polygon
-    ts = int(datetime.now(timezone.utc).timestamp())
-    try:
-        polygon_tx = record_on_polygon(ipfs_cid or trip_id, ts)
-    except Exception as e:
-        logger.error("Polygon record failed: %s", e)
+async def certificate_template(job: dict):
+    trip_id = job["trip_id"]
+    template = _certificate_templates.get(trip_id)
+    if template is not None:
+        _certificate_templates.move_to_end(trip_id)
+        return template
+    trip = (await supabase.table("reefer_trips").select("*").eq("id", trip_id).single().execute()).data
+    builder = CertificateTemplateBuilder.for_trip(trip)
+    async for page in iter_trip_events(trip):
+        await asyncio.to_thread(builder.add_events, page)
+    template = builder.build()
+    if raw_archive_reader:
+        await add_archive_digest(template, trip, job)
+    _certificate_templates[trip_id] = template
+    if len(_certificate_templates) > CERT_TEMPLATE_CACHE_SIZE:
+        _certificate_templates.popitem(last=False)
+    return template
 
-    # Regenerate PDF with final CID / tx
-    pdf_bytes = generate_certificate_pdf(trip, events, ipfs_cid=ipfs_cid, polygon_tx=polygon_tx or None)
+async def add_archive_digest(template: CertificateTemplate, trip: dict, job: dict):
+    # The certificate commits to the payloads in segments opened before the job was
+    # created (the trip close); those are all written one segment age later
+    cutoff = parse_time(job["created_at"])
+    wait = cutoff.timestamp() + RAW_ARCHIVE_SEGMENT_SECONDS - time.time()
+    if wait > 0:
+        await asyncio.sleep(wait)
+    if raw_archive and raw_archive.unwritten(trip["truck_id"], cutoff.timestamp()):
+        # Digesting now would leave those payloads out; the job retries with backoff
+        raise RuntimeError(f"Archive segments for truck {trip['truck_id']} are still being written")
+    sha256, count = await asyncio.to_thread(
+        raw_archive_reader.trip_digest, trip["truck_id"], parse_time(trip["started_at"]),
+        parse_time(trip["ended_at"]), trip["user_id"], cutoff)
+    template.header_lines.extend(archive_lines(sha256, count, cutoff))
+    template.raw_sha256 = sha256
 
-    # Store certificate row
-    cert_ins = supabase.table("reefer_certificates").insert({
-        "user_id": user_id,
-        "truck_id": truck_id,
-        "trip_id": trip_id,
-        "pdf_url": "",  # can be filled with storage URL if you upload to Supabase Storage later
-        "ipfs_cid": ipfs_cid,
-        "polygon_tx_hash": polygon_tx,
-    }).execute().data[0]
-
-    # Email recipients if configured
-    rec = supabase.table("recipient_emails").select("*").eq("user_id", user_id).eq("truck_id", truck_id).maybe_single().execute().data
-    emails = []
-    if rec:
-        for key in ["driver_email", "shipper_email", "broker_email", "insurance_email"]:
-            if rec.get(key):
-                emails.append(rec[key])
-    if emails:
-        subject = "ReeferShield Certificate – Trip Completed"
-        link_text = "Your reefer certificate is attached or available via your ReeferShield dashboard."
-        html = f"<p>{link_text}</p>"
-        try:
-            send_certificate_email(emails, subject, html, pdf_bytes)
-        except Exception as e:
-            logger.error("Error sending certificate email: %s", e)
+async def certificate_car(job: dict):
+    # Draft PDF (no anchors) is what goes to IPFS; PDF rendering is blocking
+    template = await certificate_template(job)
+    with stage("pdf_render"):
+        pdf_bytes = await asyncio.to_thread(render_certificate_pdf, template, None, None)
+    return await asyncio.to_thread(pack_car, pdf_bytes)
+
+async def run_certificate_stage(name: str, job: dict) -> dict:
+    """Run one issuance stage for a job and return the columns to persist."""
+    trip_id = job["trip_id"]
+
+    if name == "upload":
+        if not ipfs_uploader:
+            logger.warning("WEB3_STORAGE_TOKEN not set; skipping IPFS upload")
+            template = await certificate_template(job)
+            return {"ipfs_cid": None, "raw_archive_sha256": template.raw_sha256}
+        # The CID is known before the upload finishes, so anchoring doesn't wait
+        # for it; `pin` confirms the upload before the certificate is stored
+        cid, car = await certificate_car(job)
+        ipfs_uploader.start(cid, car)
+        template = await certificate_template(job)  # cached by certificate_car
+        return {"ipfs_cid": cid, "raw_archive_sha256": template.raw_sha256}
+
+    if name == "pin":
+        cid = job.get("ipfs_cid")
+        if cid and ipfs_uploader and not await ipfs_uploader.wait(cid):
+            # Upload was started by another process (or failed); send it again from here
+            draft_cid, car = await certificate_car(job)
+            if draft_cid != cid:
+                raise RuntimeError(f"Certificate PDF no longer matches anchored CID {cid}")
+            task = ipfs_uploader.start(cid, car)
+            if task:
+                await task
+        return {}
+
+    if name == "anchor":
+        # With Polygon configured this stage is handed to the batch anchor loop
+        # (cert_worker.AnchorBatcher) and never runs here
+        logger.warning("Polygon not fully configured; skipping on-chain record")
+        return {}
+
+    if name == "store":
+        trip = (await supabase.table("reefer_trips").select("user_id,truck_id").eq("id", trip_id).single().execute()).data
+        cert = (await supabase.table("reefer_certificates").upsert({
+            "user_id": trip["user_id"],
+            "truck_id": trip["truck_id"],
+            "trip_id": trip_id,
+            "pdf_url": "",  # can be filled with storage URL if you upload to Supabase Storage later
+            "ipfs_cid": job.get("ipfs_cid"),
+            "polygon_tx_hash": job.get("polygon_tx_hash"),
+            "merkle_root": job.get("merkle_root"),
+            "merkle_proof": job.get("merkle_proof"),
+            "raw_archive_sha256": job.get("raw_archive_sha256"),
+        }, on_conflict="trip_id").execute()).data[0]
+        # Reaches the dashboard only if this process serves the user's live stream
+        live_hub.publish(trip["user_id"], "certificate_ready", {
+            "trip_id": trip_id, "truck_id": trip["truck_id"], "certificate_id": cert["id"],
+            "ipfs_cid": job.get("ipfs_cid"), "polygon_tx_hash": job.get("polygon_tx_hash"),
+        })
+        return {"certificate_id": cert["id"]}
+
+    if name == "email":
+        trip = (await supabase.table("reefer_trips").select("user_id,truck_id").eq("id", trip_id).single().execute()).data
+        rec_resp = await supabase.table("recipient_emails").select("*").eq("user_id", trip["user_id"]).eq("truck_id", trip["truck_id"]).maybe_single().execute()
+        rec = rec_resp.data if rec_resp else None
+        emails = []
+        if rec:
+            for key in ["driver_email", "shipper_email", "broker_email", "insurance_email"]:
+                if rec.get(key):
+                    emails.append(rec[key])
+        if emails:
+            # Final PDF: same template, stamped with the CID / tx anchors
+            template = await certificate_template(job)
+            with stage("pdf_render"):
+                pdf_bytes = await asyncio.to_thread(render_certificate_pdf, template, job.get("ipfs_cid"),
+                                                    job.get("polygon_tx_hash"), job.get("merkle_root"))
+            subject = "ReeferShield Certificate – Trip Completed"
+            link_text = "Your reefer certificate is attached or available via your ReeferShield dashboard."
+            html = f"<p>{link_text}</p>"
+            await send_certificate_email(emails, subject, html, pdf_bytes)
+        _certificate_templates.pop(trip_id, None)
+        return {}
+
+    raise ValueError(f"Unknown certificate stage: {name}")
 
 # ---------- Routes ----------
 
@@ -350,30 +478,60 @@ def oauth_start(provider: str, user_id: str):
         return RedirectResponse(url)
     raise HTTPException(404, "Unknown provider")
 
+def oauth_client(provider: str):
+    """(token_url, client_id, client_secret, redirect_uri) for a provider, or None."""
+    if provider == "samsara":
+        return ("https://api.samsara.com/oauth2/token", SAMSARA_CLIENT_ID, SAMSARA_CLIENT_SECRET, SAMSARA_OAUTH_REDIRECT_URI)
+    if provider == "motive":
+        return ("https://api.gomotive.com/oauth/token", MOTIVE_CLIENT_ID, MOTIVE_CLIENT_SECRET, MOTIVE_OAUTH_REDIRECT_URI)
+    if provider == "geotab":
+        return ("https://my.geotab.com/apiv1/oauth/token", GEOTAB_CLIENT_ID, GEOTAB_CLIENT_SECRET, GEOTAB_OAUTH_REDIRECT_URI)
+    return None
+
+async def refresh_oauth_token(provider: str, refresh_token: str) -> dict:
+    client = oauth_client(provider)
+    if client is None:
+        raise RuntimeError(f"Unknown provider {provider}")
+    token_url, client_id, client_secret, _ = client
+    resp = await http_client(token_url).post(token_url, data={
+        "grant_type": "refresh_token",
+        "refresh_token": refresh_token,
+        "client_id": client_id,
+        "client_secret": client_secret,
+    })
+    if resp.status_code >= 400:
+        EXTERNAL_ERRORS.inc(provider=provider)
+        logger.error("OAuth token refresh error: %s %s", resp.status_code, resp.text[:200])
+        raise RuntimeError(f"{provider} token refresh failed with {resp.status_code}")
+    return resp.json()
+
+async def load_connection(user_id: str, provider: str) -> Optional[dict]:
+    conn_resp = await supabase.table("telematics_connections").select("access_token,refresh_token,expires_at,scope").eq("user_id", user_id).eq("provider", provider).maybe_single().execute()
+    return conn_resp.data if conn_resp else None
+
+async def save_connection(user_id: str, provider: str, token: OAuthToken):
+    await supabase.table("telematics_connections").upsert({
+        "user_id": user_id,
+        "provider": provider,
+        **token.to_row(),
+    }, on_conflict="user_id,provider").execute()
+
+token_cache = TokenCache(
+    load_connection,
+    refresh_oauth_token,
+    save_connection,
+    max_size=TOKEN_CACHE_SIZE,
+    margin_s=TOKEN_REFRESH_MARGIN_SECONDS,
+    interval_s=TOKEN_REFRESH_INTERVAL_SECONDS,
+)
+
 @app.get("/auth/{provider}/callback")
-def oauth_callback(provider: str, code: str, state: str):
+async def oauth_callback(provider: str, code: str, state: str):
     user_id = state
-    token_url = None
-    client_id = None
-    client_secret = None
-    redirect_uri = None
-    if provider == "samsara":
-        token_url = "https://api.samsara.com/oauth2/token"
-        client_id = SAMSARA_CLIENT_ID
-        client_secret = SAMSARA_CLIENT_SECRET
-        redirect_uri = SAMSARA_OAUTH_REDIRECT_URI
-    elif provider == "motive":
-        token_url = "https://api.gomotive.com/oauth/token"
-        client_id = MOTIVE_CLIENT_ID
-        client_secret = MOTIVE_CLIENT_SECRET
-        redirect_uri = MOTIVE_OAUTH_REDIRECT_URI
-    elif provider == "geotab":
-        token_url = "https://my.geotab.com/apiv1/oauth/token"
-        client_id = GEOTAB_CLIENT_ID
-        client_secret = GEOTAB_CLIENT_SECRET
-        redirect_uri = GEOTAB_OAUTH_REDIRECT_URI
-    else:
+    client = oauth_client(provider)
+    if client is None:
         raise HTTPException(404, "Unknown provider")
+    token_url, client_id, client_secret, redirect_uri = client
 
     data = {
         "grant_type": "authorization_code",
@@ -382,145 +540,561 @@ def oauth_callback(provider: str, code: str, state: str):
         "client_id": client_id,
         "client_secret": client_secret,
     }
-    resp = requests.post(token_url, data=data)
+    resp = await http_client(token_url).post(token_url, data=data)
     if resp.status_code >= 400:
         logger.error("OAuth token exchange error: %s %s", resp.status_code, resp.text)
         raise HTTPException(400, "Token exchange failed")
-    tokens = resp.json()
-    access_token = tokens.get("access_token")
-    refresh_token = tokens.get("refresh_token")
-    expires_in = tokens.get("expires_in")
-    expires_at = datetime.now(timezone.utc) + timedelta(seconds=expires_in or 3600)
+    token = OAuthToken.from_grant(resp.json())
 
-    supabase.table("telematics_connections").upsert({
-        "user_id": user_id,
-        "provider": provider,
-        "access_token": access_token,
-        "refresh_token": refresh_token,
-        "expires_at": expires_at.isoformat(),
-        "scope": tokens.get("scope"),
-    }, on_conflict="user_id,provider").execute()
+    await save_connection(user_id, provider, token)
+    token_cache.put(user_id, provider, token)
 
     return JSONResponse({"status": "connected", "provider": provider})
 
 # Webhook handlers for telematics providers.
-# These normalize incoming data into reefer_events and may trigger trip completion.
-
-def handle_telematics_event(provider: str, payload: dict):
-    logger.info("Telematics webhook from %s: %s", provider, payload)
-    # This assumes payload contains user_id and truck_id fields that you map via provider config.
-    user_id = payload.get("user_id")
-    truck_id = payload.get("truck_id")
-    if not user_id or not truck_id:
-        logger.warning("Missing user_id/truck_id in webhook payload")
+# Native payloads are normalized per provider (normalizers.py) into reefer_events and may trigger trip completion.
+
+recent_keys = RecentKeys(INGEST_DEDUP_CACHE_SIZE)
+# Rows of inserts that failed after they may have committed (e.g. a read timeout).
+# When a retry finds them already stored, they are ours and still need their rules.
+unconfirmed_writes = RecentKeys(INGEST_DEDUP_CACHE_SIZE)
+
+def write_key(row: dict) -> str:
+    # Same columns as the reefer_events unique index
+    return f"{row['truck_id']}\t{row['dedup_key']}"
+
+def handle_telematics_event(provider: str, payload: dict) -> str:
+    """Queue one payload; returns "accepted", "invalid" or "duplicate"."""
+    if PAYLOAD_LOG_SAMPLE_RATE and random.random() < PAYLOAD_LOG_SAMPLE_RATE:
+        logger.info("Telematics webhook from %s (sampled): %s", provider, payload)
+    try:
+        event = normalize(provider, payload)
+    except InvalidEvent as e:
+        INGEST_INVALID.inc(provider=provider, reason="invalid")
+        logger.warning("Dropping invalid %s payload: %s", provider, e)
+        return "invalid"
+    if recent_keys.seen(event.dedup_key):
+        INGEST_DUPLICATES.inc(provider=provider, layer="memory")
+        return "duplicate"
+    # Raises IngestQueueFull when the buffer is at capacity; the key is only
+    # remembered once queued, so the provider's retry of a 429 gets through
+    ingest_queue.put(event)
+    recent_keys.add(event.dedup_key)
+    return "accepted"
+
+async def load_vehicles(provider: str, external_ids: List[str]) -> dict:
+    trucks = (await supabase.table("trucks").select("id,user_id,external_vehicle_id")
+              .eq("telematics_provider", provider).in_("external_vehicle_id", external_ids).execute()).data
+    return {t["external_vehicle_id"]: (t["id"], t["user_id"]) for t in trucks}
+
+vehicle_index = VehicleIndex(load_vehicles, ttl=VEHICLE_INDEX_TTL_SECONDS, miss_ttl=VEHICLE_INDEX_MISS_TTL_SECONDS)
+
+async def resolve_reefer_events(events: List[ReeferEvent]) -> List[dict]:
+    # Native vehicle ids -> trucks, one bulk lookup per provider on a cache miss
+    pending = {}
+    for event in events:
+        if event.truck_id is None:
+            pending.setdefault(event.provider, set()).add(event.external_vehicle_id)
+    vehicles = {provider: await vehicle_index.resolve(provider, ids) for provider, ids in pending.items()}
+    rows = []
+    cargo = {}
+    unknown = {}
+    for event in events:
+        if event.truck_id is None:
+            match = vehicles[event.provider].get(event.external_vehicle_id)
+            if match is None:
+                key = (event.provider, event.external_vehicle_id)
+                unknown[key] = unknown.get(key, 0) + 1
+                continue
+            event.truck_id, event.user_id = match
+        if event.cargo_type is None:
+            # Native payloads don't know the cargo; it comes from the truck's open trip
+            if event.truck_id not in cargo:
+                trip = await open_trips.get(event.truck_id)
+                cargo[event.truck_id] = trip.get("cargo_type") if trip else None
+            event.cargo_type = cargo[event.truck_id]
+        if raw_archive and event.raw_ref is None:
+            event.raw_ref = raw_archive.add(event.user_id, event.truck_id, event.occurred_at,
+                                            event.provider, event.raw_payload)
+        rows.append(event.to_row())
+    for (provider, external_id), count in unknown.items():
+        INGEST_INVALID.inc(count, provider=provider, reason="unknown_vehicle")
+        logger.warning("Dropping %d readings from unregistered %s vehicle %s", count, provider, external_id)
+    return rows
+
+# SQLSTATE classes for rows Postgres refuses outright: data exceptions and constraint violations
+REFUSED_ROW_SQLSTATES = ("22", "23")
+
+def rows_refused(error: Exception) -> bool:
+    code = getattr(error, "code", None)
+    return isinstance(code, str) and code[:2] in REFUSED_ROW_SQLSTATES
+
+async def flush_reefer_events(events: List[ReeferEvent]):
+    # One multi-row insert per batch, then per-event rules in arrival order.
+    # Nothing after the insert may raise, or the ingest queue would retry it.
+    rows = await resolve_reefer_events(events)
+    if not rows:
         return
+    try:
+        with stage("db_insert"):
+            # ON CONFLICT DO NOTHING on the dedup index: only new rows come back
+            inserted = (await supabase.table("reefer_events")
+                        .upsert(rows, on_conflict="truck_id,dedup_key", ignore_duplicates=True).execute()).data or []
+    except Exception as e:
+        EXTERNAL_ERRORS.inc(provider="supabase")
+        # Let redeliveries through again in case the batch is finally dropped
+        recent_keys.forget(row["dedup_key"] for row in rows)
+        if rows_refused(e):
+            # Retrying can't help; the queue splits the batch to find the bad rows
+            raise BatchRejected(str(e)) from e
+        for row in rows:
+            unconfirmed_writes.add(write_key(row))
+        raise
+    if len(inserted) < len(rows):
+        # Already stored by another process (or before a restart): skip their rules too,
+        # unless it was this batch's own earlier attempt that stored them
+        new_keys = {write_key(row) for row in inserted}
+        for row in rows:
+            key = write_key(row)
+            if key in new_keys:
+                continue
+            if unconfirmed_writes.seen(key):
+                new_keys.add(key)
+            else:
+                INGEST_DUPLICATES.inc(provider=row["provider"], layer="database")
+        rows = [row for row in rows if write_key(row) in new_keys]
+    unconfirmed_writes.forget(write_key(row) for row in rows)
+    live_hub.publish_readings(rows)
+    for name, step in (("rollup_update", update_rollups), ("excursion_check", check_excursions)):
+        try:
+            with stage(name):
+                await step(rows)
+        except Exception as e:
+            logger.error("Post-insert step %s failed for %d rows: %s", step.__name__, len(rows), e)
+    for row in rows:
+        try:
+            await apply_event_rules(row)
+        except Exception as e:
+            logger.error("Event rules failed for truck %s: %s", row["truck_id"], e)
 
-    event_type = payload.get("event_type")
-    cargo_type = payload.get("cargo_type")
-    temperature = payload.get("temperature")
-    setpoint = payload.get("setpoint")
-    latitude = payload.get("latitude")
-    longitude = payload.get("longitude")
-    occurred_at = payload.get("occurred_at") or datetime.now(timezone.utc).isoformat()
+async def update_rollups(rows: List[dict]):
+    partials = rollup_aggregator.aggregate(rows)
+    if partials:
+        # Additive merge happens in SQL so concurrent API processes can't clobber each other
+        await supabase.rpc("merge_temperature_rollups", {"rollups": partials}).execute()
 
-    supabase.table("reefer_events").insert({
-        "user_id": user_id,
-        "truck_id": truck_id,
-        "provider": provider,
-        "event_type": event_type,
-        "cargo_type": cargo_type,
-        "temperature": temperature,
-        "setpoint": setpoint,
-        "latitude": latitude,
-        "longitude": longitude,
-        "raw_payload": payload,
-        "occurred_at": occurred_at,
-    }).execute()
-
-    # Simple temp range logic
-    if temperature is not None and cargo_type:
-        # Example ranges
-        ranges = {
-            "frozen": (-20, 10),
-            "fresh": (30, 40),
-            "produce": (34, 42),
-        }
-        rng = ranges.get(cargo_type.lower())
-        if rng:
-            low, high = rng
-            if temperature < low or temperature > high:
-                # Attempt auto-recovery via OEM API
-                try:
-                    execute_recovery_command(provider, user_id, truck_id, setpoint= (low + high) / 2)
-                except Exception as e:
-                    logger.error("Recovery command failed: %s", e)
+async def check_excursions(rows: List[dict]):
+    # Whole batch goes through the per-truck hysteresis state machine at once
+    latest = {row["truck_id"]: row for row in rows}
+    for tr in excursion_detector.process_rows(rows):
+        exc = tr.excursion
+        if tr.kind == "started":
+            logger.warning("Excursion started for truck %s at %s (peak %s)", tr.truck_id, exc.to_dict()["started_at"], exc.peak_temperature)
+            live_hub.publish(latest[tr.truck_id]["user_id"], "excursion_started", exc.to_dict())
+        elif tr.kind == "ended":
+            logger.info("Excursion ended for truck %s after %.0fs (peak %s)", tr.truck_id, exc.duration_s, exc.peak_temperature)
+            live_hub.publish(latest[tr.truck_id]["user_id"], "excursion_ended", exc.to_dict())
+        elif tr.kind == "recover":
+            # Attempt auto-recovery via OEM API, rate-limited by the detector's cooldown
+            row = latest[tr.truck_id]
+            try:
+                await execute_recovery_command(row["provider"], row["user_id"], tr.truck_id, setpoint=tr.setpoint)
+            except Exception as e:
+                EXTERNAL_ERRORS.inc(provider=row["provider"])
+                logger.error("Recovery command failed: %s", e)
+
+async def apply_event_rules(row: dict):
+    truck_id = row["truck_id"]
+    event_type = row["event_type"]
+    latitude = row["latitude"]
+    longitude = row["longitude"]
+    occurred_at = row["occurred_at"]
 
     # Trip completion detection: ignition_off near receiver
     if event_type == "ignition_off":
-        # Find open trip for this truck
-        trips = supabase.table("reefer_trips").select("*").eq("truck_id", truck_id).eq("status", "open").execute().data
-        if trips:
-            trip = trips[0]
-            receiver_lat = trip.get("receiver_lat")
-            receiver_lng = trip.get("receiver_lng")
-            if receiver_lat is not None and receiver_lng is not None and latitude and longitude:
-                # naive distance check
-                dist = abs(float(receiver_lat) - float(latitude)) + abs(float(receiver_lng) - float(longitude))
-                if dist < 0.5:  # rough threshold
-                    # close trip and generate cert
-                    supabase.table("reefer_trips").update({
-                        "status": "completed",
-                        "ended_at": occurred_at,
-                    }).eq("id", trip["id"]).execute()
-                    complete_trip_and_issue_certificate(trip["id"])
-
-def execute_recovery_command(provider: str, user_id: str, truck_id: str, setpoint: float):
-    conn = supabase.table("telematics_connections").select("*").eq("user_id", user_id).eq("provider", provider).maybe_single().execute().data
-    if not conn:
+        # Open trip comes from the in-memory index; no DB round trip on a hit
+        trip = await open_trips.get(truck_id)
+        if trip and within_geofence(trip, latitude, longitude, TRIP_GEOFENCE_RADIUS_M):
+            # The trip stays open (and keeps taking late readings) until the watermark passes
+            await trip_closer.hold(trip, occurred_at)
+    elif event_type == "ignition_on":
+        # Moving again: the stop at the receiver wasn't the end of the trip
+        trip_closer.cancel(truck_id, occurred_at)
+
+async def close_trip(trip: dict, ended_at: str):
+    # Conditional on the trip still being open, so concurrent ignition_offs
+    # (other shards or processes) close it exactly once
+    closed = (await supabase.table("reefer_trips").update({
+        "status": "completed",
+        "ended_at": ended_at,
+    }).eq("id", trip["id"]).eq("status", "open").execute()).data
+    open_trips.put({**trip, "status": "completed"})
+    if not closed:
+        logger.info("Trip %s was already closed; not issuing another certificate", trip["id"])
+        return
+    # Issuance happens out of band on the certificate workers
+    await enqueue_certificate_job(trip)
+
+async def load_open_trip(truck_id: str) -> Optional[dict]:
+    trips = (await supabase.table("reefer_trips").select("id,user_id,truck_id,cargo_type,receiver_lat,receiver_lng,status")
+             .eq("truck_id", truck_id).eq("status", "open").limit(1).execute()).data
+    return trips[0] if trips else None
+
+live_hub = LiveHub(coalesce=LIVE_COALESCE_SECONDS, max_pending=LIVE_MAX_PENDING,
+                   max_per_user=LIVE_MAX_CONNECTIONS_PER_USER)
+
+open_trips = OpenTripIndex(load_open_trip, ttl=TRIP_INDEX_TTL_SECONDS)
+trip_closer = TripCloser(close_trip, watermark=TRIP_CLOSE_WATERMARK_SECONDS)
+
+cargo_thresholds = build_thresholds(
+    json.loads(CARGO_THRESHOLDS_JSON) if CARGO_THRESHOLDS_JSON else None,
+    hysteresis=EXCURSION_HYSTERESIS,
+    min_duration_s=EXCURSION_MIN_DURATION_SECONDS,
+)
+excursion_detector = ExcursionDetector(cargo_thresholds, recovery_cooldown_s=RECOVERY_COOLDOWN_SECONDS)
+rollup_aggregator = RollupAggregator(cargo_thresholds)
+
+async def execute_recovery_command(provider: str, user_id: str, truck_id: str, setpoint: float):
+    # Token comes from the in-process cache, already renewed ahead of expiry
+    token = await token_cache.get(user_id, provider)
+    if not token:
         logger.warning("No telematics connection found for recovery")
         return
-    token = conn["access_token"]
-    headers = {"Authorization": f"Bearer {token}"}
 
     if provider == "samsara":
         # Placeholder: adjust to Samsara's reefer API
         url = f"https://api.samsara.com/fleet/assets/{truck_id}/reefer/setpoint"
-        resp = requests.post(url, headers=headers, json={"setPoint": setpoint})
-        logger.info("Samsara recovery response: %s %s", resp.status_code, resp.text[:200])
+        body = {"setPoint": setpoint}
     elif provider == "motive":
         url = f"https://api.gomotive.com/v1/reefers/{truck_id}/set_temperature"
-        resp = requests.post(url, headers=headers, json={"set_temperature": setpoint})
-        logger.info("Motive recovery response: %s %s", resp.status_code, resp.text[:200])
+        body = {"set_temperature": setpoint}
     elif provider == "geotab":
         # Geotab may not support remote setpoint; placeholder no-op
         logger.info("Geotab recovery not implemented; provider may not support remote setpoint")
+        return
     else:
         logger.warning("Unknown provider for recovery command: %s", provider)
+        return
+
+    with stage("recovery_command"):
+        resp = await http_client(url).post(url, headers={"Authorization": f"Bearer {token.access_token}"}, json=body)
+        if resp.status_code == 401 and token.refresh_token:
+            # Revoked or expired early: renew once and retry
+            token = await token_cache.refresh(user_id, provider)
+            resp = await http_client(url).post(url, headers={"Authorization": f"Bearer {token.access_token}"}, json=body)
+    if resp.status_code >= 400:
+        EXTERNAL_ERRORS.inc(provider=provider)
+    logger.info("%s recovery response: %s %s", provider.capitalize(), resp.status_code, resp.text[:200])
+
+NDJSON_CONTENT_TYPES = ("application/x-ndjson", "application/ndjson", "application/jsonl")
+
+def ingest_shard_key(event: ReeferEvent) -> str:
+    # Native payloads aren't resolved to a truck yet; their vehicle id is just as stable
+    return event.truck_id or f"{event.provider}:{event.external_vehicle_id}"
+
+ingest_queue = ShardedIngestQueue(
+    flush_reefer_events,
+    ingest_shard_key,
+    shards=INGEST_SHARDS,
+    max_batch=INGEST_BATCH_SIZE,
+    max_delay=INGEST_FLUSH_INTERVAL_MS / 1000,
+    max_size=INGEST_MAX_QUEUE,
+)
 
 @app.post("/webhooks/{provider}")
-async def telematics_webhook(provider: str, request: Request, background_tasks: BackgroundTasks):
-    payload = await request.json()
+async def telematics_webhook(provider: str, request: Request):
     # In a real app, validate HMAC / signatures per provider.
-    background_tasks.add_task(handle_telematics_event, provider, payload)
-    return {"status": "ok"}
+    # Accepts a single JSON object, a JSON array of readings, or a streamed NDJSON body.
+    content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    counts = {"accepted": 0, "invalid": 0, "duplicate": 0}
+    try:
+        if content_type in NDJSON_CONTENT_TYPES:
+            async for payload in iter_ndjson(request.stream()):
+                counts[handle_telematics_event(provider, payload)] += 1
+        else:
+            body = await request.json()
+            payloads = body if isinstance(body, list) else [body]
+            for payload in payloads:
+                if not isinstance(payload, dict):
+                    logger.warning("Skipping non-object reading in webhook batch")
+                    counts["invalid"] += 1
+                    continue
+                counts[handle_telematics_event(provider, payload)] += 1
+    except IngestQueueFull:
+        INGEST_EVENTS.inc(counts["accepted"], provider=provider)
+        INGEST_REJECTED.inc(provider=provider)
+        raise HTTPException(429, {"message": "Ingest queue full, retry later", "accepted": counts["accepted"]})
+    except ValueError:
+        raise HTTPException(400, "Invalid JSON body")
+    INGEST_EVENTS.inc(counts["accepted"], provider=provider)
+    return {"status": "ok", "accepted": counts["accepted"], "invalid": counts["invalid"], "duplicates": counts["duplicate"]}
 
-@app.get("/cron/daily-digest")
-def daily_digest():
-    yesterday = datetime.now(timezone.utc) - timedelta(days=1)
-    # For each profile with daily_digest enabled, aggregate certificates
-    profiles = supabase.table("profiles").select("*").eq("daily_digest", True).execute().data or []
-    for prof in profiles:
-        user_id = prof["id"]
-        email = prof["email"]
-        certs = supabase.table("reefer_certificates").select("*").eq("user_id", user_id)            .gte("created_at", yesterday.isoformat()).execute().data or []
-        if not certs:
-            continue
-        html = "<h2>Your ReeferShield daily digest</h2><ul>"
-        for c_row in certs:
-            html += f"<li>Truck {c_row['truck_id']} – Trip {c_row.get('trip_id')} – Created {c_row['created_at']}</li>"
-        html += "</ul>"
+@app.get("/ingest/stats")
+def ingest_stats():
+    stats = {**ingest_queue.stats(), "open_trips": open_trips.stats(), "vehicles": vehicle_index.stats(),
+             "trip_closes": trip_closer.stats(), "dedup": recent_keys.stats(), "live": live_hub.stats()}
+    if raw_archive:
+        stats["raw_archive"] = raw_archive.stats()
+    return stats
+
+@REGISTRY.collector
+def collect_backend_stats():
+    queue = ingest_queue.stats()
+    yield ("reefershield_ingest_queue_depth", "gauge", "Readings buffered for the next insert", [({}, queue["depth"])])
+    yield ("reefershield_ingest_shard_depth", "gauge", "Readings buffered per ingest shard",
+           [({"shard": str(i)}, depth) for i, depth in enumerate(queue["shard_depths"])])
+    yield ("reefershield_ingest_flush_errors_total", "counter", "Failed reefer_events batch inserts", [({}, queue["flush_errors"])])
+    yield ("reefershield_ingest_dropped_total", "counter", "Readings dropped after insert retries or refused by the database", [({}, queue["dropped_total"])])
+    trips = open_trips.stats()
+    yield ("reefershield_trip_closes_pending", "gauge", "Trip closes waiting for the late-arrival watermark",
+           [({}, trip_closer.stats()["pending"])])
+    yield ("reefershield_open_trip_cache_hits_total", "counter", "Open-trip index hits", [({}, trips["hits"])])
+    yield ("reefershield_open_trip_cache_misses_total", "counter", "Open-trip index misses", [({}, trips["misses"])])
+    live = live_hub.stats()
+    yield ("reefershield_live_subscribers", "gauge", "Open dashboard live streams", [({}, live["subscribers"])])
+    yield ("reefershield_live_dropped_total", "counter", "Live alerts dropped for clients that fell behind",
+           [({}, live["dropped"])])
+    vehicles = vehicle_index.stats()
+    yield ("reefershield_vehicle_cache_misses_total", "counter", "Vehicle id lookups that went to the database", [({}, vehicles["misses"])])
+    tokens = token_cache.stats()
+    yield ("reefershield_oauth_token_refreshes_total", "counter", "Telematics token refreshes", [({}, tokens["refreshes"])])
+    if raw_archive:
+        archive = raw_archive.stats()
+        yield ("reefershield_raw_archive_buffered", "gauge", "Raw payloads waiting for their segment write", [({}, archive["buffered"])])
+        yield ("reefershield_raw_archive_bytes_total", "counter", "Parquet segment bytes written", [({}, archive["bytes_written"])])
+    if ipfs_uploader:
+        yield ("reefershield_ipfs_uploads_inflight", "gauge", "Background IPFS uploads in progress",
+               [({}, ipfs_uploader.stats()["inflight"])])
+
+async def authenticate_user(authorization: Optional[str]) -> str:
+    # Supabase access token from the dashboard session; the user id comes from Supabase, not the client
+    scheme, _, token = (authorization or "").partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        raise HTTPException(401, "Missing bearer token")
+    try:
+        resp = await supabase.auth.get_user(token)
+    except Exception as e:
+        logger.info("Rejected bearer token: %s", e)
+        resp = None
+    if not resp or not resp.user:
+        raise HTTPException(401, "Invalid or expired token")
+    return resp.user.id
+
+async def owned_trip(trip_id: str, user_id: str) -> dict:
+    # Someone else's trip is reported as missing, so trip ids can't be probed
+    trip_resp = await supabase.table("reefer_trips").select("*").eq("id", trip_id).maybe_single().execute()
+    trip = trip_resp.data if trip_resp else None
+    if not trip or trip.get("user_id") != user_id:
+        raise HTTPException(404, "Trip not found")
+    return trip
+
+@app.get("/live")
+async def live_stream(authorization: Optional[str] = Header(None)):
+    # Server-Sent Events: reading, excursion_started, excursion_ended, certificate_ready,
+    # and overflow when this client fell behind and should reload
+    user_id = await authenticate_user(authorization)
+    try:
+        subscriber = live_hub.subscribe(user_id)
+    except LiveSubscriberLimit as e:
+        raise HTTPException(429, str(e))
+
+    async def events():
         try:
-            send_certificate_email([email], "ReeferShield daily digest", html, pdf_bytes=b"")
-        except Exception as e:
-            logger.error("Error sending daily digest: %s", e)
+            yield ": connected\n\n"
+            ends_at = time.monotonic() + LIVE_STREAM_MAX_SECONDS
+            while time.monotonic() < ends_at:
+                batch = await subscriber.next_batch(min(LIVE_HEARTBEAT_SECONDS, ends_at - time.monotonic()))
+                if batch is None:
+                    break
+                yield "".join(batch) if batch else ": keepalive\n\n"
+        finally:
+            live_hub.unsubscribe(subscriber)
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.get("/metrics")
+def metrics():
+    return PlainTextResponse(REGISTRY.render(), media_type=CONTENT_TYPE)
+
+@app.get("/trips/{trip_id}/excursions")
+async def trip_excursions(trip_id: str, authorization: Optional[str] = Header(None)):
+    trip = await owned_trip(trip_id, await authenticate_user(authorization))
+    th = cargo_thresholds.get((trip.get("cargo_type") or "").lower())
+    if th is None:
+        return {"trip_id": trip_id, "excursions": []}
+    reducer = TripExcursionReducer(th, trip["truck_id"], trip["cargo_type"])
+    async for page in iter_trip_events(trip, columns="id,occurred_at,temperature"):
+        reducer.add(*event_arrays(page))
+    return {"trip_id": trip_id, "excursions": [e.to_dict() for e in reducer.result()]}
+
+@app.get("/trips/{trip_id}/raw-payloads")
+async def trip_raw_payloads(trip_id: str, authorization: Optional[str] = Header(None)):
+    # NDJSON replay of the trip's raw webhook payloads, from the archive when enabled
+    trip = await owned_trip(trip_id, await authenticate_user(authorization))
+
+    async def lines():
+        if raw_archive_reader:
+            end = parse_time(trip["ended_at"]) if trip.get("ended_at") else datetime.now(timezone.utc)
+            payloads = raw_archive_reader.iter_trip(trip["truck_id"], parse_time(trip["started_at"]), end, trip["user_id"])
+            # Pulled a page at a time off the event loop; only the segments being merged are held
+            while True:
+                page = await asyncio.to_thread(lambda: list(itertools.islice(payloads, EVENT_PAGE_SIZE)))
+                if not page:
+                    return
+                yield "".join(payload + "\n" for _, payload in page)
+        async for page in iter_trip_events(trip, columns="id,occurred_at,raw_payload"):
+            for event in page:
+                yield json.dumps(event["raw_payload"]) + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+@app.get("/trucks/{truck_id}/temperature")
+async def truck_temperature_history(truck_id: str, start: datetime, end: datetime, resolution: int = 3600,
+                                    authorization: Optional[str] = Header(None)):
+    # Served from the coarsest stored rollup that evenly divides `resolution` (seconds)
+    user_id = await authenticate_user(authorization)
+    if resolution < ROLLUP_RESOLUTIONS[0] or resolution % ROLLUP_RESOLUTIONS[0]:
+        # Any other size would split stored buckets across two output buckets
+        raise HTTPException(400, f"resolution must be a multiple of {ROLLUP_RESOLUTIONS[0]} seconds")
+    source = pick_resolution(resolution)
+    merger = RollupMerger(resolution)
+    cursor = start.isoformat()
+    op = "gte"
+    while True:
+        query = (supabase.table("temperature_rollups")
+                 .select("bucket_start,min_temp,max_temp,sum_temp,count,out_of_range_s")
+                 .eq("user_id", user_id).eq("truck_id", truck_id).eq("resolution_s", source))
+        page = (await getattr(query, op)("bucket_start", cursor).lt("bucket_start", end.isoformat())
+                .order("bucket_start").limit(EVENT_PAGE_SIZE).execute()).data or []
+        merger.add(page)
+        if len(page) < EVENT_PAGE_SIZE:
+            break
+        cursor, op = page[-1]["bucket_start"], "gt"
+    return {
+        "truck_id": truck_id,
+        "resolution": resolution,
+        "source_resolution": source,
+        "buckets": merger.result(),
+    }
+
+@app.get("/certificates/{trip_id}/status")
+async def certificate_status(trip_id: str, authorization: Optional[str] = Header(None)):
+    await owned_trip(trip_id, await authenticate_user(authorization))
+    job_resp = await supabase.table("certificate_jobs").select(
+        "trip_id,status,stage,attempts,next_attempt_at,last_error,ipfs_cid,polygon_tx_hash,merkle_root,certificate_id,created_at,updated_at"
+    ).eq("trip_id", trip_id).maybe_single().execute()
+    if not job_resp or not job_resp.data:
+        raise HTTPException(404, "No certificate job for trip")
+    return job_resp.data
+
+# Supabase Database Webhook on reefer_trips (INSERT/UPDATE/DELETE) keeps the open-trip index current
+@app.post("/hooks/reefer-trips")
+async def reefer_trips_hook(request: Request):
+    if not TRIP_HOOK_SECRET:
+        # Without a secret anyone could push fake trips into the index
+        raise HTTPException(500, "Trip hook not configured")
+    if not hmac.compare_digest(request.headers.get("x-webhook-secret", "").encode(), TRIP_HOOK_SECRET.encode()):
+        raise HTTPException(401, "Invalid webhook secret")
+    payload = await request.json()
+    record = payload.get("record")
+    old_record = payload.get("old_record")
+    if payload.get("type") == "DELETE" or not record:
+        if old_record and old_record.get("truck_id"):
+            open_trips.invalidate(old_record["truck_id"])
+    elif record.get("truck_id"):
+        if old_record and old_record.get("truck_id") and old_record["truck_id"] != record["truck_id"]:
+            open_trips.invalidate(old_record["truck_id"])
+        open_trips.put(record)
     return {"status": "ok"}
+
+@app.get("/cron/daily-digest")
+async def daily_digest():
+    # One checkpoint row per UTC day: a rerun after a crash or timeout resumes
+    # after the last fully sent page, and a finished day is not sent again.
+    if not RESEND_API_KEY:
+        logger.warning("RESEND_API_KEY missing; skipping daily digest")
+        return {"status": "skipped"}
+    started = time.perf_counter()
+    now = datetime.now(timezone.utc)
+    run_date = now.date().isoformat()
+    await supabase.table("digest_runs").upsert({
+        "run_date": run_date,
+        "since": (now - timedelta(days=1)).isoformat(),
+    }, on_conflict="run_date", ignore_duplicates=True).execute()
+    run = (await supabase.table("digest_runs").select("*").eq("run_date", run_date).single().execute()).data
+    if run["status"] == "done":
+        return {"status": "already_sent", "run_date": run_date, "metrics": run.get("metrics")}
+
+    metrics = DigestMetrics()
+    cursor = run.get("cursor")
+    users, failed = run.get("users") or 0, run.get("emails_failed") or 0
+    slots = asyncio.Semaphore(DIGEST_SEND_CONCURRENCY)
+
+    async def send(batch: List[dict]) -> int:
+        key = hashlib.sha256("\n".join(m["to"][0] for m in batch).encode()).hexdigest()[:32]
+        async with slots:
+            try:
+                await send_email_batch(batch, f"digest/{run_date}/{key}")
+                return 0
+            except Exception as e:
+                logger.error("Daily digest batch of %d failed: %s", len(batch), e)
+                return len(batch)
+
+    while True:
+        t = time.perf_counter()
+        # All digest users' certificates since the run's window start, grouped per user in SQL
+        page = (await supabase.rpc("daily_digest_page", {
+            "since": run["since"],
+            "after_user": cursor,
+            "max_users": DIGEST_PAGE_USERS,
+            "max_items": DIGEST_MAX_ITEMS,
+        }).execute()).data or []
+        metrics.query_s += time.perf_counter() - t
+        if not page:
+            break
+
+        t = time.perf_counter()
+        messages = digest_messages(page, FROM_EMAIL)
+        metrics.render_s += time.perf_counter() - t
+
+        t = time.perf_counter()
+        chunks = list(batches(messages))
+        results = await asyncio.gather(*(send(chunk) for chunk in chunks))
+        metrics.send_s += time.perf_counter() - t
+        page_failed = sum(results)
+
+        metrics.pages += 1
+        metrics.users += len(page)
+        metrics.emails += len(messages) - page_failed
+        metrics.batches += len(chunks)
+        metrics.failed_emails += page_failed
+        metrics.failed_batches += sum(1 for n in results if n)
+        failed += page_failed
+        if page_failed:
+            # Keep the cursor before this page so the next call sends it again;
+            # the batches that did go out are skipped by their idempotency keys
+            await supabase.table("digest_runs").update({"emails_failed": failed}).eq("run_date", run_date).execute()
+            break
+        cursor = page[-1]["user_id"]
+        users += len(page)
+        await supabase.table("digest_runs").update({
+            "cursor": cursor,
+            "users": users,
+            "emails_failed": failed,
+        }).eq("run_date", run_date).execute()
+        if len(page) < DIGEST_PAGE_USERS:
+            break
+
+    metrics.total_s = time.perf_counter() - started
+    if metrics.failed_batches:
+        await supabase.table("digest_runs").update({"metrics": metrics.to_dict()}).eq("run_date", run_date).execute()
+        logger.error("Daily digest %s stopped at a failed page: %s", run_date, metrics.to_dict())
+        return JSONResponse({"status": "incomplete", "run_date": run_date, "metrics": metrics.to_dict()}, status_code=502)
+    await supabase.table("digest_runs").update({
+        "status": "done",
+        "finished_at": datetime.now(timezone.utc).isoformat(),
+        "metrics": metrics.to_dict(),
+    }).eq("run_date", run_date).execute()
+    logger.info("Daily digest %s: %s", run_date, metrics.to_dict())
+    return {"status": "ok", "run_date": run_date, "metrics": metrics.to_dict()}
@@ -0,0 +1,192 @@
+"""Prometheus text-format metrics and optional OpenTelemetry spans.
+
+Metrics are per process: the API serves its own at GET /metrics, and
+cert_worker.py can serve each worker's on CERT_WORKER_METRICS_PORT.
+"""
+import bisect
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Iterable, List, Sequence, Tuple
+
+logger = logging.getLogger("reefershield")
+
+OTEL_TRACING_ENABLED = os.getenv("OTEL_TRACING_ENABLED", "").lower() in ("1", "true", "yes")
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+Labels = Tuple[str, ...]
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence, extra: str = "") -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _num(value: float) -> str:
+    value = float(value)
+    return str(int(value)) if value.is_integer() else repr(value)
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Labels, float] = {}
+
+    def inc(self, value: float = 1, **labels):
+        key = tuple(str(labels.get(n, "")) for n in self.labelnames)
+        self._values[key] = self._values.get(key, 0) + value
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        # copy() is atomic, so a worker's metrics thread can render mid-update
+        for key, value in sorted(self._values.copy().items()):
+            yield f"{self.name}{_labels(self.labelnames, key)} {_num(value)}"
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Per label set: [per-bucket counts..., +Inf count], sum
+        self._series: Dict[Labels, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels.get(n, "")) for n in self.labelnames)
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = ([0] * (len(self.buckets) + 1), [0.0])
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1][0] += value
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        for key, (counts, total) in sorted(self._series.copy().items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = 'le="+Inf"' if bound == float("inf") else f'le="{_num(bound)}"'
+                yield f"{self.name}_bucket{_labels(self.labelnames, key, le)} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.labelnames, key)} {_num(total[0])}"
+            yield f"{self.name}_count{_labels(self.labelnames, key)} {cumulative}"
+
+
+class Registry:
+    """Counters and histograms, plus collectors read at scrape time.
+
+    A collector returns (name, type, help, [(labels dict, value), ...]) tuples,
+    so existing `stats()` dicts can be exported without double bookkeeping.
+    """
+
+    def __init__(self):
+        self._metrics: List = []
+        self._collectors: List[Callable[[], Iterable[tuple]]] = []
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        metric = Counter(name, help, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, help: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        metric = Histogram(name, help, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def collector(self, fn: Callable[[], Iterable[tuple]]):
+        self._collectors.append(fn)
+        return fn
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for fn in self._collectors:
+            try:
+                families = list(fn())
+            except Exception as e:
+                logger.error("Metrics collector %s failed: %s", getattr(fn, "__name__", fn), e)
+                continue
+            for name, kind, help, samples in families:
+                lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in samples:
+                    if value is None:
+                        continue
+                    lines.append(f"{name}{_labels(list(labels), list(labels.values()))} {_num(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+INGEST_EVENTS = REGISTRY.counter(
+    "reefershield_ingest_events_total", "Telematics readings accepted by webhooks", ("provider",))
+INGEST_REJECTED = REGISTRY.counter(
+    "reefershield_ingest_rejected_total", "Readings rejected with 429 because the ingest queue was full", ("provider",))
+INGEST_INVALID = REGISTRY.counter(
+    "reefershield_ingest_invalid_total", "Readings dropped as invalid or from unregistered vehicles",
+    ("provider", "reason"))
+INGEST_DUPLICATES = REGISTRY.counter(
+    "reefershield_ingest_duplicates_total", "Redelivered readings skipped by the in-memory filter or the unique index",
+    ("provider", "layer"))
+STAGE_SECONDS = REGISTRY.histogram(
+    "reefershield_stage_seconds", "Latency of backend hot-path stages", ("stage",))
+EXTERNAL_ERRORS = REGISTRY.counter(
+    "reefershield_external_errors_total", "Failed calls to external services", ("provider",))
+
+_tracer = None
+if OTEL_TRACING_ENABLED:
+    try:
+        from opentelemetry import trace
+        _tracer = trace.get_tracer("reefershield")
+    except ImportError:
+        logger.warning("OTEL_TRACING_ENABLED is set but opentelemetry-api is not installed")
+
+
+@contextmanager
+def stage(name: str, **attributes):
+    """Time a hot-path stage into reefershield_stage_seconds, inside a span when tracing is on."""
+    span = _tracer.start_as_current_span(name, attributes=attributes) if _tracer else nullcontext()
+    start = time.perf_counter()
+    with span:
+        try:
+            yield
+        finally:
+            STAGE_SECONDS.observe(time.perf_counter() - start, stage=name)
+
+
+def start_metrics_server(port: int, registry: Registry = REGISTRY) -> ThreadingHTTPServer:
+    """Serve `registry` on 0.0.0.0:port/metrics from a daemon thread (for worker processes)."""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = registry.render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("0.0.0.0", port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
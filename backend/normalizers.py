@@ -0,0 +1,415 @@
+import hashlib
+import math
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+# Cargo thresholds and rollups are in °F; plausibility bounds for a reefer reading
+TEMP_MIN_F = -100.0
+TEMP_MAX_F = 200.0
+
+VehicleKey = Tuple[str, str]  # (provider, external_vehicle_id)
+
+
+class InvalidEvent(ValueError):
+    pass
+
+
+class ReeferEvent:
+    """One normalized reading as it waits in the ingest queue.
+
+    `truck_id`/`user_id` stay None for native payloads until the vehicle is
+    resolved from `external_vehicle_id` at flush time. `dedup_key` is the same
+    for every delivery of one reading: the provider's event id when it has
+    one, otherwise vehicle, event type and timestamp.
+    """
+
+    __slots__ = ("user_id", "truck_id", "provider", "external_vehicle_id", "event_type", "cargo_type",
+                 "temperature", "setpoint", "latitude", "longitude", "occurred_at", "raw_payload", "raw_ref",
+                 "dedup_key")
+
+    def __init__(self, provider: str, raw_payload: dict, occurred_at: str, event_type: Optional[str] = None,
+                 user_id: Optional[str] = None, truck_id: Optional[str] = None,
+                 external_vehicle_id: Optional[str] = None, cargo_type: Optional[str] = None,
+                 temperature: Optional[float] = None, setpoint: Optional[float] = None,
+                 latitude: Optional[float] = None, longitude: Optional[float] = None,
+                 event_id: Optional[str] = None):
+        self.user_id = user_id
+        self.truck_id = truck_id
+        self.provider = provider
+        self.external_vehicle_id = external_vehicle_id
+        self.event_type = event_type
+        self.cargo_type = cargo_type
+        self.temperature = temperature
+        self.setpoint = setpoint
+        self.latitude = latitude
+        self.longitude = longitude
+        self.occurred_at = occurred_at
+        self.raw_payload = raw_payload
+        self.raw_ref = None
+        source = f"id:{event_id}" if event_id else f"{external_vehicle_id or truck_id}|{event_type}|{occurred_at}"
+        self.dedup_key = hashlib.blake2b(f"{provider}|{source}".encode(), digest_size=16).hexdigest()
+
+    def to_row(self) -> dict:
+        """reefer_events row (external_vehicle_id only lives in raw_payload).
+
+        Once the payload is archived (`raw_ref` set) only the pointer is stored.
+        """
+        row = {
+            "user_id": self.user_id,
+            "truck_id": self.truck_id,
+            "provider": self.provider,
+            "event_type": self.event_type,
+            "cargo_type": self.cargo_type,
+            "temperature": self.temperature,
+            "setpoint": self.setpoint,
+            "latitude": self.latitude,
+            "longitude": self.longitude,
+            "raw_payload": self.raw_payload,
+            "occurred_at": self.occurred_at,
+            "dedup_key": self.dedup_key,
+        }
+        if self.raw_ref is not None:
+            row["raw_payload"] = None
+            row["raw_ref"] = self.raw_ref
+        return row
+
+
+def field(path: str) -> Callable[[dict], object]:
+    """Getter for a dotted path, compiled once; None when any step is missing."""
+    keys = tuple(path.split("."))
+    if len(keys) == 1:
+        key = keys[0]
+        return lambda payload: payload.get(key)
+
+    def get(payload: dict):
+        value = payload
+        try:
+            for key in keys:
+                value = value[key]
+        except (KeyError, TypeError, IndexError):
+            return None
+        return value
+    return get
+
+
+def _none(payload: dict):
+    return None
+
+
+def c_to_f(value: float) -> float:
+    return round(value * 9 / 5 + 32, 2)
+
+
+def milli_c_to_f(value: float) -> float:
+    return c_to_f(value / 1000)
+
+
+UNIT_CONVERTERS = {
+    "F": lambda v: v,
+    "C": c_to_f,
+    "mC": milli_c_to_f,
+}
+
+
+def _number(value, name: str) -> Optional[float]:
+    if value is None:
+        return None
+    if isinstance(value, bool):
+        raise InvalidEvent(f"{name} is not a number")
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        raise InvalidEvent(f"{name} is not a number") from None
+    if not math.isfinite(number):
+        raise InvalidEvent(f"{name} is not finite")
+    return number
+
+
+def _temperature(value, name: str, convert: Callable[[float], float]) -> Optional[float]:
+    number = _number(value, name)
+    if number is None:
+        return None
+    number = convert(number)
+    if not TEMP_MIN_F <= number <= TEMP_MAX_F:
+        raise InvalidEvent(f"{name} {number}°F out of range")
+    return number
+
+
+def _coordinate(value, name: str, limit: float) -> Optional[float]:
+    number = _number(value, name)
+    if number is not None and not -limit <= number <= limit:
+        raise InvalidEvent(f"{name} {number} out of range")
+    return number
+
+
+def _identifier(value, name: str = "event id") -> Optional[str]:
+    if value is None or value == "":
+        return None
+    # Ids come as strings or integers; str() of a list or dict is not an id
+    if isinstance(value, bool) or not isinstance(value, (str, int)):
+        raise InvalidEvent(f"{name} is not a string or integer")
+    return str(value)
+
+
+def _uuid(value, name: str) -> str:
+    # Checked here so one malformed id can't fail the multi-row insert it lands in
+    if not isinstance(value, str):
+        raise InvalidEvent(f"missing or non-string {name}")
+    try:
+        uuid.UUID(value)
+    except ValueError:
+        raise InvalidEvent(f"{name} {value!r} is not a UUID") from None
+    return value
+
+
+def _text(value, name: str) -> Optional[str]:
+    if value is not None and not isinstance(value, str):
+        raise InvalidEvent(f"{name} is not a string")
+    return value
+
+
+def _timestamp(value) -> str:
+    if not isinstance(value, str):
+        raise InvalidEvent("missing or non-string timestamp")
+    try:
+        parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        raise InvalidEvent(f"unparseable timestamp {value!r}") from None
+    if parsed.tzinfo is None:
+        raise InvalidEvent(f"timestamp {value!r} has no UTC offset")
+    return value
+
+
+class Normalizer:
+    """Maps one provider's native payload onto a ReeferEvent.
+
+    Field paths are compiled into getters once, at registration. `unit` is
+    the provider's fixed temperature unit ("F", "C" or "mC" for
+    milli-Celsius); `unit_field` overrides it per payload when present.
+    """
+
+    def __init__(self, provider: str, vehicle_id: str, occurred_at: str, event_type: Optional[str] = None,
+                 event_types: Optional[Dict[str, str]] = None, temperature: Optional[str] = None,
+                 setpoint: Optional[str] = None, latitude: Optional[str] = None,
+                 longitude: Optional[str] = None, cargo_type: Optional[str] = None,
+                 unit: str = "F", unit_field: Optional[str] = None, event_id: Optional[str] = None):
+        self.provider = provider
+        self._vehicle_id = field(vehicle_id)
+        self._occurred_at = field(occurred_at)
+        self._event_type = field(event_type) if event_type else _none
+        self.event_types = event_types or {}
+        self._temperature = field(temperature) if temperature else _none
+        self._setpoint = field(setpoint) if setpoint else _none
+        self._latitude = field(latitude) if latitude else _none
+        self._longitude = field(longitude) if longitude else _none
+        self._cargo_type = field(cargo_type) if cargo_type else _none
+        self.unit = unit
+        self._unit = field(unit_field) if unit_field else _none
+        self._event_id = field(event_id) if event_id else _none
+
+    def event_type(self, payload: dict) -> Optional[str]:
+        native = _text(self._event_type(payload), "event type")
+        return self.event_types.get(native, native)
+
+    def readings(self, payload: dict, event_type: Optional[str]) -> Tuple[object, object]:
+        return self._temperature(payload), self._setpoint(payload)
+
+    def __call__(self, payload: dict) -> ReeferEvent:
+        vehicle_id = _identifier(self._vehicle_id(payload), "vehicle id")
+        if vehicle_id is None:
+            raise InvalidEvent("missing vehicle id")
+        event_type = self.event_type(payload)
+        unit = _text(self._unit(payload), "temperature unit") or self.unit
+        convert = UNIT_CONVERTERS.get(unit)
+        if convert is None:
+            raise InvalidEvent(f"unknown temperature unit {unit!r}")
+        temperature, setpoint = self.readings(payload, event_type)
+        return ReeferEvent(
+            self.provider,
+            payload,
+            _timestamp(self._occurred_at(payload)),
+            event_type,
+            external_vehicle_id=vehicle_id,
+            cargo_type=_text(self._cargo_type(payload), "cargo_type"),
+            temperature=_temperature(temperature, "temperature", convert),
+            setpoint=_temperature(setpoint, "setpoint", convert),
+            latitude=_coordinate(self._latitude(payload), "latitude", 90),
+            longitude=_coordinate(self._longitude(payload), "longitude", 180),
+            event_id=_identifier(self._event_id(payload)),
+        )
+
+
+class GeotabNormalizer(Normalizer):
+    """Geotab StatusData: one diagnostic per record, its value in `data`."""
+
+    def __init__(self, diagnostics: Dict[str, str], **kwargs):
+        super().__init__("geotab", event_type="diagnostic.id", event_types=diagnostics, unit="C", **kwargs)
+        self._data = field("data")
+
+    def event_type(self, payload: dict) -> Optional[str]:
+        event_type = super().event_type(payload)
+        if event_type == "ignition":
+            data = self._data(payload)
+            if data is None:
+                # Treating a missing value as "off" would close the truck's trip
+                raise InvalidEvent("ignition record without data")
+            return "ignition_on" if data else "ignition_off"
+        return event_type
+
+    def readings(self, payload: dict, event_type: Optional[str]) -> Tuple[object, object]:
+        if event_type == "temperature":
+            return self._data(payload), None
+        if event_type == "setpoint":
+            return None, self._data(payload)
+        return None, None
+
+
+def normalize_flat(provider: str, payload: dict) -> ReeferEvent:
+    """Payloads already mapped to ReeferShield ids (user_id, truck_id, °F readings)."""
+    user_id = _uuid(payload.get("user_id"), "user_id")
+    truck_id = _uuid(payload.get("truck_id"), "truck_id")
+    occurred_at = payload.get("occurred_at")
+    convert = UNIT_CONVERTERS["F"]
+    return ReeferEvent(
+        provider,
+        payload,
+        _timestamp(occurred_at) if occurred_at else datetime.now(timezone.utc).isoformat(),
+        _text(payload.get("event_type"), "event_type"),
+        user_id=user_id,
+        truck_id=truck_id,
+        cargo_type=_text(payload.get("cargo_type"), "cargo_type"),
+        temperature=_temperature(payload.get("temperature"), "temperature", convert),
+        setpoint=_temperature(payload.get("setpoint"), "setpoint", convert),
+        latitude=_coordinate(payload.get("latitude"), "latitude", 90),
+        longitude=_coordinate(payload.get("longitude"), "longitude", 180),
+        event_id=_identifier(payload.get("event_id")),
+    )
+
+
+NORMALIZERS: Dict[str, Normalizer] = {
+    # Webhooks 2.0 envelope; reefer stats are reported in milli-Celsius
+    "samsara": Normalizer(
+        "samsara",
+        vehicle_id="data.vehicle.id",
+        occurred_at="eventTime",
+        event_id="eventId",
+        event_type="eventType",
+        event_types={
+            "ReeferTemperature": "temperature",
+            "ReeferSetPointChanged": "setpoint",
+            "ReeferDoorOpen": "door",
+            "ReeferDefrost": "defrost",
+            "EngineOn": "ignition_on",
+            "EngineOff": "ignition_off",
+            "VehicleLocation": "location",
+        },
+        temperature="data.reeferStats.returnAirTemperatureMilliC",
+        setpoint="data.reeferStats.setPointMilliC",
+        latitude="data.location.latitude",
+        longitude="data.location.longitude",
+        unit="mC",
+    ),
+    # Motive reports in the fleet's configured unit, named on each payload
+    "motive": Normalizer(
+        "motive",
+        vehicle_id="vehicle.id",
+        occurred_at="located_at",
+        event_id="id",
+        event_type="action",
+        event_types={
+            "vehicle_reefer_update": "temperature",
+            "vehicle_reefer_set_point_update": "setpoint",
+            "vehicle_reefer_door_event": "door",
+            "vehicle_reefer_defrost_event": "defrost",
+            "vehicle_ignition_on": "ignition_on",
+            "vehicle_ignition_off": "ignition_off",
+            "vehicle_location_updated": "location",
+        },
+        temperature="reefer.return_air_temp",
+        setpoint="reefer.set_point",
+        latitude="location.lat",
+        longitude="location.lon",
+        unit="F",
+        unit_field="reefer.temperature_unit",
+    ),
+    "geotab": GeotabNormalizer(
+        {
+            "DiagnosticReeferReturnAirTemperatureZone1Id": "temperature",
+            "DiagnosticReeferSetPointZone1Id": "setpoint",
+            "DiagnosticReeferDoorZone1Id": "door",
+            "DiagnosticReeferDefrostZone1Id": "defrost",
+            "DiagnosticIgnitionId": "ignition",
+        },
+        vehicle_id="device.id",
+        occurred_at="dateTime",
+        event_id="id",
+        latitude="latitude",
+        longitude="longitude",
+    ),
+}
+
+
+def normalize(provider: str, payload: dict) -> ReeferEvent:
+    """ReeferEvent for a webhook payload; raises InvalidEvent when it fails validation.
+
+    Payloads that already carry `truck_id` (or come from a provider without a
+    registered normalizer) use the flat ReeferShield shape.
+    """
+    normalizer = NORMALIZERS.get(provider)
+    if normalizer is None or "truck_id" in payload:
+        return normalize_flat(provider, payload)
+    return normalizer(payload)
+
+
+class VehicleIndex:
+    """LRU of (provider, external_vehicle_id) -> (truck_id, user_id).
+
+    Unknown ids are loaded in bulk through `load(provider, ids)`, at most
+    `chunk` per call. Hits live for `ttl` seconds; vehicles with no truck are
+    remembered for `miss_ttl` so a newly registered truck is picked up soon.
+    """
+
+    def __init__(self, load: Callable[[str, List[str]], Awaitable[Dict[str, Tuple[str, str]]]],
+                 ttl: float = 600.0, miss_ttl: float = 60.0, max_size: int = 100000, chunk: int = 200):
+        self._load = load
+        self.ttl = ttl
+        self.miss_ttl = miss_ttl
+        self.max_size = max_size
+        self.chunk = chunk
+        self._entries: "OrderedDict[VehicleKey, Tuple[Optional[Tuple[str, str]], float]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    async def resolve(self, provider: str, external_ids: Iterable[str]) -> Dict[str, Optional[Tuple[str, str]]]:
+        now = time.monotonic()
+        found: Dict[str, Optional[Tuple[str, str]]] = {}
+        missing = []
+        for external_id in set(external_ids):
+            key = (provider, external_id)
+            entry = self._entries.get(key)
+            if entry and now - entry[1] < (self.ttl if entry[0] else self.miss_ttl):
+                self.hits += 1
+                self._entries.move_to_end(key)
+                found[external_id] = entry[0]
+            else:
+                self.misses += 1
+                missing.append(external_id)
+        for i in range(0, len(missing), self.chunk):
+            part = missing[i:i + self.chunk]
+            loaded = await self._load(provider, part)
+            now = time.monotonic()
+            for external_id in part:
+                found[external_id] = loaded.get(external_id)
+                self._entries[(provider, external_id)] = (found[external_id], now)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+        return found
+
+    def invalidate(self, provider: str, external_id: str):
+        self._entries.pop((provider, external_id), None)
+
+    def stats(self) -> dict:
+        return {"vehicles": len(self._entries), "hits": self.hits, "misses": self.misses}
@@ -0,0 +1,127 @@
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Tuple
+
+from excursions import CargoThresholds, parse_ts
+
+# Resolutions kept in temperature_rollups, finest first
+ROLLUP_RESOLUTIONS = (60, 3600)
+
+
+def _bucket(ts: float, resolution: int) -> float:
+    return ts - ts % resolution
+
+
+def _iso(ts: float) -> str:
+    return datetime.fromtimestamp(ts, tz=timezone.utc).isoformat()
+
+
+class RollupAggregator:
+    """Folds ingest batches into per-truck 1-minute and 1-hour partial rollups.
+
+    Each call returns the partial rows for one batch; the database merges
+    them into temperature_rollups (merge_temperature_rollups), so rollups
+    stay correct whichever process ingested which batch. Time out of range
+    credits the gap since a truck's previous reading to that reading's state,
+    capped at `max_gap_s` so an offline truck doesn't accrue hours.
+    """
+
+    def __init__(self, thresholds: Dict[str, CargoThresholds], max_gap_s: float = 600.0):
+        self.thresholds = thresholds
+        self.max_gap_s = max_gap_s
+        self._last: Dict[str, Tuple[float, bool]] = {}
+
+    def aggregate(self, rows: Iterable[dict]) -> List[dict]:
+        readings = []
+        for row in rows:
+            if row.get("temperature") is None:
+                continue
+            readings.append((parse_ts(row["occurred_at"]), row["user_id"], row["truck_id"],
+                             float(row["temperature"]), (row.get("cargo_type") or "").lower()))
+        readings.sort(key=lambda r: (r[2], r[0]))
+
+        acc: Dict[tuple, list] = {}
+        for ts, user_id, truck_id, temp, cargo in readings:
+            th = self.thresholds.get(cargo)
+            out = th is not None and (temp < th.low or temp > th.high)
+            prev = self._last.get(truck_id)
+            if prev and prev[0] > ts:
+                prev = None  # late reading; count it, but don't credit a gap
+            else:
+                self._last[truck_id] = (ts, out)
+            for res in ROLLUP_RESOLUTIONS:
+                key = (user_id, truck_id, res, _bucket(ts, res))
+                agg = acc.get(key)
+                if agg is None:
+                    agg = acc[key] = [None, None, 0.0, 0, 0.0]
+                agg[0] = temp if agg[0] is None else min(agg[0], temp)
+                agg[1] = temp if agg[1] is None else max(agg[1], temp)
+                agg[2] += temp
+                agg[3] += 1
+                if prev and prev[1]:
+                    gap = min(ts - prev[0], self.max_gap_s)
+                    prev_key = (user_id, truck_id, res, _bucket(prev[0], res))
+                    if prev_key == key:
+                        agg[4] += gap
+                    else:
+                        # Previous reading's bucket may only get time, no readings
+                        acc.setdefault(prev_key, [None, None, 0.0, 0, 0.0])[4] += gap
+
+        return [
+            {
+                "user_id": user_id,
+                "truck_id": truck_id,
+                "resolution_s": res,
+                "bucket_start": _iso(bucket),
+                "min_temp": agg[0],
+                "max_temp": agg[1],
+                "sum_temp": agg[2],
+                "count": agg[3],
+                "out_of_range_s": agg[4],
+            }
+            for (user_id, truck_id, res, bucket), agg in acc.items()
+        ]
+
+
+def pick_resolution(requested_s: int) -> int:
+    """Coarsest stored resolution that still divides the requested one."""
+    fitting = [r for r in ROLLUP_RESOLUTIONS if r <= requested_s and requested_s % r == 0]
+    if not fitting:
+        raise ValueError(f"no stored rollup resolution divides {requested_s}s")
+    return fitting[-1]
+
+
+class RollupMerger:
+    """Re-buckets stored rollup rows into `resolution_s` buckets."""
+
+    def __init__(self, resolution_s: int):
+        self.resolution_s = resolution_s
+        self.buckets: Dict[float, list] = {}
+
+    def add(self, rows: Iterable[dict]):
+        for row in rows:
+            if not row["count"] and not row["out_of_range_s"]:
+                continue
+            bucket = _bucket(parse_ts(row["bucket_start"]), self.resolution_s)
+            agg = self.buckets.get(bucket)
+            if agg is None:
+                agg = self.buckets[bucket] = [float("inf"), float("-inf"), 0.0, 0, 0.0]
+            if row["count"]:
+                agg[0] = min(agg[0], float(row["min_temp"]))
+                agg[1] = max(agg[1], float(row["max_temp"]))
+                agg[2] += float(row["sum_temp"])
+                agg[3] += int(row["count"])
+            agg[4] += float(row["out_of_range_s"])
+
+    def result(self) -> List[dict]:
+        out = []
+        for bucket in sorted(self.buckets):
+            mn, mx, total, count, oor = self.buckets[bucket]
+            out.append({
+                "bucket_start": _iso(bucket),
+                "min": mn if count else None,
+                "max": mx if count else None,
+                "mean": total / count if count else None,
+                "count": count,
+                "out_of_range_s": oor,
+            })
+        return out
@@ -0,0 +1,19 @@
+import json
+import os
+import sys
+
+import pytest
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND)
+
+SAMPLES = os.path.join(BACKEND, "benchmarks", "samples")
+
+
+@pytest.fixture
+def sample():
+    """First native payload recorded for a provider, from benchmarks/samples/."""
+    def load(provider: str) -> dict:
+        with open(os.path.join(SAMPLES, f"{provider}.ndjson")) as f:
+            return json.loads(f.readline())
+    return load
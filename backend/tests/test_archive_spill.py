@@ -0,0 +1,77 @@
+import asyncio
+from datetime import datetime, timezone
+
+import pytest
+
+pytest.importorskip("pyarrow")
+
+from archive import ArchiveReader, RawArchive
+
+USER_ID = "u1"
+TRUCK_ID = "t1"
+AT = datetime(2026, 3, 2, 14, 5, tzinfo=timezone.utc)
+
+
+class Outage:
+    """Fails RawArchive._write_table until `up` is set."""
+
+    def __init__(self, archive: RawArchive):
+        self.up = False
+        self.failures = 0
+        self._write_table = archive._write_table
+        archive._write_table = self
+
+    def __call__(self, name, table):
+        if not self.up:
+            self.failures += 1
+            raise OSError("object store unavailable")
+        return self._write_table(name, table)
+
+
+def add(archive: RawArchive, count: int):
+    return [archive.add(USER_ID, TRUCK_ID, AT.isoformat(), "samsara", {"i": i}) for i in range(count)]
+
+
+def test_failed_segment_write_is_retried_until_it_lands(tmp_path):
+    async def run():
+        archive = RawArchive(str(tmp_path / "archive"), segment_rows=3, spill_dir=str(tmp_path / "spill"),
+                             spill_after=2, retry_max_seconds=0.05)
+        outage = Outage(archive)
+        archive.start()
+        refs = add(archive, 3)
+        while outage.failures < 4:
+            await asyncio.sleep(0.01)
+        assert archive.stats()["spilled"] == 1 and archive.unwritten(TRUCK_ID, AT.timestamp() * 2) == 1
+        outage.up = True
+        await archive.stop()
+        return archive, refs
+
+    archive, refs = asyncio.run(run())
+    assert archive.stats()["segments_written"] == 1 and archive.stats()["writing"] == 0
+    assert ArchiveReader(str(tmp_path / "archive")).resolve(refs[2]) == {"i": 2}
+    assert not list((tmp_path / "spill").rglob("*.parquet"))
+
+
+def test_spilled_segment_is_uploaded_on_next_start(tmp_path):
+    async def first_process():
+        archive = RawArchive(str(tmp_path / "archive"), spill_dir=str(tmp_path / "spill"), retry_max_seconds=0.05)
+        Outage(archive)
+        archive.start()
+        refs = add(archive, 5)
+        await archive.stop()
+        return archive, refs
+
+    archive, refs = asyncio.run(first_process())
+    assert archive.stats()["spilled"] == 1 and archive.stats()["segments_written"] == 0
+    assert len(list((tmp_path / "spill").rglob("*.parquet"))) == 1
+
+    async def second_process():
+        archive = RawArchive(str(tmp_path / "archive"), spill_dir=str(tmp_path / "spill"))
+        archive.start()
+        await archive.stop()
+        return archive
+
+    archive = asyncio.run(second_process())
+    assert archive.stats()["segments_written"] == 1
+    assert ArchiveReader(str(tmp_path / "archive")).resolve(refs[4]) == {"i": 4}
+    assert not list((tmp_path / "spill").rglob("*.parquet"))
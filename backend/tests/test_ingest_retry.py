@@ -0,0 +1,91 @@
+import asyncio
+import os
+import sys
+
+os.environ.setdefault("BACKEND_SUPABASE_URL", "http://supabase.test.local")
+os.environ.setdefault("BACKEND_SUPABASE_SERVICE_ROLE_KEY", "test")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks"))
+
+import main
+from fake_supabase import FakeSupabase, FakeQuery
+from ingest import IngestQueue
+from normalizers import normalize
+
+USER_ID = "00000000-0000-0000-0000-000000000001"
+TRUCK_ID = "00000000-0000-0000-0000-000000000002"
+
+
+class CommitThenFailQuery(FakeQuery):
+    async def execute(self):
+        response = await super().execute()
+        if self.table == "reefer_events" and self.action == "upsert" and self.db.failures:
+            self.db.failures -= 1
+            raise TimeoutError("read timed out")
+        return response
+
+
+class CommitThenFail(FakeSupabase):
+    """The first reefer_events upsert is stored, then the client fails as on a read timeout."""
+
+    def __init__(self):
+        super().__init__()
+        self.failures = 1
+
+    def table(self, name: str):
+        return CommitThenFailQuery(self, name)
+
+
+def database_duplicates() -> float:
+    return main.INGEST_DUPLICATES._values.get(("test", "database"), 0)
+
+
+def reading(minute: int, event_type: str) -> dict:
+    return {"user_id": USER_ID, "truck_id": TRUCK_ID, "event_type": event_type, "temperature": 34.0,
+            "occurred_at": f"2026-03-02T14:{minute:02d}:00+00:00", "event_id": f"evt-{minute}"}
+
+
+def test_retry_after_committed_insert_runs_the_rules(monkeypatch):
+    db = CommitThenFail()
+    monkeypatch.setattr(main, "supabase", db)
+    monkeypatch.setattr(main, "raw_archive", None)
+    applied = []
+
+    async def apply_event_rules(row):
+        applied.append(row["event_type"])
+
+    monkeypatch.setattr(main, "apply_event_rules", apply_event_rules)
+    duplicates = database_duplicates()
+
+    async def run():
+        queue = IngestQueue(main.flush_reefer_events, max_delay=0.01)
+        await queue.start()
+        for minute, event_type in ((0, "temperature"), (1, "ignition_off")):
+            queue.put(normalize("test", reading(minute, event_type)))
+        await queue.stop()
+        return queue.stats()
+
+    stats = asyncio.run(run())
+    assert db.failures == 0 and stats["flush_errors"] == 1
+    assert len(db.tables["reefer_events"]) == 2
+    # The retry found its own rows stored: they are new readings, not duplicates
+    assert applied == ["temperature", "ignition_off"]
+    assert database_duplicates() == duplicates
+
+
+def test_rows_stored_elsewhere_are_still_duplicates(monkeypatch):
+    db = FakeSupabase()
+    monkeypatch.setattr(main, "supabase", db)
+    monkeypatch.setattr(main, "raw_archive", None)
+    applied = []
+
+    async def apply_event_rules(row):
+        applied.append(row["event_type"])
+
+    monkeypatch.setattr(main, "apply_event_rules", apply_event_rules)
+
+    async def run():
+        await main.flush_reefer_events([normalize("test", reading(2, "temperature"))])
+        await main.flush_reefer_events([normalize("test", reading(2, "temperature"))])
+
+    asyncio.run(run())
+    assert applied == ["temperature"]
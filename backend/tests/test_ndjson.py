@@ -0,0 +1,41 @@
+import asyncio
+import json
+
+import pytest
+
+from ingest import iter_ndjson
+
+
+async def stream(*chunks: bytes):
+    for chunk in chunks:
+        yield chunk
+
+
+def read(*chunks: bytes, max_line_bytes: int = 64):
+    async def run():
+        return [record async for record in iter_ndjson(stream(*chunks), max_line_bytes=max_line_bytes)]
+    return asyncio.run(run())
+
+
+def line(size: int) -> bytes:
+    record = json.dumps({"pad": ""}).encode()
+    return json.dumps({"pad": "x" * (size - len(record))}).encode()
+
+
+def test_lines_split_across_chunks():
+    body = b'{"a": 1}\n\n{"b": 2}\n[3]\nnot json\n{"c": 3}'
+    assert read(body[:5], body[5:13], body[13:]) == [{"a": 1}, {"b": 2}, {"c": 3}]
+
+
+def test_line_at_the_limit_is_accepted():
+    assert read(line(64) + b"\n" + line(64)) == [{"pad": "x" * 53}] * 2
+
+
+def test_oversized_complete_line_in_one_chunk_is_rejected():
+    with pytest.raises(ValueError, match="exceeds 64 bytes"):
+        read(b'{"a": 1}\n' + line(65) + b'\n{"b": 2}\n')
+
+
+def test_oversized_partial_line_is_rejected():
+    with pytest.raises(ValueError, match="exceeds 64 bytes"):
+        read(b'{"a": 1}\n' + line(65)[:40], line(65)[40:])
@@ -0,0 +1,55 @@
+import pytest
+
+from normalizers import InvalidEvent, normalize
+
+
+@pytest.mark.parametrize("provider, path", [
+    ("samsara", ("eventType",)),
+    ("geotab", ("diagnostic", "id")),
+])
+@pytest.mark.parametrize("value", [["ReeferTemperature"], {"nested": 1}])
+def test_non_scalar_event_type_is_invalid(sample, provider, path, value):
+    payload = sample(provider)
+    payload_field(payload, path, value)
+    with pytest.raises(InvalidEvent, match="event type"):
+        normalize(provider, payload)
+
+
+@pytest.mark.parametrize("value", [{"unit": "F"}, ["F"]])
+def test_non_scalar_temperature_unit_is_invalid(sample, value):
+    payload = sample("motive")
+    payload["reefer"]["temperature_unit"] = value
+    with pytest.raises(InvalidEvent, match="temperature unit"):
+        normalize("motive", payload)
+
+
+@pytest.mark.parametrize("provider, path", [
+    ("samsara", ("data", "vehicle", "id")),
+    ("motive", ("vehicle", "id")),
+    ("geotab", ("device", "id")),
+])
+@pytest.mark.parametrize("value", [{"nested": 1}, [1], True, 1.5])
+def test_non_scalar_vehicle_id_is_invalid(sample, provider, path, value):
+    payload = sample(provider)
+    payload_field(payload, path, value)
+    with pytest.raises(InvalidEvent, match="vehicle id"):
+        normalize(provider, payload)
+
+
+def test_integer_vehicle_id_is_kept_as_string(sample):
+    event = normalize("motive", sample("motive"))
+    assert event.external_vehicle_id == "104233"
+
+
+def test_geotab_ignition_without_data_is_invalid(sample):
+    payload = sample("geotab")
+    payload["diagnostic"]["id"] = "DiagnosticIgnitionId"
+    del payload["data"]
+    with pytest.raises(InvalidEvent):
+        normalize("geotab", payload)
+
+
+def payload_field(payload: dict, path: tuple, value):
+    for key in path[:-1]:
+        payload = payload[key]
+    payload[path[-1]] = value
@@ -0,0 +1,43 @@
+import asyncio
+import os
+import sys
+
+import pytest
+
+os.environ.setdefault("BACKEND_SUPABASE_URL", "http://supabase.test.local")
+os.environ.setdefault("BACKEND_SUPABASE_SERVICE_ROLE_KEY", "test")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks"))
+
+import httpx
+
+import main
+from fake_supabase import FakeSupabase
+
+USER_ID = "00000000-0000-0000-0000-000000000001"
+TRUCK_ID = "00000000-0000-0000-0000-000000000002"
+
+
+def get_history(resolution: int) -> httpx.Response:
+    async def run():
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.get(f"/trucks/{TRUCK_ID}/temperature", headers={"Authorization": f"Bearer user:{USER_ID}"},
+                                    params={"start": "2026-03-02T00:00:00Z", "end": "2026-03-03T00:00:00Z",
+                                            "resolution": resolution})
+    return asyncio.run(run())
+
+
+@pytest.mark.parametrize("resolution", [30, 90, 5400 + 30, 0, -60])
+def test_resolution_not_a_multiple_of_the_finest_rollup_is_rejected(monkeypatch, resolution):
+    monkeypatch.setattr(main, "supabase", FakeSupabase())
+    resp = get_history(resolution)
+    assert resp.status_code == 400
+    assert "multiple of 60" in resp.json()["detail"]
+
+
+@pytest.mark.parametrize("resolution, source", [(60, 60), (900, 60), (5400, 60), (3600, 3600), (86400, 3600)])
+def test_multiple_of_the_finest_rollup_is_served(monkeypatch, resolution, source):
+    monkeypatch.setattr(main, "supabase", FakeSupabase())
+    resp = get_history(resolution)
+    assert resp.status_code == 200
+    assert resp.json()["source_resolution"] == source
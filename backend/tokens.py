@@ -0,0 +1,185 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+logger = logging.getLogger("reefershield")
+
+TokenKey = Tuple[str, str]  # (user_id, provider)
+
+
+@dataclass
+class OAuthToken:
+    access_token: str
+    refresh_token: Optional[str]
+    expires_at: float
+    scope: Optional[str] = None
+
+    @classmethod
+    def from_row(cls, row: dict) -> "OAuthToken":
+        expires_at = row.get("expires_at")
+        return cls(
+            row["access_token"],
+            row.get("refresh_token"),
+            datetime.fromisoformat(expires_at.replace("Z", "+00:00")).timestamp() if expires_at else 0.0,
+            row.get("scope"),
+        )
+
+    @classmethod
+    def from_grant(cls, tokens: dict, previous: Optional["OAuthToken"] = None) -> "OAuthToken":
+        # Providers that don't rotate refresh tokens omit it from the refresh response
+        return cls(
+            tokens["access_token"],
+            tokens.get("refresh_token") or (previous.refresh_token if previous else None),
+            time.time() + float(tokens.get("expires_in") or 3600),
+            tokens.get("scope") or (previous.scope if previous else None),
+        )
+
+    def to_row(self) -> dict:
+        return {
+            "access_token": self.access_token,
+            "refresh_token": self.refresh_token,
+            "expires_at": datetime.fromtimestamp(self.expires_at, tz=timezone.utc).isoformat(),
+            "scope": self.scope,
+        }
+
+
+class TokenCache:
+    """LRU of telematics OAuth tokens keyed by (user_id, provider).
+
+    Tokens are loaded through `load` on a miss and renewed through `refresh`
+    (then persisted with `save`) once they are within `margin_s` of expiry,
+    either by the background refresher or by `get` itself. Concurrent loads
+    or refreshes of one key share a single call. A miss (no connection) is
+    remembered for `miss_ttl` so recovery storms don't hit the database.
+    """
+
+    def __init__(self, load: Callable[[str, str], Awaitable[Optional[dict]]],
+                 refresh: Callable[[str, str], Awaitable[dict]],
+                 save: Callable[[str, str, OAuthToken], Awaitable[None]],
+                 max_size: int = 1024, margin_s: float = 300.0, interval_s: float = 60.0,
+                 miss_ttl: float = 300.0):
+        self._load = load
+        self._refresh = refresh
+        self._save = save
+        self.max_size = max_size
+        self.margin_s = margin_s
+        self.interval_s = interval_s
+        self.miss_ttl = miss_ttl
+        self._entries: "OrderedDict[TokenKey, Tuple[Optional[OAuthToken], float]]" = OrderedDict()
+        self._loading: Dict[TokenKey, asyncio.Task] = {}
+        self._refreshing: Dict[TokenKey, asyncio.Task] = {}
+        self._task: Optional[asyncio.Task] = None
+        self.hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.refresh_failures = 0
+
+    async def get(self, user_id: str, provider: str) -> Optional[OAuthToken]:
+        key = (user_id, provider)
+        entry = self._entries.get(key)
+        if entry is None or (entry[0] is None and time.monotonic() - entry[1] >= self.miss_ttl):
+            self.misses += 1
+            token = await self._coalesce(self._loading, key, self._do_load)
+        else:
+            self.hits += 1
+            self._entries.move_to_end(key)
+            token = entry[0]
+        if token and token.refresh_token and token.expires_at - time.time() < self.margin_s:
+            try:
+                token = await self.refresh(user_id, provider)
+            except Exception as e:
+                # Still usable until it actually expires
+                logger.error("Token refresh for %s/%s failed: %s", user_id, provider, e)
+                if token.expires_at <= time.time():
+                    raise
+        return token
+
+    def put(self, user_id: str, provider: str, token: OAuthToken):
+        self._set((user_id, provider), token)
+
+    def invalidate(self, user_id: str, provider: str):
+        self._entries.pop((user_id, provider), None)
+
+    async def refresh(self, user_id: str, provider: str) -> OAuthToken:
+        """Renew the token now; callers arriving while a renewal is running share it."""
+        return await self._coalesce(self._refreshing, (user_id, provider), self._do_refresh)
+
+    @staticmethod
+    async def _coalesce(inflight: Dict[TokenKey, asyncio.Task], key: TokenKey, fn):
+        task = inflight.get(key)
+        if task is None:
+            task = inflight[key] = asyncio.create_task(fn(key))
+            task.add_done_callback(lambda t: inflight.pop(key, None))
+        return await asyncio.shield(task)
+
+    async def _do_load(self, key: TokenKey) -> Optional[OAuthToken]:
+        row = await self._load(*key)
+        token = OAuthToken.from_row(row) if row and row.get("access_token") else None
+        self._set(key, token)
+        return token
+
+    async def _do_refresh(self, key: TokenKey) -> OAuthToken:
+        user_id, provider = key
+        entry = self._entries.get(key)
+        current = entry[0] if entry else None
+        if current is None or not current.refresh_token:
+            row = await self._load(user_id, provider)
+            current = OAuthToken.from_row(row) if row and row.get("access_token") else None
+            if current is None or not current.refresh_token:
+                raise RuntimeError(f"No refresh token for {provider} connection")
+        try:
+            token = OAuthToken.from_grant(await self._refresh(provider, current.refresh_token), current)
+        except Exception:
+            self.refresh_failures += 1
+            # Another process may have rotated the refresh token first; take its result
+            row = await self._load(user_id, provider)
+            stored = OAuthToken.from_row(row) if row and row.get("access_token") else None
+            if stored and stored.access_token != current.access_token and stored.expires_at > time.time():
+                self._set(key, stored)
+                return stored
+            raise
+        self.refreshes += 1
+        self._set(key, token)
+        await self._save(user_id, provider, token)
+        return token
+
+    def _set(self, key: TokenKey, token: Optional[OAuthToken]):
+        self._entries[key] = (token, time.monotonic())
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def start(self):
+        self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _loop(self):
+        while True:
+            await asyncio.sleep(self.interval_s)
+            # Renew anything that would expire before the next pass, plus the margin
+            horizon = time.time() + self.margin_s + self.interval_s
+            due = [key for key, (token, _) in self._entries.items()
+                   if token and token.refresh_token and token.expires_at < horizon]
+            for user_id, provider in due:
+                try:
+                    await self.refresh(user_id, provider)
+                except Exception as e:
+                    logger.error("Background token refresh for %s/%s failed: %s", user_id, provider, e)
+
+    def stats(self) -> dict:
+        return {
+            "tokens": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "refreshes": self.refreshes,
+            "refresh_failures": self.refresh_failures,
+        }
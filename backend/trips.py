@@ -0,0 +1,162 @@
+import asyncio
+import logging
+import math
+import time
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+logger = logging.getLogger("reefershield")
+
+EARTH_RADIUS_M = 6371008.8
+
+
+def haversine_m(lat1: float, lng1: float, lat2: float, lng2: float) -> float:
+    phi1 = math.radians(lat1)
+    phi2 = math.radians(lat2)
+    dphi = phi2 - phi1
+    dlmb = math.radians(lng2 - lng1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlmb / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(min(1.0, math.sqrt(a)))
+
+
+def within_geofence(trip: dict, latitude, longitude, radius_m: float) -> bool:
+    receiver_lat = trip.get("receiver_lat")
+    receiver_lng = trip.get("receiver_lng")
+    if None in (receiver_lat, receiver_lng, latitude, longitude):
+        return False
+    return haversine_m(float(receiver_lat), float(receiver_lng), float(latitude), float(longitude)) <= radius_m
+
+
+class OpenTripIndex:
+    """In-memory map of truck_id -> open trip (or None when the truck has none).
+
+    Entries expire after `ttl` seconds and are reloaded through `load`.
+    Every write for a truck bumps its version; a load that started before the
+    bump is discarded so a slow read can't resurrect a trip that was closed.
+    """
+
+    def __init__(self, load: Callable[[str], Awaitable[Optional[dict]]], ttl: float = 300.0):
+        self._load = load
+        self.ttl = ttl
+        self._entries: Dict[str, Tuple[Optional[dict], float]] = {}
+        self._versions: Dict[str, int] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def _bump(self, truck_id: str) -> int:
+        version = self._versions.get(truck_id, 0) + 1
+        self._versions[truck_id] = version
+        return version
+
+    async def get(self, truck_id: str) -> Optional[dict]:
+        entry = self._entries.get(truck_id)
+        if entry and time.monotonic() - entry[1] < self.ttl:
+            self.hits += 1
+            return entry[0]
+        self.misses += 1
+        version = self._versions.get(truck_id, 0)
+        trip = await self._load(truck_id)
+        if self._versions.get(truck_id, 0) == version:
+            self._entries[truck_id] = (trip, time.monotonic())
+        return trip
+
+    def put(self, trip: dict):
+        truck_id = trip["truck_id"]
+        self._bump(truck_id)
+        open_trip = trip if trip.get("status", "open") == "open" else None
+        self._entries[truck_id] = (open_trip, time.monotonic())
+
+    def invalidate(self, truck_id: str):
+        self._bump(truck_id)
+        self._entries.pop(truck_id, None)
+
+    def clear(self):
+        for truck_id in list(self._entries):
+            self.invalidate(truck_id)
+
+    def stats(self) -> dict:
+        return {"trucks": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+def _event_time(occurred_at: str) -> float:
+    return datetime.fromisoformat(occurred_at.replace("Z", "+00:00")).timestamp()
+
+
+class TripCloser:
+    """Holds each trip close for `watermark` seconds after its ignition_off is processed.
+
+    The clock starts at the event's own time if that is later (clock skew),
+    so a provider that delivers its backlog late still gets the full window.
+    Readings that arrive late, on another shard or another API process, still
+    land in the trip before its certificate job is enqueued. A later
+    ignition_on from the same truck cancels the pending close, and the latest
+    ignition_off wins if several arrive. Pending closes are carried out on
+    `stop()`; a crash leaves the trip open until the truck's next stop.
+    """
+
+    def __init__(self, close: Callable[[dict, str], Awaitable[None]], watermark: float = 120.0,
+                 interval: float = 1.0):
+        self._close = close
+        self.watermark = watermark
+        self.interval = interval
+        self._pending: Dict[str, Tuple[dict, str, float]] = {}
+        self._stopping: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self.held = 0
+        self.closed = 0
+        self.cancelled = 0
+
+    async def hold(self, trip: dict, ended_at: str):
+        if self.watermark <= 0:
+            await self._run(trip, ended_at)
+            return
+        pending = self._pending.get(trip["truck_id"])
+        if pending and _event_time(pending[1]) > _event_time(ended_at):
+            return
+        if not pending:
+            self.held += 1
+        due = max(_event_time(ended_at), time.time()) + self.watermark
+        self._pending[trip["truck_id"]] = (trip, ended_at, due)
+
+    def cancel(self, truck_id: str, occurred_at: str):
+        pending = self._pending.get(truck_id)
+        if pending and _event_time(occurred_at) > _event_time(pending[1]):
+            del self._pending[truck_id]
+            self.cancelled += 1
+
+    def start(self):
+        if self._task is None:
+            self._stopping = asyncio.Event()
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task:
+            self._stopping.set()
+            await self._task
+            self._task = None
+        await self.close_due(float("inf"))
+
+    async def close_due(self, now: Optional[float] = None):
+        now = time.time() if now is None else now
+        for truck_id, (trip, ended_at, due) in list(self._pending.items()):
+            if due <= now and self._pending.get(truck_id, (None, None))[1] == ended_at:
+                del self._pending[truck_id]
+                await self._run(trip, ended_at)
+
+    async def _run(self, trip: dict, ended_at: str):
+        try:
+            await self._close(trip, ended_at)
+            self.closed += 1
+        except Exception as e:
+            logger.error("Closing trip %s failed: %s", trip.get("id"), e)
+
+    async def _loop(self):
+        while not self._stopping.is_set():
+            try:
+                await asyncio.wait_for(self._stopping.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            await self.close_due()
+
+    def stats(self) -> dict:
+        return {"pending": len(self._pending), "held": self.held, "closed": self.closed, "cancelled": self.cancelled}
@@ -43,8 +43,10 @@ create table if not exists public.reefer_events (
   setpoint numeric,
   latitude numeric,
   longitude numeric,
-  raw_payload jsonb,
-  occurred_at timestamptz not null
+  raw_payload jsonb, -- null when archived; see raw_ref
+  raw_ref text, -- archive pointer "user_id=.../truck_id=.../day=.../<segment>.parquet#<row>" (RAW_ARCHIVE_URI)
+  occurred_at timestamptz not null,
+  dedup_key text -- same for every delivery of a reading (provider event id, or vehicle/type/time)
 );
 
 create table if not exists public.reefer_trips (
@@ -69,6 +71,9 @@ create table if not exists public.reefer_certificates (
   pdf_url text,
   ipfs_cid text,
   polygon_tx_hash text,
+  merkle_root text, -- root anchored by polygon_tx_hash
+  merkle_proof jsonb, -- sibling hashes from keccak(ipfs_cid) up to merkle_root
+  raw_archive_sha256 text, -- digest of the trip's archived raw payloads, printed on the PDF
   created_at timestamptz default now()
 );
 
@@ -83,6 +88,193 @@ create table if not exists public.recipient_emails (
   created_at timestamptz default now()
 );
 
+-- Keyset pagination over a truck's events: (occurred_at, id) within user/truck
+create index if not exists reefer_events_user_truck_time_idx
+  on public.reefer_events (user_id, truck_id, occurred_at, id);
+
+-- Webhook readings are matched to trucks by the provider's vehicle id
+create index if not exists trucks_provider_external_vehicle_idx
+  on public.trucks (telematics_provider, external_vehicle_id);
+
+-- Per-truck temperature rollups at 1-minute (60) and 1-hour (3600) resolution,
+-- maintained incrementally by the backend as events are ingested
+create table if not exists public.temperature_rollups (
+  user_id uuid references auth.users(id) on delete cascade,
+  truck_id uuid references public.trucks(id) on delete cascade,
+  resolution_s integer not null,
+  bucket_start timestamptz not null,
+  min_temp numeric,
+  max_temp numeric,
+  sum_temp numeric not null default 0,
+  count integer not null default 0,
+  out_of_range_s numeric not null default 0,
+  primary key (user_id, truck_id, resolution_s, bucket_start)
+);
+
+create or replace view public.temperature_rollups_v
+with (security_invoker = true) as
+  select user_id, truck_id, resolution_s, bucket_start, min_temp, max_temp,
+         case when count > 0 then sum_temp / count end as mean_temp,
+         count, out_of_range_s
+    from public.temperature_rollups;
+
+-- Merges partial rollups from one ingest batch; least/greatest ignore nulls,
+-- so time-only partials (count 0) leave min/max untouched
+create or replace function public.merge_temperature_rollups(rollups jsonb)
+returns void
+language sql
+as $$
+  insert into public.temperature_rollups as r
+    (user_id, truck_id, resolution_s, bucket_start, min_temp, max_temp, sum_temp, count, out_of_range_s)
+  select user_id, truck_id, resolution_s, bucket_start, min_temp, max_temp, sum_temp, count, out_of_range_s
+    from jsonb_to_recordset(rollups) as x(
+      user_id uuid, truck_id uuid, resolution_s integer, bucket_start timestamptz,
+      min_temp numeric, max_temp numeric, sum_temp numeric, count integer, out_of_range_s numeric)
+  on conflict (user_id, truck_id, resolution_s, bucket_start) do update set
+    min_temp = least(r.min_temp, excluded.min_temp),
+    max_temp = greatest(r.max_temp, excluded.max_temp),
+    sum_temp = r.sum_temp + excluded.sum_temp,
+    count = r.count + excluded.count,
+    out_of_range_s = r.out_of_range_s + excluded.out_of_range_s;
+$$;
+
+-- Dashboard range queries over trips and certificates
+create index if not exists reefer_trips_user_truck_started_idx
+  on public.reefer_trips (user_id, truck_id, started_at);
+create index if not exists reefer_certificates_user_created_idx
+  on public.reefer_certificates (user_id, created_at);
+
+-- One certificate per trip; issuance upserts on trip_id
+create unique index if not exists reefer_certificates_trip_id_key
+  on public.reefer_certificates (trip_id);
+
+-- Batch anchoring columns on databases created before they were added
+alter table public.reefer_certificates
+  add column if not exists merkle_root text,
+  add column if not exists merkle_proof jsonb;
+
+-- Raw payload archive columns on databases created before they were added
+alter table public.reefer_events
+  add column if not exists raw_ref text;
+alter table public.reefer_certificates
+  add column if not exists raw_archive_sha256 text;
+
+-- Idempotent ingestion: provider retries hit this index (ON CONFLICT DO NOTHING).
+-- Rows stored before the column existed keep a null key and never conflict.
+alter table public.reefer_events
+  add column if not exists dedup_key text;
+create unique index if not exists reefer_events_truck_dedup_idx
+  on public.reefer_events (truck_id, dedup_key);
+
+-- Durable certificate issuance queue, processed by backend/cert_worker.py
+create table if not exists public.certificate_jobs (
+  id uuid primary key default gen_random_uuid(),
+  trip_id uuid not null unique references public.reefer_trips(id) on delete cascade,
+  user_id uuid references auth.users(id) on delete cascade,
+  status text not null default 'pending', -- pending/running/anchoring/done/failed
+  stage text not null default 'upload', -- upload/anchor/pin/store/email/done
+  attempts integer not null default 0, -- attempts at the current stage
+  next_attempt_at timestamptz not null default now(),
+  locked_by text,
+  locked_at timestamptz,
+  last_error text,
+  ipfs_cid text,
+  polygon_tx_hash text,
+  merkle_root text,
+  merkle_proof jsonb,
+  raw_archive_sha256 text,
+  certificate_id uuid references public.reefer_certificates(id),
+  created_at timestamptz default now(),
+  updated_at timestamptz default now()
+);
+
+alter table public.certificate_jobs
+  add column if not exists raw_archive_sha256 text;
+
+create index if not exists certificate_jobs_ready_idx
+  on public.certificate_jobs (next_attempt_at)
+  where status in ('pending', 'running');
+
+-- Hands out one due job per call; running jobs whose lease expired are reclaimed
+create or replace function public.claim_certificate_job(worker text, lease_seconds integer default 600)
+returns setof public.certificate_jobs
+language sql
+as $$
+  update public.certificate_jobs j
+     set status = 'running', locked_by = worker, locked_at = now(), updated_at = now()
+   where j.id = (
+     select id from public.certificate_jobs
+      where (status = 'pending' and next_attempt_at <= now())
+         or (status = 'running' and locked_at < now() - make_interval(secs => lease_seconds))
+      order by next_attempt_at
+      limit 1
+      for update skip locked
+   )
+  returning j.*;
+$$;
+
+-- Jobs waiting for the next batch anchor transaction
+create index if not exists certificate_jobs_anchoring_idx
+  on public.certificate_jobs (next_attempt_at)
+  where status = 'anchoring';
+
+-- Hands the batch anchor loop up to max_jobs due jobs at once
+create or replace function public.claim_anchor_batch(worker text, max_jobs integer default 256, lease_seconds integer default 600)
+returns setof public.certificate_jobs
+language sql
+as $$
+  update public.certificate_jobs j
+     set locked_by = worker, locked_at = now(), updated_at = now()
+   where j.id in (
+     select id from public.certificate_jobs
+      where status = 'anchoring'
+        and next_attempt_at <= now()
+        and (locked_by is null or locked_at < now() - make_interval(secs => lease_seconds))
+      order by next_attempt_at
+      limit max_jobs
+      for update skip locked
+   )
+  returning j.*;
+$$;
+
+-- Daily digest checkpoints, one row per UTC day; a rerun resumes after `cursor`
+create table if not exists public.digest_runs (
+  run_date date primary key,
+  since timestamptz not null, -- certificates created after this are included
+  cursor uuid, -- last profile id whose digest page was fully sent
+  status text not null default 'running', -- running/done
+  users integer not null default 0,
+  emails_failed integer not null default 0,
+  metrics jsonb,
+  started_at timestamptz default now(),
+  finished_at timestamptz
+);
+
+-- One page of digest recipients with their certificates since `since`, keyed by profile id
+create or replace function public.daily_digest_page(
+  since timestamptz, after_user uuid default null, max_users integer default 1000, max_items integer default 200)
+returns table (user_id uuid, email text, total integer, certificates jsonb)
+language sql
+stable
+as $$
+  select p.id, p.email, c.total, c.items
+    from public.profiles p
+    cross join lateral (
+      select count(*)::integer as total,
+             coalesce(jsonb_agg(jsonb_build_object(
+               'truck_id', x.truck_id, 'trip_id', x.trip_id, 'created_at', x.created_at
+             ) order by x.created_at) filter (where x.n <= max_items), '[]'::jsonb) as items
+        from (select r.truck_id, r.trip_id, r.created_at, row_number() over (order by r.created_at) as n
+                from public.reefer_certificates r
+               where r.user_id = p.id and r.created_at >= since) x
+    ) c
+   where p.daily_digest
+     and (after_user is null or p.id > after_user)
+     and c.total > 0
+   order by p.id
+   limit max_users;
+$$;
+
 alter table public.profiles enable row level security;
 alter table public.trucks enable row level security;
 alter table public.telematics_connections enable row level security;
@@ -90,6 +282,9 @@ alter table public.reefer_events enable row level security;
 alter table public.reefer_trips enable row level security;
 alter table public.reefer_certificates enable row level security;
 alter table public.recipient_emails enable row level security;
+alter table public.certificate_jobs enable row level security;
+alter table public.temperature_rollups enable row level security;
+alter table public.digest_runs enable row level security;
 
 -- Basic RLS: users can see their own data
 create policy "Users can manage own profile"
@@ -126,3 +321,11 @@ create policy "Users manage own recipient emails"
   on public.recipient_emails for all
   using (auth.uid() = user_id)
   with check (auth.uid() = user_id);
+
+create policy "Users read own certificate jobs"
+  on public.certificate_jobs for select
+  using (auth.uid() = user_id);
+
+create policy "Users read own temperature rollups"
+  on public.temperature_rollups for select
+  using (auth.uid() = user_id);
@@ -1,11 +1,12 @@
 "use client";
 
-import { useState } from "react";
+import { useEffect, useState } from "react";
 import { Button } from "@/components/ui/button";
 import { Card, CardContent, CardHeader, CardTitle } from "@/components/ui/card";
 import { Badge } from "@/components/ui/badge";
 import { ShieldCheck, Thermometer, Truck, Link2 } from "lucide-react";
 import { BACKEND_BASE_URL } from "@/lib/config";
+import { subscribeLive } from "@/lib/liveUpdates";
 
 const demoTrucks = [
   {
@@ -29,7 +30,19 @@ const demoTrucks = [
 ];
 
 export default function DashboardPage() {
-  const [trucks] = useState(demoTrucks);
+  const [trucks, setTrucks] = useState(demoTrucks);
+
+  // Live readings pushed by the backend (at most one per truck per second), instead of polling Supabase
+  useEffect(
+    () =>
+      subscribeLive((kind, data) => {
+        if (kind !== "reading" || data.temperature == null) return;
+        setTrucks((current) =>
+          current.map((t) => (t.id === data.truck_id ? { ...t, temp: `${Math.round(data.temperature)}°F` } : t))
+        );
+      }),
+    []
+  );
 
   const onConnect = (provider: "samsara" | "motive" | "geotab") => {
     // In production you pass the Supabase user id here
@@ -0,0 +1,57 @@
+import { BACKEND_BASE_URL } from "@/lib/config";
+import { supabaseBrowser } from "@/lib/supabaseClient";
+
+export type LiveEvent =
+  | "reading"
+  | "excursion_started"
+  | "excursion_ended"
+  | "certificate_ready"
+  | "overflow";
+
+// Streams GET /live (Server-Sent Events) with the signed-in user's Supabase token.
+// fetch() instead of EventSource so the token goes in a header, not the URL.
+// Reconnects with a fresh token whenever the stream ends; call the returned function to stop.
+export function subscribeLive(onEvent: (kind: LiveEvent, data: any) => void): () => void {
+  const controller = new AbortController();
+  let retryMs = 1000;
+
+  const run = async () => {
+    while (!controller.signal.aborted) {
+      try {
+        const { data } = await supabaseBrowser.auth.getSession();
+        const token = data.session?.access_token;
+        if (!token) return;
+        const res = await fetch(`${BACKEND_BASE_URL}/live`, {
+          headers: { Authorization: `Bearer ${token}` },
+          signal: controller.signal
+        });
+        if (!res.ok || !res.body) throw new Error(`live stream: ${res.status}`);
+        retryMs = 1000;
+        const reader = res.body.pipeThrough(new TextDecoderStream()).getReader();
+        let buffer = "";
+        for (;;) {
+          const { value, done } = await reader.read();
+          if (done) break;
+          const messages = (buffer + value).split("\n\n");
+          buffer = messages.pop() ?? "";
+          for (const message of messages) {
+            let kind = "";
+            let payload = "";
+            for (const line of message.split("\n")) {
+              if (line.startsWith("event: ")) kind = line.slice(7);
+              else if (line.startsWith("data: ")) payload += line.slice(6);
+            }
+            if (kind && payload) onEvent(kind as LiveEvent, JSON.parse(payload));
+          }
+        }
+      } catch (err) {
+        if (controller.signal.aborted) return;
+        await new Promise((resolve) => setTimeout(resolve, retryMs));
+        retryMs = Math.min(retryMs * 2, 30000);
+      }
+    }
+  };
+
+  run();
+  return () => controller.abort();
+}